@@ -1,21 +1,37 @@
-from lib.dbmanagement.connector.BigQueryConnector import BigQueryConnector
+import os
+from lib.dbmanagement.connector.ConnectorFactory import ConnectorFactory
 from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+from lib.dbmanagement.tablemanagement.SchemaRegistry import SchemaRegistry
 from lib.data.comparer.TableComparer import TableComparer
 from lib.data.ingestor.DataIngestor import DataIngestor
-from flask import Flask, request
+from lib.dbmanagement.transaction.BigquerySessionPool import BigquerySessionPool
+from lib.dbmanagement.transaction.RetryPolicy import RetryPolicy
+from lib.monitoring.QueryStatistics import QueryStatistics
+from lib.runner.IngestionRunner import IngestionRunner
+from flask import Flask, Response, request
 from flask_restx import Resource, Api, fields
 
 project_id = 'my-prj'
 
-bq_client = BigQueryConnector(project_id).get_client()
-ingestor = DataIngestor(bq_client)
+# SCD2_ENGINE=local runs on the sqlite stand-in executor, stored in SCD2_DATABASE_DIR
+engine = os.environ.get('SCD2_ENGINE', 'bigquery')
+if engine == 'local':
+    bq_client = ConnectorFactory.create(engine, database_dir = os.environ.get('SCD2_DATABASE_DIR')).get_client()
+else:
+    bq_client = ConnectorFactory.create(engine, project_id = project_id).get_client()
+session_pool = BigquerySessionPool(bq_client, size = 4, idle_ttl = 600)
+schema_registry = SchemaRegistry(bq_client, ttl = 300)
+# triggers on the same destination abort each other's transactions: the aborted run is retried with backoff
+ingestor = DataIngestor(bq_client, session_pool = session_pool, schema_registry = schema_registry, retry_policy = RetryPolicy())
+# triggers of the same tables within 5 seconds share a run, runs on the same destination are serialized
+runner = IngestionRunner(ingestor, max_workers = 4, max_pending = 100, result_ttl = 3600, coalesce_window = 5)
 app = Flask(__name__)
 
 api = Api()
 api.init_app(
     app,
     title = 'Data Engineer Transformation SCD2',
-    description = 'This is a simple REST API containing one endpoint. This API allows you to trigger Transformation SCD2 on bigquery project my-prj',
+    description = 'This is a simple REST API. This API allows you to trigger Transformation SCD2 on bigquery project my-prj and to scrape its metrics',
     version = '1.0.0',
     validate=False
 )
@@ -24,7 +40,7 @@ api.init_app(
 post_request = api.model('post_request', {
     'src_table': fields.String(required=True, example='transformation_scd2.table_1_partners_input'),
     'dest_table': fields.String(required=True, example='transformation_scd2.table_2_partners_output'),
-    'pkey': fields.String(required=True, example='PartnerID')
+    'pkey': fields.Raw(required=True, example='PartnerID', description='name of the key column, or list of the columns of a composite key')
 })
 
 
@@ -34,22 +50,73 @@ class TriggerTransformation(Resource):
     @api.doc(
             summary = 'Trigger Transformation SCD2 on Bigquery "my-prj" project for source and destination tables specified in parameters',
             responses={
-                200: 'successful operation',
-                405: 'Invalid input'
+                202: 'run queued, the response contains the run id (the id of the queued run of the same tables, if any)',
+                400: 'invalid input: missing field or unknown operation',
+                503: 'too many pending runs'
             }
     )
     @api.expect(post_request)
     def post(self):
-        src_table = api.payload['src_table']
-        dest_table = api.payload['dest_table']
-        pkey = api.payload['pkey']
+        try:
+            src_table = api.payload['src_table']
+            dest_table = api.payload['dest_table']
+            pkey = api.payload['pkey']
+        except (KeyError, TypeError) as error:
+            return {'error': f'Missing field {error}'}, 400
+
+        try:
+            run_id = runner.submit(src_table, dest_table, pkey)
+        except ValueError as error:
+            return {'error': str(error)}, 400
+        except RuntimeError as error:
+            return {'error': str(error)}, 503
+
+        return {'run_id': run_id, 'status': f'/runs/{run_id}'}, 202
+
+
+@api.route('/runs/<string:run_id>')
+class RunStatus(Resource):
+
+    @api.doc(
+            summary = 'Status of a Transformation SCD2 run: phase, row counts and error',
+            responses={
+                200: 'successful operation',
+                404: 'run not found or expired'
+            }
+    )
+    def get(self, run_id):
+        run = runner.get_run(run_id)
+        if not run:
+            return {'error': f'Run {run_id} not found'}, 404
+        return run
+
 
-        result = ingestor.ingest_data(src_table, dest_table, pkey)
+@api.route('/metrics')
+class Metrics(Resource):
 
-        if result:
-            return 405, 'Invalid input'
-        return result
+    @api.doc(
+            summary = 'Statement and run metrics (bytes processed/billed, slot ms, wall and queue time, DML rows) in Prometheus text format',
+            responses={
+                200: 'successful operation'
+            }
+    )
+    def get(self):
+        return Response(QueryStatistics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@api.route('/report/')
+class LastRunReport(Resource):
+
+    @api.doc(
+            summary = 'Statistics report of the last Transformation SCD2 run',
+            responses={
+                200: 'successful operation'
+            }
+    )
+    def get(self):
+        return ingestor.get_last_run_report()
 
 
 if __name__ == "__main__":
+    session_pool.warm_up()
     app.run(debug=True)
\ No newline at end of file
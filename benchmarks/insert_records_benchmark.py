@@ -0,0 +1,67 @@
+""" Throughput benchmark of BigQueryManager.insert_records literal and staged paths on the local client.
+
+Run it from the repository folder:
+
+    python -m benchmarks.insert_records_benchmark --rows 1000 10000 100000
+"""
+import argparse
+import time
+import numpy
+import pandas
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+from lib.dbmanagement.transaction.BigqueryTransaction import BigqueryTransaction
+
+
+def generate_rows(num_rows:int) -> pandas.DataFrame:
+    """ function that generates partner-like rows with tech columns """
+    return pandas.DataFrame({
+        'TechnicalKey': numpy.arange(num_rows, dtype='int64'),
+        'PartnerID': numpy.arange(num_rows, dtype='int64'),
+        'Name': [f"Partner's {i}" for i in range(num_rows)],
+        'Canton': numpy.random.choice(['ZH', 'BE', 'BS', 'GE', None], size=num_rows),
+        'Date_From': '2023-01-01 00:00:00',
+        'Date_To': '9999-01-01 00:00:00',
+        'Is_valid': 'yes'
+    })
+
+
+def run(num_rows:int, staged:bool) -> float:
+    """ function that inserts num_rows rows inside a transaction and returns the throughput in rows/s """
+    client = LocalConnector().get_client()
+    client.create_dataset('benchmark')
+    client.create_dataset('staging')
+    client.query("""
+        create table `benchmark.partners` (
+            TechnicalKey INT64 NOT NULL, PartnerID INT64 NOT NULL, Name STRING, Canton STRING,
+            Date_From DATETIME NOT NULL, Date_To DATETIME NOT NULL, Is_valid STRING NOT NULL
+        )
+    """)
+    rows = generate_rows(num_rows)
+    bq_manager = BigQueryManager(client, staging_threshold = 0 if staged else num_rows, staging_dataset = 'staging')
+    transaction = BigqueryTransaction(bigquery_connection = client)
+
+    try:
+        start = time.perf_counter()
+        job_config = transaction.begin_transaction()
+        bq_manager.insert_records('benchmark.partners', rows, job_config)
+        transaction.commit_transaction()
+        elapsed = time.perf_counter() - start
+    finally:
+        client.close()
+
+    return num_rows / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type = int, nargs = '+', default = [1000, 10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'literal rows/s':>16} {'staged rows/s':>16}")
+    for num_rows in args.rows:
+        print(f"{num_rows:>10} {run(num_rows, staged=False):>16.0f} {run(num_rows, staged=True):>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+""" Throughput benchmark of the client-side TechnicalKey assignment of HashKeyAllocator, with a uniqueness check of the keys.
+
+Run it from the repository folder:
+
+    python -m benchmarks.key_allocator_benchmark --rows 1000000 10000000
+"""
+import argparse
+import time
+import numpy
+import pandas
+from lib.data.technicalkey.HashKeyAllocator import HashKeyAllocator
+
+
+def generate_rows(num_rows:int) -> pandas.DataFrame:
+    """ function that generates num_rows new versions opened on the same day, the first version of their key on this day """
+    return pandas.DataFrame({
+        'PartnerID': numpy.arange(num_rows, dtype='int64'),
+        'Date_From': pandas.Series(['2022-01-01 00:00:00'], dtype='category').repeat(num_rows).reset_index(drop=True),
+        'Version': numpy.zeros(num_rows, dtype='int64')
+    })
+
+
+def run(num_rows:int) -> tuple:
+    """ function that assigns the keys of num_rows rows and returns the throughput in rows/s and the number of duplicated keys """
+    rows = generate_rows(num_rows)
+
+    start = time.perf_counter()
+    keys = HashKeyAllocator().assign_keys('benchmark.partners', rows, 'PartnerID')
+    elapsed = time.perf_counter() - start
+
+    return num_rows / elapsed, int(keys.duplicated().sum())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type = int, nargs = '+', default = [1000000, 10000000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'rows/s':>16} {'duplicated keys':>16}")
+    for num_rows in args.rows:
+        throughput, duplicated_keys = run(num_rows)
+        print(f"{num_rows:>10} {throughput:>16.0f} {duplicated_keys:>16}")
+
+
+if __name__ == "__main__":
+    main()
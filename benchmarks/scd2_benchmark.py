@@ -0,0 +1,299 @@
+""" End-to-end benchmark of the SCD2 ingestion on synthetic partner-like tables, run on the local client.
+
+Every case generates a destination table with --rows valid versions and a source table where a share of the keys
+is changed (--change-rate), deleted (--delete-rate) or new (--insert-rate), then runs one operation of the lib
+(ingest_data, apply_changes or compare_tables) in a separate process and reports:
+
+    throughput (source rows/s), peak RSS of the process, bytes shipped client -> engine (statements, parameters
+    and loaded files) and engine -> client (downloaded dataframes), number and size of the statements,
+    wall time of the traced phases (see Tracer)
+
+The results are saved in a JSON file named after the current commit, so that runs can be compared across commits:
+
+    python -m benchmarks.scd2_benchmark --rows 1000 10000 100000 --columns 5 --width 32
+    python -m benchmarks.scd2_benchmark --rows 100000 --baseline benchmarks/results/<commit>.json
+
+With --baseline the exit code is 1 if the throughput of a case is lower than the baseline by more than --tolerance.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy
+import pandas
+from lib.data.comparer.TableComparer import TableComparer
+from lib.data.ingestor.DataIngestor import DataIngestor
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+from lib.monitoring.Tracer import InMemorySpanExporter, Tracer
+
+DATASET = 'benchmark'
+SOURCE_TABLE = f'{DATASET}.partners_input'
+DESTINATION_TABLE = f'{DATASET}.partners_output'
+PKEY = 'PartnerID'
+OPERATIONS = ('ingest_data', 'apply_changes', 'compare_tables')
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+# phases reported in the results, see the spans recorded by the lib
+PHASES = ('transaction.begin', 'compare_tables', 'to_dataframe', 'materialize_differences', 'invalidate', 'insert', 'transaction.commit')
+
+
+class MeteredJob():
+    """ Class that wraps a query job, counting the bytes of the downloaded dataframes """
+
+    def __init__(self, job, meter:dict) -> None:
+        self.__job = job
+        self.__meter = meter
+
+    def __getattr__(self, name):
+        return getattr(self.__job, name)
+
+    def __count(self, dataframe:pandas.DataFrame) -> pandas.DataFrame:
+        self.__meter['bytes_from_engine'] += int(dataframe.memory_usage(deep = True).sum())
+        return dataframe
+
+    def to_dataframe(self, *args, **kwargs) -> pandas.DataFrame:
+        return self.__count(self.__job.to_dataframe(*args, **kwargs))
+
+    def result(self, *args, **kwargs):
+        rows = self.__job.result(*args, **kwargs)
+        if hasattr(rows, 'to_dataframe_iterable'):
+            to_dataframe_iterable = rows.to_dataframe_iterable
+            rows.to_dataframe_iterable = lambda *a, **k: (self.__count(frame) for frame in to_dataframe_iterable(*a, **k))
+        return rows
+
+
+class MeteredClient():
+    """ Class that wraps a client, counting the statements and the bytes sent to the engine """
+
+    def __init__(self, client) -> None:
+        self.__client = client
+        self.meter = {'bytes_to_engine': 0, 'bytes_from_engine': 0, 'statement_bytes': []}
+
+    def __getattr__(self, name):
+        return getattr(self.__client, name)
+
+    def query(self, query:str, job_config = None, location:str = None):
+        statement_bytes = len(query.encode())
+        self.meter['statement_bytes'].append(statement_bytes)
+        parameters = getattr(job_config, 'query_parameters', None) or []
+        self.meter['bytes_to_engine'] += statement_bytes + sum(
+            len(str(getattr(parameter, 'values', getattr(parameter, 'value', '')))) for parameter in parameters
+        )
+        return MeteredJob(self.__client.query(query, job_config = job_config, location = location), self.meter)
+
+    def load_table_from_file(self, file_obj, destination, job_config = None):
+        self.meter['bytes_to_engine'] += file_obj.getbuffer().nbytes if hasattr(file_obj, 'getbuffer') else 0
+        return self.__client.load_table_from_file(file_obj, destination, job_config = job_config)
+
+
+def generate_tables(client, num_rows:int, columns:int, width:int, rates:dict, chunk_size:int, seed:int) -> dict:
+    """ function that generates destination and source tables chunk by chunk and returns the expected differences """
+    payload = [f'col_{index}' for index in range(columns)]
+    column_defs = ", ".join(f"{column} STRING" for column in payload)
+    client.query(f"create table `{SOURCE_TABLE}` ({PKEY} INT64 NOT NULL, {column_defs})")
+    client.query(f"""
+        create table `{DESTINATION_TABLE}` (
+            TechnicalKey INT64 NOT NULL, {PKEY} INT64 NOT NULL, {column_defs},
+            Date_From DATETIME NOT NULL, Date_To DATETIME NOT NULL, Is_valid STRING NOT NULL
+        )
+    """)
+    bq_manager = BigQueryManager(client, staging_threshold = 0, staging_dataset = f'{DATASET}_staging')
+    random = numpy.random.default_rng(seed)
+    expected = {'changed': 0, 'deleted': 0, 'inserted': 0}
+
+    def payload_frame(keys:numpy.ndarray, prefix:str) -> pandas.DataFrame:
+        key_strings = pandas.Series(keys).astype(str)
+        return pandas.DataFrame({
+            column: (f'{prefix}{index}_' + key_strings).str.pad(width, side = 'right', fillchar = 'x').str.slice(0, width)
+            for index, column in enumerate(payload)
+        })
+
+    for chunk_start in range(0, num_rows, chunk_size):
+        keys = numpy.arange(chunk_start, min(chunk_start + chunk_size, num_rows), dtype = 'int64')
+        draw = random.random(len(keys))
+        deleted = draw < rates['delete']
+        changed = (draw >= rates['delete']) & (draw < rates['delete'] + rates['change'])
+        expected['deleted'] += int(deleted.sum())
+        expected['changed'] += int(changed.sum())
+
+        destination = payload_frame(keys, 'c')
+        destination.insert(0, PKEY, keys)
+        destination.insert(0, 'TechnicalKey', keys)
+        destination['Date_From'] = '2020-01-01 00:00:00'
+        destination['Date_To'] = '9999-01-01 00:00:00'
+        destination['Is_valid'] = 'yes'
+        bq_manager.insert_records(DESTINATION_TABLE, destination)
+
+        source = destination.loc[~deleted, [PKEY] + payload].reset_index(drop = True)
+        source.loc[changed[~deleted], payload[0]] = payload_frame(keys[changed], 'u')[payload[0]].values
+        bq_manager.insert_records(SOURCE_TABLE, source)
+
+    num_inserts = int(num_rows * rates['insert'])
+    for chunk_start in range(0, num_inserts, chunk_size):
+        keys = numpy.arange(num_rows + chunk_start, num_rows + min(chunk_start + chunk_size, num_inserts), dtype = 'int64')
+        source = payload_frame(keys, 'c')
+        source.insert(0, PKEY, keys)
+        bq_manager.insert_records(SOURCE_TABLE, source)
+    expected['inserted'] = num_inserts
+
+    return expected
+
+
+def run_case(case:dict, queue) -> None:
+    """ function that runs a benchmark case, in a separate process so that peak RSS is measured per case """
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as database_dir:
+        client = LocalConnector(database_dir = database_dir).get_client()
+        client.create_dataset(DATASET)
+        client.create_dataset(f'{DATASET}_staging')
+
+        start = time.perf_counter()
+        expected = generate_tables(
+            client, case['rows'], case['columns'], case['width'], case['rates'], case['chunk_size'], case['seed']
+        )
+        setup_s = time.perf_counter() - start
+
+        metered_client = MeteredClient(client)
+        exporter = InMemorySpanExporter()
+        Tracer.configure(exporter)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        try:
+            start = time.perf_counter()
+            if case['operation'] == 'compare_tables':
+                differences = TableComparer(metered_client).compare_tables(SOURCE_TABLE, DESTINATION_TABLE, PKEY)
+                outcome = {'differences': int(len(differences))}
+                del differences
+            else:
+                ingestor = DataIngestor(metered_client, batch_size = case['batch_size'], staging_dataset = f'{DATASET}_staging')
+                getattr(ingestor, case['operation'])(SOURCE_TABLE, DESTINATION_TABLE, PKEY)
+                outcome = {'valid_rows': list(client.query(
+                    f"select count(*) from `{DESTINATION_TABLE}` where Is_valid = 'yes'").result())[0][0]}
+            wall_s = time.perf_counter() - start
+        finally:
+            Tracer.disable()
+            client.close()
+
+    source_rows = case['rows'] - expected['deleted'] + expected['inserted']
+    outcome['expected_differences'] = 2 * expected['changed'] + expected['deleted'] + expected['inserted']
+    outcome['expected_valid_rows'] = source_rows
+    phases_ms = dict()
+    for span in exporter.spans:
+        if span['name'] in PHASES:
+            phases_ms[span['name']] = phases_ms.get(span['name'], 0) + span['duration_ms']
+    statement_bytes = metered_client.meter['statement_bytes']
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss_scale = 1 if sys.platform == 'darwin' else 1024
+
+    queue.put({
+        **{name: value for name, value in case.items() if name not in ('chunk_size', 'seed')},
+        **outcome,
+        'setup_s': setup_s,
+        'wall_s': wall_s,
+        'rows_per_s': source_rows / wall_s if wall_s else None,
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_scale,
+        'setup_peak_rss_bytes': rss_before * rss_scale,
+        'bytes_to_engine': metered_client.meter['bytes_to_engine'],
+        'bytes_from_engine': metered_client.meter['bytes_from_engine'],
+        'statements': len(statement_bytes),
+        'statement_bytes_total': sum(statement_bytes),
+        'statement_bytes_max': max(statement_bytes, default = 0),
+        'phases_ms': phases_ms,
+    })
+
+
+def run(case:dict) -> dict:
+    """ function that runs a case in a spawned process and returns its result """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target = run_case, args = (case, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def current_commit() -> str:
+    """ function that returns the current git commit, None outside a git repository """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results:list, baseline:dict, tolerance:float) -> list:
+    """ function that returns the cases slower than the baseline by more than tolerance """
+    case_key = lambda result: (result['operation'], result['rows'], result['columns'], result['width'])
+    baseline_results = {case_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(case_key(result))
+        if previous and previous['rows_per_s'] and result['rows_per_s'] < previous['rows_per_s'] * (1 - tolerance):
+            regressions.append((result, previous))
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type = int, nargs = '+', default = [1000, 10000, 100000])
+    parser.add_argument('--columns', type = int, default = 3, help = 'number of payload columns')
+    parser.add_argument('--width', type = int, default = 16, help = 'characters of every payload value')
+    parser.add_argument('--change-rate', type = float, default = 0.05)
+    parser.add_argument('--insert-rate', type = float, default = 0.01)
+    parser.add_argument('--delete-rate', type = float, default = 0.01)
+    parser.add_argument('--operations', nargs = '+', choices = OPERATIONS, default = ['ingest_data', 'compare_tables'])
+    parser.add_argument('--batch-size', type = int, default = None, help = 'batch size of ingest_data (streaming ingestion)')
+    parser.add_argument('--chunk-size', type = int, default = 1000000, help = 'rows generated and loaded at once')
+    parser.add_argument('--seed', type = int, default = 42)
+    parser.add_argument('--output', default = None, help = 'results file, default benchmarks/results/<commit>.json')
+    parser.add_argument('--baseline', default = None, help = 'results file of a previous run to compare with')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'accepted throughput loss against the baseline')
+    args = parser.parse_args()
+
+    commit = current_commit()
+    rates = {'change': args.change_rate, 'insert': args.insert_rate, 'delete': args.delete_rate}
+    results = []
+
+    print(f"{'operation':>15} {'rows':>10} {'rows/s':>10} {'peak RSS MB':>12} {'to engine MB':>13} {'from engine MB':>15} {'stmts':>6} {'max stmt KB':>12}")
+    for num_rows in args.rows:
+        for operation in args.operations:
+            result = run({
+                'operation': operation, 'rows': num_rows, 'columns': args.columns, 'width': args.width, 'rates': rates,
+                'batch_size': args.batch_size, 'chunk_size': args.chunk_size, 'seed': args.seed,
+            })
+            results.append(result)
+            print(f"{operation:>15} {num_rows:>10} {result['rows_per_s']:>10.0f} {result['peak_rss_bytes'] / 2**20:>12.1f} "
+                  f"{result['bytes_to_engine'] / 2**20:>13.2f} {result['bytes_from_engine'] / 2**20:>15.2f} "
+                  f"{result['statements']:>6} {result['statement_bytes_max'] / 2**10:>12.1f}")
+
+    report = {
+        'commit': commit,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok = True)
+    with open(output, 'w') as results_file:
+        json.dump(report, results_file, indent = 2)
+    print(f"results saved in {output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for result, previous in regressions:
+            print(f"REGRESSION {result['operation']} {result['rows']} rows: "
+                  f"{result['rows_per_s']:.0f} rows/s against {previous['rows_per_s']:.0f} rows/s")
+        exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
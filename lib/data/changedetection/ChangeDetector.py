@@ -0,0 +1,19 @@
+class ChangeDetector():
+    """
+    Base class of the source change detectors used by DataIngestor.
+    A detector returns a cheap fingerprint of the source table: if it is equal to the fingerprint recorded
+    at the last successful run, the source is unchanged and the run is skipped.
+
+    """
+
+    def source_fingerprint(self, source_table:str) -> str:
+        """ method used to compute the fingerprint of the source table
+
+        Args:
+            source_table (str): name of source table
+
+        Returns:
+            str: fingerprint of the source table, None if it cannot be computed (the run is never skipped)
+
+        """
+        raise NotImplementedError
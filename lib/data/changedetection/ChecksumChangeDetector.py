@@ -0,0 +1,29 @@
+from lib.data.changedetection.ChangeDetector import ChangeDetector
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+
+
+class ChecksumChangeDetector(ChangeDetector):
+    """
+    Class that fingerprints a source table with the number of rows and the XOR of the row fingerprints.
+    It costs one aggregation query scanning the source table (no join, no session).
+
+    Args:
+        bigquery_connection (Client): Bigquery client
+
+    Notes:
+        the XOR of two equal rows cancels out, the number of rows is part of the fingerprint to detect them
+
+    """
+
+    CHECKSUM_STMT = """
+        select CAST(count(*) AS STRING) || '|' || CAST(coalesce(BIT_XOR(FARM_FINGERPRINT(TO_JSON_STRING(src))), 0) AS STRING)
+        from `{source_table}` as src;
+    """
+
+    def __init__(self, bigquery_connection) -> None:
+        self.__bigquery_manager = BigQueryManager(bigquery_connection)
+
+    def source_fingerprint(self, source_table:str) -> str:
+        return list(self.__bigquery_manager.run_query(
+            ChecksumChangeDetector.CHECKSUM_STMT.format(source_table = source_table)
+        ).result())[0][0]
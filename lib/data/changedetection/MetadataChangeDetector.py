@@ -0,0 +1,26 @@
+from lib.data.changedetection.ChangeDetector import ChangeDetector
+
+
+class MetadataChangeDetector(ChangeDetector):
+    """
+    Class that fingerprints a source table with its metadata: last modification time and number of rows.
+    It costs a metadata call and no query.
+
+    Args:
+        bigquery_connection (Client): Bigquery client
+
+    Notes:
+        views and external tables have no reliable modification time: ChecksumChangeDetector should be used instead.
+        The fingerprint is None if the table has no modification time
+
+    """
+
+    def __init__(self, bigquery_connection) -> None:
+        self.__client = bigquery_connection
+
+    def source_fingerprint(self, source_table:str) -> str:
+        table = self.__client.get_table(source_table)
+        modified = getattr(table, 'modified', None)
+        if modified is None:
+            return None
+        return f"{modified.isoformat()}|{table.num_rows}"
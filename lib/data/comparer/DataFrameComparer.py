@@ -0,0 +1,186 @@
+import logging
+import numpy
+import pandas
+from lib.data.comparer.TableComparer import TableComparer
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+from lib.dbmanagement.connector.BigQueryConnector import BigQueryConnector
+from lib.monitoring.Tracer import Tracer
+from pandas import DataFrame
+from pandas.util import hash_pandas_object
+
+
+class DataFrameComparer():
+    """
+    Class that implements comparation between a source DataFrame (or a Parquet/CSV file) and the valid versions
+    of a destination table on Google Bigquery, in memory: rows are hashed with pandas vectorized hashing
+    and matched on the hashes, without uploading the source.
+    Schema for source and destination should be the same, except for tech fields in destination table.
+
+    Args:
+        bigquery_connection (BigQueryConnector): Bigquery connection from BigQueryConnector.
+        fingerprint_column (str, optional): name of the destination column storing the row fingerprint (see TableComparer).
+            It is excluded from the comparison and returned as NULL for the new versions. Default None
+
+    """
+
+    VALID_VERSIONS_STMT = """
+        select * except({excluded_columns})
+        from `{dest_table}`
+        where {valid_versions_filter}
+    """
+
+    TECH_COLUMNS = ['TechnicalKey', 'Date_From', 'Date_To', 'Is_valid']
+
+    def __init__(self,
+                 bigquery_connection:BigQueryConnector,
+                 fingerprint_column:str = None
+                ) -> None:
+        self.__bigquery_manager = BigQueryManager(bigquery_connection)
+        self.__fingerprint_column = fingerprint_column
+        self.__logger = logging.getLogger()
+
+    @staticmethod
+    def read_source(source) -> DataFrame:
+        """ method that returns the source rows from a DataFrame or from a Parquet or CSV file
+
+        Args:
+            source (DataFrame | str): DataFrame, or path of a .parquet or .csv file
+
+        Returns:
+            pandas.DataFrame: the source rows
+
+        """
+        if isinstance(source, DataFrame):
+            return source
+        if str(source).lower().endswith('.parquet'):
+            return pandas.read_parquet(source)
+        if str(source).lower().endswith('.csv'):
+            return pandas.read_csv(source)
+        raise ValueError(f'Unsupported source {source}, expected a DataFrame, a .parquet or a .csv file')
+
+    @staticmethod
+    def __align_types(source:DataFrame, destination:DataFrame) -> DataFrame:
+        """ private method that casts the source columns to the destination types, so that equal values have equal hashes """
+        missing_columns = set(destination.columns) ^ set(source.columns)
+        if missing_columns:
+            raise ValueError(f"Source and destination columns differ: {', '.join(sorted(missing_columns))}")
+
+        source = source[list(destination.columns)]
+        casts = {
+            column: destination[column].dtype
+            for column in destination.columns
+            if source[column].dtype != destination[column].dtype and not destination[column].empty
+        }
+        return source.astype(casts) if casts else source
+
+    @staticmethod
+    def row_hashes(rows:DataFrame) -> numpy.ndarray:
+        """ method that returns the 64 bits hash of every row, computed column by column with vectorized hashing
+
+        Args:
+            rows (DataFrame): rows to hash
+
+        Returns:
+            numpy.ndarray: uint64 hashes aligned to rows
+
+        """
+        return hash_pandas_object(rows, index = False, categorize = False).to_numpy()
+
+    @staticmethod
+    def __members(codes:numpy.ndarray, num_codes:int) -> numpy.ndarray:
+        """ private method that returns, for every code, True if it is in codes """
+        members = numpy.zeros(num_codes, dtype = bool)
+        members[codes] = True
+        return members
+
+    @staticmethod
+    def __first_occurrences(codes:numpy.ndarray, num_codes:int) -> numpy.ndarray:
+        """ private method that returns, for every position of codes, True if it is the first occurrence of its code """
+        positions = numpy.arange(len(codes))
+        first_position = numpy.empty(num_codes, dtype = positions.dtype)
+        # with repeated indices the last assignment wins: positions are assigned in reverse order
+        first_position[codes[::-1]] = positions[::-1]
+        return first_position[codes] == positions
+
+    @staticmethod
+    def compare_dataframes(source:DataFrame, destination:DataFrame) -> DataFrame:
+        """ method used to check differences between source rows and destination valid versions,
+            with the same result of TableComparer.DIFF_STMT
+
+        Args:
+            source (DataFrame): source rows
+            destination (DataFrame): valid versions of destination table, without tech columns
+
+        Returns:
+            pandas.DataFrame: pandas.DataFrame containing the new or updated rows (operation 1)
+                and the deleted rows (operation 2), in destination column order
+
+        Notes:
+            rows are equal if all their columns are equal (NULLs included), duplicated rows are returned once
+
+        """
+        source = DataFrameComparer.__align_types(source, destination)
+        source_hashes = DataFrameComparer.row_hashes(source)
+        destination_hashes = DataFrameComparer.row_hashes(destination)
+
+        # both sides are coded on one hash table, membership and first occurrence are then array lookups
+        codes, uniques = pandas.factorize(numpy.concatenate([source_hashes, destination_hashes]))
+        source_codes, destination_codes = codes[:len(source_hashes)], codes[len(source_hashes):]
+
+        # except distinct: first occurrence of the rows whose hash is not on the other side
+        rows_to_update = ~DataFrameComparer.__members(destination_codes, len(uniques))[source_codes] \
+            & DataFrameComparer.__first_occurrences(source_codes, len(uniques))
+        rows_to_delete = ~DataFrameComparer.__members(source_codes, len(uniques))[destination_codes] \
+            & DataFrameComparer.__first_occurrences(destination_codes, len(uniques))
+
+        return pandas.concat([
+            source[rows_to_update].assign(operation = 1),
+            destination[rows_to_delete].assign(operation = 2)
+        ], ignore_index = True)
+
+    def compare_tables(self, source, dest_table:str, pkey = None) -> DataFrame:
+        """ method used to check differences between a source DataFrame or file and the valid versions of a destination table,
+            with the same contract of TableComparer.compare_tables
+
+        Args:
+            source (DataFrame | str): source rows, or path of a .parquet or .csv file
+            dest_table (str): name of destination table
+            pkey (str | list, optional): name of primary (or surrogate) key, or list of the columns of a composite key,
+                they must be columns of the source
+
+        Returns:
+            pandas.DataFrame: pandas.DataFrame containing the new or updated rows
+
+        Notes:
+            the dataframe will contains all fields from source/destination table and a column 'operation'
+            where value 1 means new or updated rows (to insert in the destination table)
+            and value 2 means deleted rows (to invalidate in the destination table).
+            In fingerprint mode the dataframe contains also the fingerprint column, NULL for every row:
+            DataIngestor.ingest_dataframe computes it in the insert of the new versions
+
+        """
+        try:
+            source_rows = DataFrameComparer.read_source(source)
+            missing_keys = [column for column in BigQueryManager.key_columns(pkey) if column not in source_rows.columns] if pkey else []
+            if missing_keys:
+                raise ValueError(f"Primary key {', '.join(missing_keys)} is not a column of the source")
+
+            with Tracer.span('compare_tables', source_table = source if isinstance(source, str) else 'dataframe', destination_table = dest_table) as span:
+                valid_versions_stmt = DataFrameComparer.VALID_VERSIONS_STMT.format(
+                    excluded_columns = ", ".join(DataFrameComparer.TECH_COLUMNS + ([self.__fingerprint_column] if self.__fingerprint_column else [])),
+                    dest_table = dest_table,
+                    valid_versions_filter = TableComparer.VALID_VERSIONS_FILTER
+                )
+                with Tracer.span('to_dataframe'):
+                    destination_rows = self.__bigquery_manager.run_query(valid_versions_stmt).to_dataframe()
+
+                differences = DataFrameComparer.compare_dataframes(source_rows, destination_rows)
+                span.set(rows = len(differences), source_rows = len(source_rows), destination_rows = len(destination_rows))
+
+            if self.__fingerprint_column:
+                differences.insert(len(differences.columns) - 1, self.__fingerprint_column, None)
+            return differences
+
+        except Exception as e:
+            self.__logger.error(f'Error comparing data between {source if isinstance(source, str) else "dataframe"} and {dest_table} with error {str(e)}')
+            raise e
@@ -1,7 +1,13 @@
 import logging
+import pandas
+import pyarrow
 from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
 from lib.dbmanagement.connector.BigQueryConnector import BigQueryConnector
+from lib.dbmanagement.tablemanagement.SchemaRegistry import SchemaRegistry
+from lib.monitoring.Tracer import Tracer
+from google.cloud.bigquery import QueryJobConfig
 from pandas import DataFrame
+from typing import Iterator
 
 
 
@@ -13,18 +19,38 @@ class TableComparer():
 
     Args:
         bigquery_connection (BigQueryConnector): Bigquery connection from BigQueryConnector.
+        fingerprint_column (str, optional): name of the destination column storing the row fingerprint of each version.
+            If set, tables are compared on primary key and fingerprint instead of whole rows. Default None
+        watermark_column (str, optional): name of the source column storing the last modification of each row.
+            If set, incremental comparisons read only the source rows changed between two watermarks. Default None
+        time_travel (bool, optional): if True, incremental comparisons read the source rows changed between two timestamps
+            with time travel (FOR SYSTEM_TIME AS OF) instead of watermark_column. A previous timestamp out of the
+            time travel window (TIME_TRAVEL_WINDOW) cannot be read: the whole tables are compared. Default False
+        schema_registry (SchemaRegistry, optional): cache of the table schemas. If set, the difference query selects
+            explicit column lists instead of `*` and `* except(...)`. Default None
+        dtypes (dict, optional): if set, the differences are downloaded as Arrow and converted to compact dtypes
+            (see to_typed_dataframe) instead of object columns; the dict overrides the dtype of some columns,
+            e.g. {'Canton': 'category'} for low-cardinality strings. An empty dict uses the default mapping. Default None
 
     """
 
+    # valid versions are open-ended (Date_To 9999-01-01 or 9999-12-31): the Date_To predicate is redundant but, on destination
+    # tables partitioned by Date_To (see BigQueryManager.create_scd2_table), prunes every dated partition of history,
+    # leaving the __UNPARTITIONED__ partition where the dates beyond the partition range (the valid versions) are stored
+    VALID_VERSIONS_FILTER = "Is_valid = 'yes' and Date_To >= DATETIME '9999-01-01 00:00:00'"
+
+    # business columns of the destination versions, when the column list is not known
+    DEST_COLUMNS = "* except(TechnicalKey, Date_From, Date_To, Is_valid)"
+
     DIFF_STMT = """
         with src_table as (
-            select *
-            from `{src_table}`
+            select {src_columns}
+            from {src_relation}{src_filter}
         ),
         dest_table as (
-            select * except(TechnicalKey, Date_From, Date_To, Is_valid)
-            from `{dest_table}`
-            where Is_valid = 'yes'
+            select {dest_columns}
+            from `{dest_table}` as dest
+            where {valid_versions_filter}{dest_filter}
         ),
         rows_to_update as (
             select *
@@ -47,19 +73,381 @@ class TableComparer():
         from rows_to_delete;
     """
 
+    FINGERPRINT_DIFF_STMT = """
+        with src_table as (
+            select {src_columns}, FARM_FINGERPRINT(TO_JSON_STRING(src)) as {fingerprint_column}
+            from {src_relation} as src{src_filter}
+        ),
+        dest_table as (
+            select {dest_columns}
+            from `{dest_table}` as dest
+            where {valid_versions_filter}{dest_filter}
+        ),
+        src_keys as (
+            select {pkey_columns}, {fingerprint_column}
+            from src_table
+        ),
+        dest_keys as (
+            select {pkey_columns}, {fingerprint_column}
+            from dest_table
+        ),
+        rows_to_update as (
+            select *
+            from src_table
+            where not exists (
+                select 1
+                from dest_keys
+                where {dest_keys_join}
+                and dest_keys.{fingerprint_column} = src_table.{fingerprint_column}
+            )
+        ),
+        rows_to_delete as (
+            select *
+            from dest_table
+            where not exists (
+                select 1
+                from src_keys
+                where {src_keys_join}
+                and src_keys.{fingerprint_column} = dest_table.{fingerprint_column}
+            )
+        )
+        select *, 1 as operation # new/updated
+        from rows_to_update
+        union all
+        select *, 2 as operation # deleted
+        from rows_to_delete;
+    """
+
+    # fingerprint of a row computed from its business columns: listed in source order, the same as TO_JSON_STRING(src)
+    FINGERPRINT_EXPRESSION = "FARM_FINGERPRINT(TO_JSON_STRING(STRUCT({columns})))"
+
+    ADD_FINGERPRINT_STMT = """
+        alter table `{dest_table}` add column if not exists {fingerprint_column} INT64;
+
+        update `{dest_table}` as dest
+        set {fingerprint_column} = FARM_FINGERPRINT(TO_JSON_STRING((
+            select as struct dest.* except(TechnicalKey, Date_From, Date_To, Is_valid, {fingerprint_column})
+        )))
+        where {valid_versions_filter} and {fingerprint_column} is null;
+    """
+
+    # source rows changed between previous and current watermark
+    WATERMARK_SOURCE_STMT = """(
+            select *
+            from `{src_table}`
+            where {watermark_column} > CAST(@previous_watermark AS {watermark_type})
+            and {watermark_column} <= CAST(@current_watermark AS {watermark_type})
+        )"""
+
+    TIME_TRAVEL_SOURCE_STMT = """(
+            select *
+            from `{src_table}` for system_time as of CAST(@current_watermark AS TIMESTAMP)
+            except distinct
+            select *
+            from `{src_table}` for system_time as of CAST(@previous_watermark AS TIMESTAMP)
+        )"""
+
+    # valid versions of the changed keys, and of the keys deleted from the source (key-only anti-join).
+    # not exists instead of not in: a NULL key in the source would make not in false for every version
+    INCREMENTAL_DEST_FILTER = """
+            and (exists (select 1 from {src_relation} as changed_src where {changed_join})
+                or not exists (select 1 from `{src_table}` as current_src{snapshot} where {current_join}))"""
+
+    # time travel window of a dataset (7 days by default, the maximum), less a margin for the run duration
+    TIME_TRAVEL_WINDOW = pandas.Timedelta(days=7) - pandas.Timedelta(hours=1)
+
+    CURRENT_WATERMARK_STMT = """
+        select CAST(max({watermark_column}) AS STRING)
+        from `{src_table}`;
+    """
+
+    CURRENT_TIMESTAMP_STMT = """
+        select CAST(CURRENT_TIMESTAMP() AS STRING);
+    """
+
+    # deleted/updated versions first, so that a streaming consumer invalidates them before inserting new versions
+    ORDERED_DIFF_STMT = """
+        {diff_query}
+        order by operation desc
+    """
+
+    # pandas dtypes of the Arrow types in a typed download: nullable numbers and booleans, Arrow backed strings and dates,
+    # so that no column is stored as python objects. Other types (timestamps, numerics) use the pyarrow default
+    ARROW_DTYPES = {
+        pyarrow.int64(): pandas.Int64Dtype(),
+        pyarrow.float64(): pandas.Float64Dtype(),
+        pyarrow.bool_(): pandas.BooleanDtype(),
+        pyarrow.string(): pandas.StringDtype('pyarrow'),
+        pyarrow.large_string(): pandas.StringDtype('pyarrow'),
+        pyarrow.date32(): pandas.ArrowDtype(pyarrow.date32())
+    }
+
+    PROJECTION_STMT = """
+        select {columns}, operation
+        from ({diff_query})
+    """
+
+    MATERIALIZE_STMT = """
+        create {table_type} `{diff_table}` as
+        {diff_query}
+    """
+
+    # differences of the keys whose valid versions are still the deleted/updated ones (operation 2) of the comparison:
+    # stale keys have been changed since, e.g. by a concurrent run, and a key without operation 2 should still have no valid version
+    VALID_DIFF_STMT = """
+        with diff_versions as (
+            select * except(operation)
+            from `{diff_table}`
+            where operation = 2
+        ),
+        current_versions as (
+            select {dest_columns}
+            from `{dest_table}` as dest
+            where {valid_versions_filter}
+            and exists (select 1 from `{diff_table}` as diff_keys where {diff_keys_join})
+        ),
+        removed_versions as (
+            select *
+            from diff_versions
+            except distinct
+            select *
+            from current_versions
+        ),
+        added_versions as (
+            select *
+            from current_versions
+            except distinct
+            select *
+            from diff_versions
+        ),
+        stale_keys as (
+            select {pkey_columns}
+            from removed_versions
+            union all
+            select {pkey_columns}
+            from added_versions
+        )
+        select *
+        from `{diff_table}` as diff
+        where not exists (select 1 from stale_keys where {stale_keys_join})
+    """
+
+    # bucket of a key: the same key always falls in the same shard, on source and destination
+    SHARD_FILTER = "ABS(MOD(FARM_FINGERPRINT({key_string}), {shards})) = {shard}"
+
     def __init__(self,
-                 bigquery_connection:BigQueryConnector
+                 bigquery_connection:BigQueryConnector,
+                 fingerprint_column:str = None,
+                 watermark_column:str = None,
+                 time_travel:bool = False,
+                 schema_registry:SchemaRegistry = None,
+                 dtypes:dict = None
                 ) -> None:
+        if watermark_column and time_travel:
+            raise ValueError('Incremental comparison uses either watermark_column or time_travel')
         self.__bigquery_manager = BigQueryManager(bigquery_connection)
+        self.__fingerprint_column = fingerprint_column
+        self.__watermark_column = watermark_column
+        self.__time_travel = time_travel
+        self.__schema_registry = schema_registry
+        self.__dtypes = dtypes
         self.__logger = logging.getLogger()
 
-    def compare_tables(self, src_table:str, dest_table:str) -> DataFrame:
+    @property
+    def is_incremental(self) -> bool:
+        return bool(self.__watermark_column or self.__time_travel)
+
+    def current_watermark(self, src_table:str) -> str:
+        """ method used to read the current watermark of the source table: the max of watermark_column,
+            or the current timestamp in time travel mode
+
+        Args:
+            src_table (str): name of source table
+
+        Returns:
+            str: the current watermark, to be stored after a successful run
+
+        """
+        if self.__time_travel:
+            watermark_stmt = TableComparer.CURRENT_TIMESTAMP_STMT
+        elif self.__watermark_column:
+            watermark_stmt = TableComparer.CURRENT_WATERMARK_STMT.format(watermark_column = self.__watermark_column, src_table = src_table)
+        else:
+            raise ValueError('Watermark column or time travel not configured')
+
+        return list(self.__bigquery_manager.run_query(watermark_stmt).result())[0][0]
+
+    @property
+    def is_typed(self) -> bool:
+        return self.__dtypes is not None
+
+    @staticmethod
+    def to_typed_dataframe(arrow_table:pyarrow.Table, dtypes:dict = None) -> DataFrame:
+        """ method that converts an Arrow table to a pandas DataFrame with compact dtypes (see ARROW_DTYPES)
+
+        Args:
+            arrow_table (pyarrow.Table): rows downloaded as Arrow
+            dtypes (dict, optional): dtype of some columns, overriding the default mapping. 'category' columns
+                are dictionary encoded in Arrow, so that the strings are never materialized as python objects
+
+        Returns:
+            pandas.DataFrame: the rows, with the same columns of the Arrow table
+
+        """
+        dtypes = dtypes or dict()
+        for column, dtype in dtypes.items():
+            if dtype == 'category' and column in arrow_table.column_names:
+                position = arrow_table.column_names.index(column)
+                arrow_table = arrow_table.set_column(position, column, arrow_table.column(column).dictionary_encode())
+
+        rows = arrow_table.to_pandas(types_mapper = TableComparer.ARROW_DTYPES.get)
+        casts = {column: dtype for column, dtype in dtypes.items() if dtype != 'category' and column in rows.columns}
+        return rows.astype(casts) if casts else rows
+
+    def __source_relation(self, src_table:str) -> str:
+        """ private method that builds the source relation of the difference query, restricted to the changed rows
+            in incremental mode """
+        if self.__time_travel:
+            return TableComparer.TIME_TRAVEL_SOURCE_STMT.format(src_table = src_table)
+
+        return TableComparer.WATERMARK_SOURCE_STMT.format(
+            src_table = src_table,
+            watermark_column = self.__watermark_column,
+            watermark_type = (self.__schema_registry or self.__bigquery_manager).get_column_types(src_table)[self.__watermark_column]
+        )
+
+    @staticmethod
+    def is_in_time_travel_window(timestamp:str) -> bool:
+        """ method that returns True if the source can still be read with time travel at a timestamp (see TIME_TRAVEL_WINDOW)
+
+        Args:
+            timestamp (str): timestamp, as returned by current_watermark in time travel mode
+
+        Returns:
+            bool: True if the timestamp is more recent than the time travel window
+        """
+        timestamp = pandas.Timestamp(timestamp)
+        timestamp = timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp
+        return timestamp > pandas.Timestamp.now(tz='UTC') - TableComparer.TIME_TRAVEL_WINDOW
+
+    @staticmethod
+    def fingerprint_expression(columns:list) -> str:
+        """ method that returns the SQL expression of the fingerprint of a row from its business columns
+
+        Args:
+            columns (list): business columns, in source order
+
+        Returns:
+            str: SQL expression, equal to the fingerprint computed on the source rows by the comparison
+        """
+        return TableComparer.FINGERPRINT_EXPRESSION.format(columns = ", ".join(columns))
+
+    @staticmethod
+    def shard_filter(pkey:str, shard:tuple) -> str:
+        """ method that returns the predicate selecting the keys of a shard
+
+        Args:
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            shard (tuple): index of the shard (from 0) and number of shards
+
+        Returns:
+            str: SQL predicate on pkey
+
+        """
+        return TableComparer.SHARD_FILTER.format(key_string = BigQueryManager.key_string(pkey), shard = shard[0], shards = shard[1])
+
+    def __difference_query(self, src_table:str, dest_table:str, pkey = None, watermarks:tuple = None, shard:tuple = None) -> tuple:
+        """ private method that builds the SQL statement returning the differences between source and destination tables
+
+        Args:
+            src_table (str): name of source table
+            dest_table (str): name of destination table
+            pkey (str | list, optional): name of primary (or surrogate) key, or list of the columns of a composite key,
+                required in fingerprint, incremental and sharded mode
+            watermarks (tuple, optional): previous and current watermark. If set (and previous watermark is not None),
+                only the source rows changed between the two watermarks are compared
+            shard (tuple, optional): index of the shard and number of shards. If set, only the keys of the shard are compared
+
+        Returns:
+            tuple: the SQL statement and its query parameters
+
+        """
+        src_relation, dest_filter, query_parameters = f"`{src_table}`", "", None
+
+        if watermarks and watermarks[0] is not None:
+            if not self.is_incremental:
+                raise ValueError('Watermark column or time travel not configured')
+            if not pkey:
+                raise ValueError('Primary key is required to compare tables incrementally')
+            if self.__time_travel and not TableComparer.is_in_time_travel_window(watermarks[0]):
+                self.__logger.warning(f'Previous run of {src_table} at {watermarks[0]} is out of the time travel window, the whole tables are compared')
+                watermarks = None
+
+        if watermarks and watermarks[0] is not None:
+            src_relation = self.__source_relation(src_table)
+            dest_filter = TableComparer.INCREMENTAL_DEST_FILTER.format(
+                src_relation = src_relation,
+                changed_join = BigQueryManager.key_join(pkey, 'changed_src', 'dest'),
+                src_table = src_table,
+                snapshot = " for system_time as of CAST(@current_watermark AS TIMESTAMP)" if self.__time_travel else "",
+                current_join = BigQueryManager.key_join(pkey, 'current_src', 'dest')
+            )
+            query_parameters = [
+                BigQueryManager.scalar_parameter('previous_watermark', watermarks[0]),
+                BigQueryManager.scalar_parameter('current_watermark', watermarks[1])
+            ]
+
+        src_filter = ""
+        if shard:
+            if not pkey:
+                raise ValueError('Primary key is required to compare tables by shard')
+            src_filter = f"\n            where {TableComparer.shard_filter(pkey, shard)}"
+            dest_filter += f"\n            and {TableComparer.shard_filter(pkey, shard)}"
+
+        columns = self.__schema_registry.get_columns(src_table) if self.__schema_registry else None
+
+        if not self.__fingerprint_column:
+            return TableComparer.DIFF_STMT.format(
+                src_columns = ", ".join(columns) if columns else "*",
+                dest_columns = ", ".join(columns) if columns else TableComparer.DEST_COLUMNS,
+                valid_versions_filter = TableComparer.VALID_VERSIONS_FILTER,
+                src_relation = src_relation,
+                src_filter = src_filter,
+                dest_table = dest_table,
+                dest_filter = dest_filter
+            ), query_parameters
+
+        if not pkey:
+            raise ValueError('Primary key is required to compare tables on row fingerprint')
+
+        return TableComparer.FINGERPRINT_DIFF_STMT.format(
+            src_columns = ", ".join(f"src.{column}" for column in columns) if columns else "src.*",
+            dest_columns = ", ".join(columns + [self.__fingerprint_column]) if columns else TableComparer.DEST_COLUMNS,
+            valid_versions_filter = TableComparer.VALID_VERSIONS_FILTER,
+            src_relation = src_relation,
+            src_filter = src_filter,
+            dest_table = dest_table,
+            dest_filter = dest_filter,
+            pkey_columns = ", ".join(BigQueryManager.key_columns(pkey)),
+            dest_keys_join = BigQueryManager.key_join(pkey, 'dest_keys', 'src_table'),
+            src_keys_join = BigQueryManager.key_join(pkey, 'src_keys', 'dest_table'),
+            fingerprint_column = self.__fingerprint_column
+        ), query_parameters
+
+    def compare_tables(self, src_table:str, dest_table:str, pkey = None, watermarks:tuple = None, columns:list = None) -> DataFrame:
         """ method used to check differences between source and destination tables on bigquery
             based on SQL statement that returns a pandas DataFrame containing the new, updated and deleted rows
 
         Args:
             src_table (str): name of source table
             dest_table (str): name of destination table
+            pkey (str | list, optional): name of primary (or surrogate) key, or list of the columns of a composite key,
+                required in fingerprint and incremental mode
+            watermarks (tuple, optional): previous and current watermark, to compare only the source rows changed
+                between them (see current_watermark). If None, or the previous watermark is None (or out of the time travel window),
+                whole tables are compared
+            columns (list, optional): columns of the differences to download (operation is always downloaded).
+                If None, all the columns are downloaded
 
         Returns:
             pandas.DataFrame: pandas.DataFrame containing the new or updated rows
@@ -67,18 +455,192 @@ class TableComparer():
         Notes:
             the dataframe will contains all fields from source/destination table and a column 'operation'
             where value 1 means new or updated rows (to insert in the destination table)
-            and value 2 means deleted rows (to invalidate in the destination table)
+            and value 2 means deleted rows (to invalidate in the destination table).
+            In fingerprint mode the dataframe contains also the fingerprint column, to be stored with the new versions.
+            With dtypes set, the dataframe is converted from Arrow with compact dtypes (see to_typed_dataframe)
 
         """
         try:
-            sql_difference_query = TableComparer.DIFF_STMT.format(
-                    src_table = src_table,
-                    dest_table = dest_table
+            sql_difference_query, query_parameters = self.__difference_query(src_table, dest_table, pkey, watermarks)
+            if columns:
+                sql_difference_query = TableComparer.PROJECTION_STMT.format(
+                    columns = ", ".join(columns),
+                    diff_query = sql_difference_query.strip().rstrip(';')
                 )
-            query_job = self.__bigquery_manager.run_query(sql_difference_query)
-            return query_job.to_dataframe()
+            with Tracer.span('compare_tables', source_table = src_table, destination_table = dest_table):
+                query_job = self.__bigquery_manager.run_query(sql_difference_query, query_parameters = query_parameters)
+                with Tracer.span('to_dataframe', typed = self.is_typed) as span:
+                    if self.is_typed:
+                        differences = TableComparer.to_typed_dataframe(query_job.to_arrow(), self.__dtypes)
+                    else:
+                        differences = query_job.to_dataframe()
+                    if Tracer.is_enabled():
+                        span.set(rows = len(differences), bytes = int(differences.memory_usage(deep = True).sum()))
+            return differences
 
         except Exception as e:
             self.__logger.error(f'Error comparing data between {src_table} and {dest_table} tables with error {str(e)}')
             raise e
 
+
+    def compare_tables_in_batches(self,
+                                  src_table:str,
+                                  dest_table:str,
+                                  pkey = None,
+                                  batch_size:int = 10000,
+                                  bqstorage_client = None,
+                                  watermarks:tuple = None
+                                  ) -> Iterator[DataFrame]:
+        """ method used to check differences between source and destination tables on bigquery,
+            returning the differences as an iterator of pandas DataFrames, so that memory is bounded by batch_size
+
+        Args:
+            src_table (str): name of source table
+            dest_table (str): name of destination table
+            pkey (str | list, optional): name of primary (or surrogate) key, or list of the columns of a composite key,
+                required in fingerprint and incremental mode
+            batch_size (int, optional): number of rows of each DataFrame (page size of the result), default 10000
+            bqstorage_client (BigQueryReadClient, optional): client of BigQuery Storage Read API used to download
+                the result as Arrow record batches. If None, the result is downloaded page by page with the REST API
+            watermarks (tuple, optional): previous and current watermark (see compare_tables)
+
+        Returns:
+            Iterator[pandas.DataFrame]: DataFrames with the same layout of compare_tables
+
+        Notes:
+            rows are ordered by operation descending: all deleted/updated versions (operation 2)
+            are returned before the new versions (operation 1).
+            With the Storage Read API the batch size is chosen by the server.
+            With dtypes set, every batch is downloaded as Arrow and converted with compact dtypes (see to_typed_dataframe)
+
+        """
+        try:
+            diff_query, query_parameters = self.__difference_query(src_table, dest_table, pkey, watermarks)
+            sql_difference_query = TableComparer.ORDERED_DIFF_STMT.format(diff_query = diff_query.strip().rstrip(';'))
+            query_job = self.__bigquery_manager.run_query(sql_difference_query, query_parameters = query_parameters)
+            row_iterator = query_job.result(page_size = batch_size)
+            if self.is_typed:
+                for record_batch in row_iterator.to_arrow_iterable(bqstorage_client = bqstorage_client):
+                    yield TableComparer.to_typed_dataframe(pyarrow.Table.from_batches([record_batch]), self.__dtypes)
+            else:
+                yield from row_iterator.to_dataframe_iterable(bqstorage_client = bqstorage_client)
+
+        except Exception as e:
+            self.__logger.error(f'Error comparing data between {src_table} and {dest_table} tables with error {str(e)}')
+            raise e
+
+    def materialize_differences(self,
+                                src_table:str,
+                                dest_table:str,
+                                diff_table:str,
+                                job_config:QueryJobConfig,
+                                pkey = None,
+                                watermarks:tuple = None,
+                                shard:tuple = None,
+                                temporary:bool = True
+                                ) -> None:
+        """ method used to store differences between source and destination tables in a session temp table on bigquery,
+            so that the difference never leaves the bigquery engine
+
+        Args:
+            src_table (str): name of source table
+            dest_table (str): name of destination table
+            diff_table (str): name of the temp table that will contain the differences
+            job_config (QueryJobConfig): query job of the session (transaction) where the temp table is created
+            pkey (str | list, optional): name of primary (or surrogate) key, or list of the columns of a composite key,
+                required in fingerprint, incremental and sharded mode
+            watermarks (tuple, optional): previous and current watermark (see compare_tables)
+            shard (tuple, optional): index of the shard and number of shards. If set, only the keys of the shard are compared
+            temporary (bool, optional): if False, diff_table is a regular table, created outside of any session
+                (job_config None) and to be dropped by the caller. Default True
+
+        Notes:
+            the temp table has the same layout of the dataframe returned by compare_tables,
+            and it is dropped by bigquery at the end of the session
+
+        """
+        try:
+            diff_query, query_parameters = self.__difference_query(src_table, dest_table, pkey, watermarks, shard)
+            sql_materialize_query = TableComparer.MATERIALIZE_STMT.format(
+                    table_type = "temp table" if temporary else "table",
+                    diff_table = diff_table,
+                    diff_query = diff_query.strip().rstrip(';')
+                )
+            self.__bigquery_manager.run_query(sql_materialize_query, job_config, query_parameters)
+
+        except Exception as e:
+            self.__logger.error(f'Error materializing differences between {src_table} and {dest_table} tables with error {str(e)}')
+            raise e
+
+    def materialize_valid_differences(self,
+                                      src_table:str,
+                                      dest_table:str,
+                                      diff_table:str,
+                                      valid_diff_table:str,
+                                      job_config:QueryJobConfig,
+                                      pkey
+                                      ) -> None:
+        """ method used to store in a session temp table the differences, materialized outside of the transaction, of the keys
+            whose valid versions in the destination table have not changed since the comparison (see VALID_DIFF_STMT)
+
+        Args:
+            src_table (str): name of source table
+            dest_table (str): name of destination table
+            diff_table (str): name of the table containing the differences (see materialize_differences)
+            valid_diff_table (str): name of the temp table that will contain the differences still valid
+            job_config (QueryJobConfig): query job of the session (transaction) applying the differences
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+
+        Notes:
+            run in the transaction before the differences are applied, so that only the keys still matching the comparison
+            are changed. The stale keys are compared again by the next run
+
+        """
+        columns = self.__schema_registry.get_columns(src_table) if self.__schema_registry else None
+        if columns and self.__fingerprint_column:
+            columns = columns + [self.__fingerprint_column]
+
+        try:
+            valid_diff_query = TableComparer.VALID_DIFF_STMT.format(
+                diff_table = diff_table,
+                dest_columns = ", ".join(columns) if columns else TableComparer.DEST_COLUMNS,
+                dest_table = dest_table,
+                valid_versions_filter = TableComparer.VALID_VERSIONS_FILTER,
+                diff_keys_join = BigQueryManager.key_join(pkey, 'diff_keys', 'dest'),
+                pkey_columns = ", ".join(BigQueryManager.key_columns(pkey)),
+                stale_keys_join = BigQueryManager.key_join(pkey, 'stale_keys', 'diff')
+            )
+            self.__bigquery_manager.run_query(TableComparer.MATERIALIZE_STMT.format(
+                table_type = "temp table",
+                diff_table = valid_diff_table,
+                diff_query = valid_diff_query.strip()
+            ), job_config)
+
+        except Exception as e:
+            self.__logger.error(f'Error validating differences of {dest_table} in {diff_table} with error {str(e)}')
+            raise e
+
+    def add_fingerprint_column(self, dest_table:str) -> None:
+        """ method used to add the fingerprint column to an existing destination table and to compute it for the valid rows
+
+        Args:
+            dest_table (str): name of destination table
+
+        Notes:
+            the fingerprint is computed on the business columns in declaration order,
+            that should be the same order of the source table columns
+
+        """
+        if not self.__fingerprint_column:
+            raise ValueError('Fingerprint column not configured')
+
+        try:
+            self.__bigquery_manager.run_query(TableComparer.ADD_FINGERPRINT_STMT.format(
+                valid_versions_filter = TableComparer.VALID_VERSIONS_FILTER,
+                dest_table = dest_table,
+                fingerprint_column = self.__fingerprint_column
+            ))
+
+        except Exception as e:
+            self.__logger.error(f'Error adding fingerprint column to {dest_table} table with error {str(e)}')
+            raise e
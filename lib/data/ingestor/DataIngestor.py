@@ -1,12 +1,25 @@
+import contextvars
 import logging
-import random
-from datetime import date, datetime, time
+import math
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timezone
+from lib.data.changedetection.ChangeDetector import ChangeDetector
+from lib.data.comparer.DataFrameComparer import DataFrameComparer
 from lib.data.comparer.TableComparer import TableComparer
+from lib.data.state.IngestionStateStore import IngestionStateStore
+from lib.data.technicalkey.HashKeyAllocator import HashKeyAllocator
+from lib.data.technicalkey.KeyAllocator import KeyAllocator
 from lib.dbmanagement.connector.BigQueryConnector import BigQueryConnector
 from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+from lib.dbmanagement.tablemanagement.SchemaRegistry import SchemaRegistry
+from lib.dbmanagement.transaction.BigquerySessionPool import BigquerySessionPool
 from lib.dbmanagement.transaction.BigqueryTransaction import BigqueryTransaction
+from lib.dbmanagement.transaction.RetryPolicy import RetryPolicy
+from lib.monitoring.QueryStatistics import RunReport
+from lib.monitoring.Tracer import Tracer
 from google.cloud.bigquery import QueryJobConfig
-from pandas import DataFrame
+from pandas import DataFrame, Series
 
 
 class DataIngestor():
@@ -16,23 +29,204 @@ class DataIngestor():
 
     Args:
         bigquery_connection (BigQueryConnector): Bigquery connection from BigQueryConnector.
+        fingerprint_column (str, optional): name of the destination column storing the row fingerprint (see TableComparer).
+            The fingerprint column should be the last column of the destination table. Default None
+        staging_threshold (int, optional): number of inserted rows above which records are loaded through a staging table
+            (see BigQueryManager), default 10000
+        staging_dataset (str, optional): dataset of the staging tables, default the dataset of the destination table
+        invalidation_chunk_size (int, optional): max number of keys invalidated by a single update statement, default 100000
+        key_allocator (KeyAllocator, optional): allocator of the TechnicalKey of new versions, default HashKeyAllocator
+            (deterministic hash of pkey, Date_From and the number of versions of the key already opened on Date_From)
+        batch_size (int, optional): if set, ingest_data streams the differences in batches of batch_size rows
+            (see TableComparer.compare_tables_in_batches) instead of downloading them at once. Default None
+        bqstorage_client (BigQueryReadClient, optional): client of BigQuery Storage Read API used to stream the differences
+        state_store (IngestionStateStore, optional): store of the watermark and of the source fingerprint of the last successful run,
+            required in incremental mode and with change detection
+        watermark_column (str, optional): name of the source column storing the last modification of each row.
+            If set, only the source rows changed since the last successful run are compared (see TableComparer). Default None
+        time_travel (bool, optional): if True, the source rows changed since the last successful run are read with time travel.
+            Default False
+        session_pool (BigquerySessionPool, optional): pool of warm sessions used by the transactions. If None, every
+            transaction creates and aborts its own session
+        schema_registry (SchemaRegistry, optional): cache of the table schemas. If set, source and destination schemas
+            are checked before the session is opened, and the statements use explicit column lists. Default None
+        change_detector (ChangeDetector, optional): detector of the source fingerprint: if it is equal to the one recorded
+            at the last successful run, the run is skipped before the session is opened. Default None
+        change_detectors (dict, optional): detectors by source table, overriding change_detector (None disables the detection
+            for a table). Default None
+        dtypes (dict, optional): if set, the differences are downloaded as Arrow with compact dtypes, overridden by column
+            (see TableComparer), e.g. {'Canton': 'category'}. Default None
+        retry_policy (RetryPolicy, optional): policy used to run again ingest_data and apply_changes, from the comparison,
+            when their transaction is aborted by a concurrent one (see BigqueryTransaction.run). Default None
+        shards (int, optional): number of buckets of the pkey hash used by apply_changes to split the comparison and the DML
+            statements (see TableComparer.SHARD_FILTER). Default None (no sharding)
+        rows_per_shard (int, optional): if set (and shards is not), the number of shards is derived from the number of rows
+            of the source table. Default None
+        shard_concurrency (int, optional): max number of shard comparisons running at the same time, default 4
+        run_token_retention_days (int, optional): number of days the token of a committed run is kept in the state store:
+            the tokens are pruned by the runs with a token, so a duplicate submitted later is not detected. Default 30
 
     """
 
+    DATE_FROM_EXPRESSION = "DATETIME(CURRENT_DATE())"
+
+    # number of versions of the key of a diff row already opened on date_from: the versions closed on the same day
+    # end the day before (Date_To set as the invalidation does), the older partitions of Date_To are pruned
+    SAME_DAY_VERSIONS_EXPRESSION = """(
+            select count(*)
+            from `{destination_table}` as same_day
+            where {key_join} and same_day.Date_From = {date_from}
+                and same_day.Date_To >= DATE_SUB(DATE({date_from}), INTERVAL 1 DAY)
+        )"""
+
+    # same day versions of the keys passed in the pkeys array parameter
+    SAME_DAY_VERSIONS_STMT = """
+        select {key_columns}, count(*) as Version
+        from `{destination_table}` as dest{join_relation}
+        where {keys_filter} and dest.Date_From = {date_from}
+            and dest.Date_To >= DATE_SUB(DATE({date_from}), INTERVAL 1 DAY)
+        group by {key_columns}
+    """
+
+    WATERMARK_STATE = "watermark"
+
+    SOURCE_FINGERPRINT_STATE = "source_fingerprint"
+
+    # prefix of the state keys of the committed run tokens
+    RUN_TOKEN_STATE = "run_token"
+
+    INSERT_FROM_DIFF_STMT = """
+        select
+            {technical_key} as TechnicalKey,
+            {columns},
+            {date_from} as Date_From,
+            DATETIME '9999-01-01 00:00:00' as Date_To,
+            'yes' as Is_valid{fingerprint_select}
+        from `{diff_table}` as diff
+        where operation = 1
+    """
+
+    # versions of every key over consecutive snapshots: a version starts when a key appears, reappears after
+    # a missing snapshot or changes, and ends at the snapshot before its next change or disappearance
+    BACKFILL_STMT = """
+        with snapshots as (
+            {snapshot_relation}
+        ),
+        snapshot_dates as (
+            select
+                snapshot_date,
+                row_number() over (order by snapshot_date) as snapshot_index,
+                lead(snapshot_date) over (order by snapshot_date) as next_snapshot_date
+            from (select distinct {snapshot_column} as snapshot_date from snapshots) as dates
+        ),
+        snapshot_rows as (
+            select
+                {columns},
+                snapshot_dates.snapshot_date,
+                snapshot_dates.next_snapshot_date,
+                coalesce(lag(snapshot_dates.snapshot_index) over key_snapshots < snapshot_dates.snapshot_index - 1, true)
+                    {changed_from_previous} as starts_version,
+                coalesce(lead(snapshot_dates.snapshot_index) over key_snapshots > snapshot_dates.snapshot_index + 1, true)
+                    {changed_in_next} as ends_version
+            from snapshots
+            join snapshot_dates on snapshots.{snapshot_column} = snapshot_dates.snapshot_date
+            window key_snapshots as (partition by {pkey} order by snapshot_dates.snapshot_index)
+        ),
+        version_starts as (
+            select
+                {columns},
+                DATETIME(snapshot_date) as Date_From,
+                row_number() over (partition by {pkey} order by snapshot_date) as version_number
+            from snapshot_rows
+            where starts_version
+        ),
+        version_ends as (
+            select
+                {pkey},
+                next_snapshot_date,
+                row_number() over (partition by {pkey} order by snapshot_date) as version_number
+            from snapshot_rows
+            where ends_version
+        ),
+        versions as (
+            select
+                {columns},
+                Date_From,
+                coalesce(DATETIME_SUB(DATETIME(next_snapshot_date), INTERVAL 1 DAY), DATETIME '9999-01-01 00:00:00') as Date_To,
+                case when next_snapshot_date is null then 'yes' else 'no' end as Is_valid
+            from version_starts
+            join version_ends using ({pkey}, version_number)
+        )
+    """
 
     def __init__(self,
-                 bigquery_connection:BigQueryConnector
+                 bigquery_connection:BigQueryConnector,
+                 fingerprint_column:str = None,
+                 staging_threshold:int = 10000,
+                 staging_dataset:str = None,
+                 invalidation_chunk_size:int = 100000,
+                 key_allocator:KeyAllocator = None,
+                 batch_size:int = None,
+                 bqstorage_client = None,
+                 state_store:IngestionStateStore = None,
+                 watermark_column:str = None,
+                 time_travel:bool = False,
+                 session_pool:BigquerySessionPool = None,
+                 schema_registry:SchemaRegistry = None,
+                 change_detector:ChangeDetector = None,
+                 change_detectors:dict = None,
+                 dtypes:dict = None,
+                 retry_policy:RetryPolicy = None,
+                 shards:int = None,
+                 rows_per_shard:int = None,
+                 shard_concurrency:int = 4,
+                 run_token_retention_days:int = 30
             ) -> None:
 
+        if (watermark_column or time_travel) and not state_store:
+            raise ValueError('State store is required in incremental mode')
+        if (change_detector or any((change_detectors or dict()).values())) and not state_store:
+            raise ValueError('State store is required with change detection')
+
         self.__logger = logging.getLogger()
-        self.__bigquery_manager = BigQueryManager(bigquery_connection)
-        self.__comparer = TableComparer(bigquery_connection)
-        self.__bigquery_transaction = BigqueryTransaction(bigquery_connection = bigquery_connection)
+        self.__last_run_report = None
+        self.__state_store = state_store
+        self.__key_allocator = key_allocator or HashKeyAllocator()
+        self.__invalidation_chunk_size = invalidation_chunk_size
+        self.__batch_size = batch_size
+        self.__bqstorage_client = bqstorage_client
+        self.__fingerprint_column = fingerprint_column
+        self.__bigquery_manager = BigQueryManager(
+            bigquery_connection,
+            staging_threshold = staging_threshold,
+            staging_dataset = staging_dataset,
+            schema_registry = schema_registry
+        )
+        self.__comparer = TableComparer(
+            bigquery_connection,
+            fingerprint_column = fingerprint_column,
+            watermark_column = watermark_column,
+            time_travel = time_travel,
+            schema_registry = schema_registry,
+            dtypes = dtypes
+        )
+        self.__dataframe_comparer = DataFrameComparer(bigquery_connection, fingerprint_column = fingerprint_column)
+        self.__bigquery_connection = bigquery_connection
+        self.__session_pool = session_pool
+        self.__schema_registry = schema_registry
+        self.__change_detector = change_detector
+        self.__change_detectors = dict(change_detectors or dict())
+        self.__retry_policy = retry_policy
+        self.__staging_dataset = staging_dataset
+        self.__shards = shards
+        self.__rows_per_shard = rows_per_shard
+        self.__shard_concurrency = shard_concurrency
+        self.__run_token_retention_days = run_token_retention_days
 
 
     def __update_data(self,
                       destination_table:str,
-                      pkey:str,
+                      pkey,
                       data_to_ingest: DataFrame,
                       job_config:QueryJobConfig = None
                       ) -> None:
@@ -41,58 +235,168 @@ class DataIngestor():
 
         Args:
             destination_table (str): name of destination table
-            pkey (str): name of primary (or surrogate) key
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
             data_to_ingest (DataFrame) : dataframe containing new/updated/deleted records
             job_config (QueryJobConfig, optional): query job used for transaction. If None, method runs without transaction
 
 
+        Returns:
+            int: number of invalidated rows
+
         Notes:
             Based on latest version of google-cloud library (3.15.0) (https://cloud.google.com/python/docs/reference/bigquery/latest/google.cloud.bigquery.client.Client)
-            method update_rows does not exist anymore
+            method update_rows does not exist anymore.
+            The keys are passed as an array query parameter, in chunks of invalidation_chunk_size keys
+            running on the same job_config (transaction). The values of a composite key are passed as an array of structs,
+            joined to the destination table
 
         """
         assignments = dict()
         assignments['Is_valid'] = '"no"'
         assignments['Date_To'] = 'DATE_SUB(CURRENT_DATE(), INTERVAL 1 DAY)'
 
-        list_pkeys_involved = str(set(data_to_ingest[pkey])).replace('{','').replace('}','')
-        filter_cond = f"{pkey} in ({list_pkeys_involved})"
+        key_columns = BigQueryManager.key_columns(pkey)
+        if len(key_columns) == 1:
+            filter_cond = f"{TableComparer.VALID_VERSIONS_FILTER} and {key_columns[0]} in unnest(@pkeys)"
+            join_relation = None
+        else:
+            # a composite key is passed as an array of structs and joined on its columns
+            filter_cond = f"{TableComparer.VALID_VERSIONS_FILTER} and {BigQueryManager.key_join(pkey, 'dest', 'invalidated_keys')}"
+            join_relation = "unnest(@pkeys) as invalidated_keys"
+
+        with Tracer.span('invalidate', destination_table = destination_table) as span:
+            if len(key_columns) == 1:
+                pkeys_involved = data_to_ingest[key_columns[0]].dropna().drop_duplicates().tolist()
+            else:
+                pkeys_involved = data_to_ingest[key_columns].dropna().drop_duplicates().to_dict('records')
+            rows_updated = 0
+            for chunk_start in range(0, len(pkeys_involved), self.__invalidation_chunk_size):
+                pkeys_chunk = pkeys_involved[chunk_start:chunk_start + self.__invalidation_chunk_size]
+                rows_updated += self.__bigquery_manager.update_records(
+                    destination_table,
+                    assignments,
+                    filter_cond,
+                    job_config,
+                    query_parameters = [
+                        BigQueryManager.array_parameter('pkeys', pkeys_chunk) if len(key_columns) == 1
+                        else BigQueryManager.struct_array_parameter('pkeys', pkeys_chunk)
+                    ],
+                    join_relation = join_relation
+                ) or 0
+            span.set(keys = len(pkeys_involved), rows = rows_updated)
+
+        return rows_updated
+
+    def __update_data_from_table(self,
+                                 destination_table:str,
+                                 pkey,
+                                 diff_table:str,
+                                 job_config:QueryJobConfig
+                                 ) -> int:
+        """ private method used to invalidate data in destination tables on bigquery based on the
+            differences stored in a session temp table
 
-        return self.__bigquery_manager.update_records(destination_table, assignments, filter_cond, job_config)
+        Args:
+            destination_table (str): name of destination table
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            diff_table (str): name of session temp table containing new/updated/deleted records
+            job_config (QueryJobConfig): query job of the session (transaction) owning the temp table
+
+        Returns:
+            int: number of invalidated rows
+
+        """
+        assignments = dict()
+        assignments['Is_valid'] = '"no"'
+        assignments['Date_To'] = 'DATE_SUB(CURRENT_DATE(), INTERVAL 1 DAY)'
 
-    def __assign_tech_id(self, technical_id_list:list) -> int:
-        """ private method used to generate a new technical id not already stored in table
+        key_columns = BigQueryManager.key_columns(pkey)
+        if len(key_columns) == 1:
+            filter_cond = f"{TableComparer.VALID_VERSIONS_FILTER} and {key_columns[0]} in (select distinct {key_columns[0]} from `{diff_table}`)"
+            join_relation = None
+        else:
+            filter_cond = f"{TableComparer.VALID_VERSIONS_FILTER} and {BigQueryManager.key_join(pkey, 'dest', 'invalidated_keys')}"
+            join_relation = f"(select distinct {', '.join(key_columns)} from `{diff_table}`) as invalidated_keys"
+
+        with Tracer.span('invalidate', destination_table = destination_table) as span:
+            rows_updated = self.__bigquery_manager.update_records(
+                destination_table, assignments, filter_cond, job_config, join_relation = join_relation
+            )
+            span.set(rows = rows_updated)
+        return rows_updated
+
+    def __insert_data_from_table(self,
+                                 destination_table:str,
+                                 pkey,
+                                 diff_table:str,
+                                 job_config:QueryJobConfig
+                                 ) -> int:
+        """ private method used to insert new versions in destination tables on bigquery based on the
+            differences stored in a session temp table
 
         Args:
-            technical_id_list (list): list of technical id stored in destination table
+            destination_table (str): name of destination table
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            diff_table (str): name of session temp table containing new/updated/deleted records
+            job_config (QueryJobConfig): query job of the session (transaction) owning the temp table
 
         Returns:
-            int: new technical id
-        """
+            int: number of inserted rows
+
+        Notes:
+            CAREFUL: without schema registry, columns added in positional order as declaration
 
-        x = random.randint(100000,999999)
-        cnt = 0
-        threshold = 10
-        while x in technical_id_list:
-            print(x, "in",technical_id_list)
-            x = random.randint(1,4)
-            if cnt > threshold:
-                raise Exception("Error generating new Technical ID")
-            cnt += 1
-        return x
+        """
+        tech_columns = SchemaRegistry.TECH_COLUMNS + ([self.__fingerprint_column] if self.__fingerprint_column else [])
+        business_columns, insert_columns = None, None
+        if self.__schema_registry:
+            business_columns = [column for column in self.__schema_registry.get_columns(destination_table) if column not in tech_columns]
+            insert_columns = ['TechnicalKey'] + business_columns + tech_columns[1:]
+
+        count_rows = lambda: list(self.__bigquery_manager.run_query(
+            f"select count(*) from `{diff_table}` where operation = 1", job_config
+        ).result())[0][0]
+
+        version_expression = DataIngestor.SAME_DAY_VERSIONS_EXPRESSION.format(
+            destination_table = destination_table,
+            key_join = BigQueryManager.key_join(pkey, 'same_day', 'diff'),
+            date_from = DataIngestor.DATE_FROM_EXPRESSION
+        ) if self.__key_allocator.derived_keys else "0"
+
+        select_stmt = DataIngestor.INSERT_FROM_DIFF_STMT.format(
+            technical_key = self.__key_allocator.key_expression(
+                destination_table, pkey, DataIngestor.DATE_FROM_EXPRESSION, count_rows, version_expression
+            ),
+            date_from = DataIngestor.DATE_FROM_EXPRESSION,
+            diff_table = diff_table,
+            columns = ", ".join(business_columns) if business_columns else "* except({})".format(
+                ", ".join(filter(None, ['operation', self.__fingerprint_column]))
+            ),
+            fingerprint_select = f",\n            {self.__fingerprint_column}" if self.__fingerprint_column else ""
+        )
+
+        with Tracer.span('insert', destination_table = destination_table) as span:
+            rows_inserted = self.__bigquery_manager.insert_from_query(destination_table, select_stmt, job_config, insert_columns)
+            span.set(rows = rows_inserted)
+        return rows_inserted
 
     def __insert_data(self,
                       destination_table: str,
+                      pkey,
                       data_to_ingest: DataFrame,
-                      job_config: QueryJobConfig = None
+                      job_config: QueryJobConfig = None,
+                      compute_fingerprint: bool = False
                       ) -> None:
         """ private method used to insert new data in destination tables on bigquery based on previously checked
             compared data between source and destination table
 
         Args:
             destination_table (str): name of destination table
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
             data_to_ingest (DataFrame) : dataframe containing new/updated/deleted record
             job_config (QueryJobConfig, optional): query job used for transaction. If None, method runs without transaction
+            compute_fingerprint (bool, optional): in fingerprint mode, compute the fingerprint of the new versions in the insert
+                instead of copying the one of data_to_ingest, default False
 
 
         Returns:
@@ -105,24 +409,330 @@ class DataIngestor():
 
         """
 
-        query_job = self.__bigquery_manager.run_query("select distinct TechnicalKey from transformation_scd2.table_2_partners_output")
-        technical_id_list = query_job.to_dataframe()
+        with Tracer.span('insert', destination_table = destination_table) as span:
+            rows_to_insert = data_to_ingest[data_to_ingest['operation']== 1].drop(columns=['operation'])
+            # UTC date, the one of CURRENT_DATE() used by the invalidation
+            rows_to_insert['Date_From'] = datetime.combine(datetime.now(timezone.utc).date(), time.min).strftime("%Y-%m-%d %H:%M:%S")
+            with Tracer.span('assign_keys', rows = len(rows_to_insert)):
+                if self.__key_allocator.derived_keys:
+                    rows_to_insert['Version'] = self.__same_day_versions(destination_table, pkey, rows_to_insert, job_config)
+                technical_keys = self.__key_allocator.assign_keys(destination_table, rows_to_insert, pkey)
+                rows_to_insert = rows_to_insert.drop(columns=['Version'], errors='ignore')
+            rows_to_insert.insert(loc=0, column='TechnicalKey', value=technical_keys)
+            rows_to_insert['Date_To'] = datetime(9999,1,1,0,0,0).strftime("%Y-%m-%d %H:%M:%S")
+            rows_to_insert['Is_valid'] = 'yes'
+            computed_columns = None
+            if self.__fingerprint_column:
+                # fingerprint column is stored after the tech columns
+                fingerprints = rows_to_insert.pop(self.__fingerprint_column)
+                if compute_fingerprint:
+                    # computed on the values cast to the destination types, as the comparison does on the source table
+                    business_columns = [column for column in rows_to_insert.columns if column not in SchemaRegistry.TECH_COLUMNS]
+                    computed_columns = {self.__fingerprint_column: TableComparer.fingerprint_expression(business_columns)}
+                else:
+                    rows_to_insert[self.__fingerprint_column] = fingerprints
+
+            rows_inserted = self.__bigquery_manager.insert_records(destination_table, rows_to_insert, job_config, computed_columns)
+            span.set(rows = rows_inserted)
+        return rows_inserted
+
+    def __same_day_versions(self, destination_table:str, pkey, rows:DataFrame, job_config:QueryJobConfig) -> Series:
+        """ private method that returns, for every row, the number of versions of its key already opened on its Date_From
+            (see SAME_DAY_VERSIONS_STMT). The keys are passed as an array query parameter, in chunks of invalidation_chunk_size keys
+
+        Args:
+            destination_table (str): name of destination table
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            rows (DataFrame): rows to insert, with one row per key and the same Date_From
+            job_config (QueryJobConfig): query job used for transaction, after the invalidation
+
+        Returns:
+            pandas.Series: versions indexed as rows
+
+        """
+        versions = Series(0, index=rows.index, dtype='int64')
+        if rows.empty:
+            return versions
+
+        key_columns = BigQueryManager.key_columns(pkey)
+        if len(key_columns) == 1:
+            keys_filter = f"dest.{key_columns[0]} in unnest(@pkeys)"
+            join_relation = ""
+            pkeys_involved = rows[key_columns[0]].dropna().drop_duplicates().tolist()
+        else:
+            keys_filter = BigQueryManager.key_join(pkey, 'dest', 'inserted_keys')
+            join_relation = ", unnest(@pkeys) as inserted_keys"
+            pkeys_involved = rows[key_columns].dropna().drop_duplicates().to_dict('records')
+        select_stmt = DataIngestor.SAME_DAY_VERSIONS_STMT.format(
+            key_columns = ", ".join(f"dest.{column}" for column in key_columns),
+            destination_table = destination_table,
+            join_relation = join_relation,
+            keys_filter = keys_filter,
+            date_from = f"DATETIME '{rows['Date_From'].iloc[0]}'"
+        )
+
+        same_day_versions = []
+        for chunk_start in range(0, len(pkeys_involved), self.__invalidation_chunk_size):
+            pkeys_chunk = pkeys_involved[chunk_start:chunk_start + self.__invalidation_chunk_size]
+            same_day_versions.extend(tuple(row) for row in self.__bigquery_manager.run_query(
+                select_stmt,
+                job_config,
+                [
+                    BigQueryManager.array_parameter('pkeys', pkeys_chunk) if len(key_columns) == 1
+                    else BigQueryManager.struct_array_parameter('pkeys', pkeys_chunk)
+                ]
+            ).result())
+        if not same_day_versions:
+            return versions
+
+        same_day_versions = DataFrame(same_day_versions, columns=key_columns + ['Version'])
+        merged = rows[key_columns].merge(same_day_versions, on=key_columns, how='left')
+        versions[:] = merged['Version'].fillna(0).astype('int64').values
+        return versions
+
+    def __publish_report(self, report:RunReport) -> None:
+        """ private method that stores and logs the statistics report of a run """
+        self.__last_run_report = report.summary()
+        totals = self.__last_run_report['totals']
+        self.__logger.info(
+            f"Run {report.operation} {report.source_table} -> {report.destination_table} {report.status} "
+            f"in {report.wall_ms:.0f} ms, {totals.get('statements', 0)} statements, "
+            f"{totals.get('bytes_processed', 0)} bytes processed, {totals.get('slot_ms', 0)} slot ms"
+        )
+
+    def get_last_run_report(self) -> dict:
+        """ method that returns the statistics report of the last ingest_data/apply_changes run
+
+        Returns:
+            dict: the report (see RunReport.summary), None if no run has been executed
+
+        """
+        return self.__last_run_report
+
+    def __check_schemas(self, source, destination_table:str, excluded_columns:list = None) -> None:
+        """ private method that checks source (table or DataFrame) and destination schemas with the schema registry, if configured """
+        if not self.__schema_registry:
+            return
+        if isinstance(source, DataFrame):
+            self.__schema_registry.check_columns('dataframe', list(source.columns), destination_table, self.__fingerprint_column)
+        else:
+            self.__schema_registry.check_compatibility(source, destination_table, self.__fingerprint_column, excluded_columns)
+
+    def __create_state_table(self, destination_table:str) -> None:
+        """ private method that creates the state table of the destination, if a state store is configured """
+        if self.__state_store:
+            self.__state_store.create_state_table(destination_table)
+
+    def __read_source_fingerprint(self, source_table:str, destination_table:str) -> tuple:
+        """ private method that returns the current fingerprint of the source table and True if it is equal to the one
+            recorded at the last successful run, (None, False) if change detection is not configured for the table """
+        change_detector = self.__change_detectors.get(source_table, self.__change_detector)
+        if not change_detector:
+            return None, False
+
+        with Tracer.span('source_fingerprint', source_table = source_table):
+            source_fingerprint = change_detector.source_fingerprint(source_table)
+            previous_fingerprint = self.__state_store.get_state(source_table, destination_table, DataIngestor.SOURCE_FINGERPRINT_STATE)
+
+        unchanged = source_fingerprint is not None and source_fingerprint == previous_fingerprint
+        if unchanged:
+            self.__logger.info(f'Source {source_table} unchanged since the last run on {destination_table} ({source_fingerprint})')
+        return source_fingerprint, unchanged
+
+    def __write_source_fingerprint(self, source_table:str, destination_table:str, source_fingerprint:str, job_config:QueryJobConfig) -> None:
+        """ private method that stores the source fingerprint inside the transaction, so that it is recorded only on commit """
+        if source_fingerprint is not None:
+            self.__state_store.set_state(source_table, destination_table, DataIngestor.SOURCE_FINGERPRINT_STATE, source_fingerprint, job_config)
+
+    def __shard_count(self, source_table:str) -> int:
+        """ private method that returns the number of shards of a run, from the configuration or from the source size """
+        if self.__shards:
+            return self.__shards
+        if self.__rows_per_shard:
+            num_rows = self.__bigquery_connection.get_table(source_table).num_rows or 0
+            return max(1, math.ceil(num_rows / self.__rows_per_shard))
+        return 1
+
+    def __apply_shards(self,
+                       source_table:str,
+                       destination_table:str,
+                       pkey,
+                       shards:int,
+                       job_config:QueryJobConfig,
+                       watermarks:tuple,
+                       report:RunReport
+                       ) -> tuple:
+        """ private method used to apply the differences shard by shard, so that every job shuffles 1/shards of the keys
+
+        Returns:
+            tuple: number of invalidated and inserted rows
+
+        Notes:
+            the statements of a session run one at a time: the shard comparisons run concurrently (up to shard_concurrency)
+            outside the transaction, reading the tables and writing staging tables, while the DML statements of every shard
+            run inside the transaction, so the run stays all-or-nothing. The staging tables are always dropped.
+            A concurrent run may change the destination between the comparison and the transaction: inside the transaction,
+            only the keys whose valid versions still match the comparison are applied, from a session temp table
+            (see TableComparer.materialize_valid_differences), the stale keys are left to the next run. A change committed after the validation
+            conflicts with the DML statements of the transaction, which is aborted: correctness then relies on the
+            RetryPolicy (retry_policy) running the whole unit of work again, comparison included
+
+        """
+        staging_dataset = self.__staging_dataset or destination_table.rsplit('.', 1)[0]
+        run_id = uuid.uuid4().hex
+        diff_tables = [f'{staging_dataset}.scd2_diff_{run_id}_{shard}' for shard in range(shards)]
+
+        def materialize(shard:int) -> None:
+            with Tracer.span('materialize_differences', source_table = source_table, destination_table = destination_table, shard = shard):
+                self.__comparer.materialize_differences(
+                    source_table, destination_table, diff_tables[shard], None, pkey, watermarks, (shard, shards), temporary = False
+                )
 
-        rows_to_insert = data_to_ingest[data_to_ingest['operation']== 1].drop(columns=['operation'])
-        # CAREFUL: columns added in positional order as declaration
-        rows_to_insert.insert(loc=0, column='TechnicalKey', value=self.__assign_tech_id(technical_id_list))
-        #rows_to_insert['TechnicalKey'] = rows_to_insert.apply(lambda x : self.__assign_tech_id(technical_id_list), axis=1)
-        rows_to_insert['Date_From'] = datetime.combine(date.today(), time.min).strftime("%Y-%m-%d %H:%M:%S")
-        rows_to_insert['Date_To'] = datetime(9999,1,1,0,0,0).strftime("%Y-%m-%d %H:%M:%S")
-        rows_to_insert['Is_valid'] = 'yes'
+        rows_updated, rows_inserted = 0, 0
+        try:
+            report.set_phase('comparing', shards = shards)
+            with ThreadPoolExecutor(max_workers = min(self.__shard_concurrency, shards), thread_name_prefix = 'scd2_shard') as executor:
+                # every job runs in a copy of the context, so that its statements and spans belong to the run
+                futures = [executor.submit(contextvars.copy_context().run, materialize, shard) for shard in range(shards)]
+                for future in futures:
+                    future.result()
+
+            for shard, diff_table in enumerate(diff_tables):
+                with Tracer.span('shard', shard = shard):
+                    report.set_phase('invalidating', shards_applied = shard)
+                    valid_diff_table = f'scd2_valid_diff_{run_id}_{shard}'
+                    self.__comparer.materialize_valid_differences(
+                        source_table, destination_table, diff_table, valid_diff_table, job_config, pkey
+                    )
+                    rows_updated += self.__update_data_from_table(destination_table, pkey, valid_diff_table, job_config) or 0
+                    report.set_phase('inserting', rows_updated = rows_updated)
+                    rows_inserted += self.__insert_data_from_table(destination_table, pkey, valid_diff_table, job_config) or 0
+                    report.set_phase('inserting', rows_inserted = rows_inserted)
+                    self.__bigquery_manager.drop_table(valid_diff_table, job_config)
+            report.set_phase('committing', shards_applied = shards)
+        finally:
+            for diff_table in diff_tables:
+                self.__bigquery_manager.drop_table(diff_table)
+
+        return rows_updated, rows_inserted
+
+    def __new_transaction(self) -> BigqueryTransaction:
+        """ private method that returns a new transaction, one per call so that the ingestor can be shared by concurrent runs """
+        return BigqueryTransaction(
+            bigquery_connection = self.__bigquery_connection,
+            session_pool = self.__session_pool,
+            retry_policy = self.__retry_policy
+        )
+
+    @staticmethod
+    def __on_retry(report:RunReport):
+        """ private method that returns the retry callback of a run: the counts of the aborted attempt are discarded """
+        def on_retry(attempt:int, error:Exception) -> None:
+            report.counts.clear()
+            report.set_phase('retrying', attempts = attempt + 1)
+        return on_retry
+
+    def __is_committed_run(self, source_table:str, destination_table:str, run_token:str, job_config:QueryJobConfig) -> bool:
+        """ private method that returns True if a run with the same token has already committed, read inside the transaction
+            so that a concurrent duplicate conflicts on the state table and sees the token when it is retried """
+        if not run_token:
+            return False
+        committed_at = self.__state_store.get_state(
+            source_table, destination_table, f'{DataIngestor.RUN_TOKEN_STATE}:{run_token}', job_config
+        )
+        if committed_at:
+            self.__logger.info(f'Run {run_token} of {source_table} -> {destination_table} already committed at {committed_at}')
+        return bool(committed_at)
+
+    def __write_run_token(self, source_table:str, destination_table:str, run_token:str, job_config:QueryJobConfig) -> None:
+        """ private method that records the run token inside the transaction, so that it is recorded only on commit,
+            and deletes in the same transaction the tokens older than run_token_retention_days """
+        if run_token:
+            self.__state_store.delete_expired_states(
+                source_table, destination_table, f'{DataIngestor.RUN_TOKEN_STATE}:', self.__run_token_retention_days, job_config
+            )
+            self.__state_store.set_state(
+                source_table, destination_table, f'{DataIngestor.RUN_TOKEN_STATE}:{run_token}',
+                datetime.now().isoformat(sep = ' '), job_config
+            )
+
+    def __read_watermarks(self, source_table:str, destination_table:str) -> tuple:
+        """ private method that returns the watermark of the last successful run and the current watermark
+            of the source table, None if the ingestion is not incremental """
+        if not self.__comparer.is_incremental:
+            return None
+
+        previous_watermark = self.__state_store.get_state(source_table, destination_table, DataIngestor.WATERMARK_STATE)
+        current_watermark = self.__comparer.current_watermark(source_table)
+        self.__logger.info(f'Incremental run of {source_table} -> {destination_table} from {previous_watermark} to {current_watermark}')
+
+        return previous_watermark, current_watermark
+
+    def __write_watermark(self, source_table:str, destination_table:str, watermarks:tuple, job_config:QueryJobConfig) -> None:
+        """ private method that stores the current watermark inside the transaction, so that it advances only on commit """
+        if watermarks:
+            self.__state_store.set_state(source_table, destination_table, DataIngestor.WATERMARK_STATE, watermarks[1], job_config)
+
+    def __ingest_batches(self,
+                         source_table:str,
+                         destination_table:str,
+                         pkey,
+                         job_config:QueryJobConfig,
+                         watermarks:tuple = None
+                         ) -> tuple:
+        """ private method used to invalidate and insert data batch by batch, while the differences are streamed
+            from TableComparer.compare_tables_in_batches, so that only one batch is kept in memory
 
-        return self.__bigquery_manager.insert_records(destination_table, rows_to_insert, job_config)
+        Args:
+            source_table (str): name of source table
+            destination_table (str): name of destination table
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            job_config (QueryJobConfig): query job used for transaction
+            watermarks (tuple, optional): previous and current watermark in incremental mode
 
+        Returns:
+            tuple: number of invalidated and inserted rows
+
+        Notes:
+            the differences are ordered by operation, so every deleted/updated version (operation 2) is invalidated
+            before the new versions are inserted, and only the keys of operation 2 rows are invalidated:
+            a new version inserted by a previous batch is never invalidated by a following one
+
+        """
+        rows_updated, rows_inserted = 0, 0
+        for data_to_ingest in self.__comparer.compare_tables_in_batches(
+                source_table, destination_table, pkey, self.__batch_size, self.__bqstorage_client, watermarks):
+            with Tracer.span('batch', rows = len(data_to_ingest)):
+                rows_updated += self.__update_data(destination_table, pkey, data_to_ingest[data_to_ingest['operation'] == 2], job_config)
+                if not data_to_ingest[data_to_ingest['operation'] == 1].empty:
+                    rows_inserted += self.__insert_data(destination_table, pkey, data_to_ingest, job_config) or 0
+
+        return rows_updated, rows_inserted
+
+
+    def __ingest_differences(self,
+                             destination_table:str,
+                             pkey,
+                             data_to_ingest:DataFrame,
+                             job_config:QueryJobConfig,
+                             report:RunReport,
+                             compute_fingerprint:bool = False
+                             ) -> None:
+        """ private method used to invalidate and insert the differences returned by a comparer inside the transaction """
+        report.set_phase('invalidating', rows_compared = len(data_to_ingest))
+        if not data_to_ingest.empty:
+            rows_updated  = self.__update_data(destination_table, pkey, data_to_ingest, job_config)
+            report.set_phase('inserting', rows_updated = rows_updated)
+        if not data_to_ingest[data_to_ingest['operation'] == 1].empty:
+            rows_inserted = self.__insert_data(destination_table, pkey, data_to_ingest, job_config, compute_fingerprint)
+            report.set_phase('committing', rows_inserted = rows_inserted)
 
     def ingest_data(self,
                     source_table:str,
                     destination_table:str,
-                    pkey:str) -> int:
+                    pkey,
+                    progress = None,
+                    run_token:str = None) -> int:
 
         """ method used to insert or update  data in destination tables on bigquery based on previously checked
             compared data between source and destination table
@@ -130,29 +740,259 @@ class DataIngestor():
         Args:
             source_table (str): name of destination table
             destination_table (str): name of destination table
-            pkey (str): name of primary (or surrogate) key
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            progress (callable, optional): function called with the RunReport at every phase change
+            run_token (str, optional): idempotency token of the run, recorded in the state store at commit:
+                a run with the token of a committed run does nothing. Default None
 
         Notes:
             the dataframe will contains all fields from source/destination table and a column 'operation'
             where value 1 means new or updated rows (to insert in the destination table)
-            and value 2 means deleted rows (to invalidate in the destination table)
+            and value 2 means deleted rows (to invalidate in the destination table).
+            In incremental mode only the source rows changed since the last successful run are compared,
+            and the new watermark is stored in the same transaction.
+            With a retry policy, a run aborted by a concurrent transaction is run again from the comparison
 
         """
-        try:
-            job_config = self.__bigquery_transaction.begin_transaction()
+        if run_token and not self.__state_store:
+            raise ValueError('State store is required with a run token')
+
+        with Tracer.span('ingest_data', source_table = source_table, destination_table = destination_table), \
+                RunReport(source_table, destination_table, 'ingest_data', on_close = self.__publish_report, on_phase = progress) as report:
+            # schema drift is detected and the state table is created before the session is opened
+            self.__check_schemas(source_table, destination_table)
+            self.__create_state_table(destination_table)
+            # the fingerprint is read before the diff: a change made in the meantime is detected by the next run
+            source_fingerprint, unchanged = self.__read_source_fingerprint(source_table, destination_table)
+            if unchanged:
+                report.set_phase('unchanged', rows_updated = 0, rows_inserted = 0)
+                return 0
+
+            def ingest(job_config:QueryJobConfig) -> None:
+                if self.__is_committed_run(source_table, destination_table, run_token, job_config):
+                    report.set_phase('duplicate', rows_updated = 0, rows_inserted = 0)
+                    return
+
+                watermarks = self.__read_watermarks(source_table, destination_table)
+                if self.__batch_size:
+                    report.set_phase('streaming')
+                    rows_updated, rows_inserted = self.__ingest_batches(source_table, destination_table, pkey, job_config, watermarks)
+                    report.set_phase('committing', rows_updated = rows_updated, rows_inserted = rows_inserted)
+                else:
+                    report.set_phase('comparing')
+                    data_to_ingest = self.__comparer.compare_tables(source_table, destination_table, pkey, watermarks)
+                    self.__ingest_differences(destination_table, pkey, data_to_ingest, job_config, report)
+
+                self.__write_watermark(source_table, destination_table, watermarks, job_config)
+                self.__write_source_fingerprint(source_table, destination_table, source_fingerprint, job_config)
+                self.__write_run_token(source_table, destination_table, run_token, job_config)
+
+            report.set_phase('starting')
+            self.__new_transaction().run(ingest, on_retry = DataIngestor.__on_retry(report))
 
-            data_to_ingest = self.__comparer.compare_tables(source_table, destination_table)
+        return 0
+
+    def ingest_dataframe(self,
+                         source,
+                         destination_table:str,
+                         pkey,
+                         progress = None) -> int:
+
+        """ method used to insert or update data in destination tables on bigquery from a DataFrame or a Parquet/CSV file,
+            compared in memory with the valid versions of the destination table (see DataFrameComparer)
+
+        Args:
+            source (DataFrame | str): source rows, or path of a .parquet or .csv file
+            destination_table (str): name of destination table
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            progress (callable, optional): function called with the RunReport at every phase change
+
+        Notes:
+            the result on the destination table is the same as ingest_data on a source table with the same rows.
+            In fingerprint mode the fingerprint of the new versions is computed by the insert.
+            With a retry policy, a run aborted by a concurrent transaction is run again from the comparison
+
+        """
+        source_name = source if isinstance(source, str) else 'dataframe'
 
-            if not data_to_ingest.empty:
-                rows_updated  = self.__update_data(destination_table, pkey, data_to_ingest, job_config)
-            if not data_to_ingest[data_to_ingest['operation'] == 1].empty:
-                rows_inserted = self.__insert_data(destination_table,data_to_ingest, job_config)
+        with Tracer.span('ingest_dataframe', source_table = source_name, destination_table = destination_table), \
+                RunReport(source_name, destination_table, 'ingest_dataframe', on_close = self.__publish_report, on_phase = progress) as report:
+            # the source is read once, schema drift is detected before the session is opened
+            source_rows = DataFrameComparer.read_source(source)
+            self.__check_schemas(source_rows, destination_table)
 
-            self.__bigquery_transaction.commit_transaction()
+            def ingest(job_config:QueryJobConfig) -> None:
+                report.set_phase('comparing')
+                data_to_ingest = self.__dataframe_comparer.compare_tables(source_rows, destination_table, pkey)
+                self.__ingest_differences(destination_table, pkey, data_to_ingest, job_config, report, compute_fingerprint = True)
 
-        except Exception as error: #rollback
-            self.__bigquery_transaction.rollback_transaction()
-            self.__logger.error(f'Rollback with error: {error}')
-            raise error
+            report.set_phase('starting')
+            self.__new_transaction().run(ingest, on_retry = DataIngestor.__on_retry(report))
 
         return 0
+
+    def backfill(self,
+                 snapshot_tables,
+                 destination_table:str,
+                 pkey,
+                 snapshot_column:str,
+                 progress = None) -> dict:
+
+        """ method used to build the history of an empty destination table from daily snapshots of the source,
+            in a single set-based statement: every version is inserted with the validity of the snapshots where it appears
+
+        Args:
+            snapshot_tables (str | list): name of the snapshot table, or list of snapshot tables with the same schema,
+                containing the source rows and the snapshot date
+            destination_table (str): name of destination table, it must have no rows
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            snapshot_column (str): name of the DATE (or DATETIME) column storing the snapshot date of each row
+            progress (callable, optional): function called with the RunReport at every phase change
+
+        Returns:
+            dict: number of inserted ('rows_inserted') versions
+
+        Notes:
+            a version starts (Date_From) on the first snapshot where a key appears with its values, and ends (Date_To)
+            the day before the snapshot where the key changes or is missing, as a daily ingest_data run would do.
+            Versions still present in the last snapshot are valid. The columns of the snapshots, except snapshot_column,
+            are compared (ARRAY and STRUCT columns on their JSON representation) and inserted by name.
+            In fingerprint mode the fingerprint of the versions is computed by the insert.
+            With a retry policy, a backfill aborted by a concurrent transaction is run again
+
+        """
+        snapshot_tables = [snapshot_tables] if isinstance(snapshot_tables, str) else list(snapshot_tables)
+        # schema drift is detected before the session is opened
+        for snapshot_table in snapshot_tables:
+            self.__check_schemas(snapshot_table, destination_table, [snapshot_column])
+        column_types = self.__bigquery_manager.get_column_types(snapshot_tables[0])
+        columns = [column for column in column_types if column != snapshot_column]
+        compared_columns = [column for column in columns if column not in BigQueryManager.key_columns(pkey)]
+        # ARRAY and STRUCT values are not comparable, their JSON representation is
+        compared = lambda column, value: f"TO_JSON_STRING({value})" if BigQueryManager.is_nested_type(column_types[column]) else value
+
+        versions_stmt = DataIngestor.BACKFILL_STMT.format(
+            snapshot_relation = "\n            union all\n            ".join(
+                f"select {', '.join(columns + [snapshot_column])} from `{table}`" for table in snapshot_tables
+            ),
+            snapshot_column = snapshot_column,
+            pkey = ", ".join(BigQueryManager.key_columns(pkey)),
+            columns = ", ".join(columns),
+            changed_from_previous = "".join(
+                f"\n                    or {compared(column, f'lag({column}) over key_snapshots')} is distinct from {compared(column, column)}"
+                for column in compared_columns
+            ),
+            changed_in_next = "".join(
+                f"\n                    or {compared(column, f'lead({column}) over key_snapshots')} is distinct from {compared(column, column)}"
+                for column in compared_columns
+            )
+        )
+
+        # columns matched by name, the snapshots may declare them in another order than the destination
+        insert_columns = ['TechnicalKey'] + columns + SchemaRegistry.TECH_COLUMNS[1:] + ([self.__fingerprint_column] if self.__fingerprint_column else [])
+        source_name = ", ".join(snapshot_tables)
+
+        with Tracer.span('backfill', source_table = source_name, destination_table = destination_table), \
+                RunReport(source_name, destination_table, 'backfill', on_close = self.__publish_report, on_phase = progress) as report:
+
+            def insert_versions(job_config:QueryJobConfig) -> int:
+                destination_rows = list(self.__bigquery_manager.run_query(
+                    f"select count(*) from `{destination_table}`", job_config).result())[0][0]
+                if destination_rows:
+                    raise ValueError(f'Backfill requires an empty destination table, {destination_table} has {destination_rows} rows')
+
+                report.set_phase('inserting')
+                count_rows = lambda: list(self.__bigquery_manager.run_query(
+                    f"{versions_stmt}\n        select count(*) from versions", job_config
+                ).result())[0][0]
+                # the versions of a key start on different snapshots: version 0 of their Date_From in the empty destination
+                select_stmt = "{versions_stmt}\n        select {technical_key} as TechnicalKey, * {fingerprint_select}from versions".format(
+                    versions_stmt = versions_stmt,
+                    technical_key = self.__key_allocator.key_expression(destination_table, pkey, 'Date_From', count_rows),
+                    fingerprint_select = (
+                        f", {TableComparer.fingerprint_expression(columns)} as {self.__fingerprint_column} " if self.__fingerprint_column else ""
+                    )
+                )
+                with Tracer.span('insert', destination_table = destination_table) as span:
+                    rows_inserted = self.__bigquery_manager.insert_from_query(destination_table, select_stmt, job_config, insert_columns) or 0
+                    span.set(rows = rows_inserted)
+                report.set_phase('committing', rows_inserted = rows_inserted)
+                return rows_inserted
+
+            report.set_phase('starting')
+            rows_inserted = self.__new_transaction().run(insert_versions, on_retry = DataIngestor.__on_retry(report))
+
+        return {'rows_inserted': rows_inserted or 0}
+
+    def apply_changes(self,
+                      source_table:str,
+                      destination_table:str,
+                      pkey,
+                      progress = None,
+                      run_token:str = None) -> dict:
+
+        """ method used to insert or update data in destination tables on bigquery keeping the differences
+            server-side: the differences are stored in a session temp table and applied with DML statements
+            inside the same transaction, so no row is downloaded
+
+        Args:
+            source_table (str): name of source table
+            destination_table (str): name of destination table
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            progress (callable, optional): function called with the RunReport at every phase change
+            run_token (str, optional): idempotency token of the run (see ingest_data). Default None
+
+        Returns:
+            dict: number of invalidated ('rows_updated') and inserted ('rows_inserted') rows
+
+        Notes:
+            the result on the destination table is the same as ingest_data.
+            With shards (or rows_per_shard), the comparison and the DML statements run by bucket of pkey hash
+
+        """
+        if run_token and not self.__state_store:
+            raise ValueError('State store is required with a run token')
+
+        with Tracer.span('apply_changes', source_table = source_table, destination_table = destination_table), \
+                RunReport(source_table, destination_table, 'apply_changes', on_close = self.__publish_report, on_phase = progress) as report:
+            # schema drift is detected and the state table is created before the session is opened
+            self.__check_schemas(source_table, destination_table)
+            self.__create_state_table(destination_table)
+            # the fingerprint is read before the diff: a change made in the meantime is detected by the next run
+            source_fingerprint, unchanged = self.__read_source_fingerprint(source_table, destination_table)
+            if unchanged:
+                report.set_phase('unchanged', rows_updated = 0, rows_inserted = 0)
+                return {'rows_updated': 0, 'rows_inserted': 0}
+
+            def apply(job_config:QueryJobConfig) -> dict:
+                if self.__is_committed_run(source_table, destination_table, run_token, job_config):
+                    report.set_phase('duplicate', rows_updated = 0, rows_inserted = 0)
+                    return {'rows_updated': 0, 'rows_inserted': 0}
+
+                watermarks = self.__read_watermarks(source_table, destination_table)
+                shards = self.__shard_count(source_table)
+                if shards > 1:
+                    rows_updated, rows_inserted = self.__apply_shards(
+                        source_table, destination_table, pkey, shards, job_config, watermarks, report
+                    )
+                else:
+                    report.set_phase('comparing')
+                    diff_table = f'scd2_diff_{uuid.uuid4().hex}'
+                    with Tracer.span('materialize_differences', source_table = source_table, destination_table = destination_table):
+                        self.__comparer.materialize_differences(source_table, destination_table, diff_table, job_config, pkey, watermarks)
+
+                    report.set_phase('invalidating')
+                    rows_updated = self.__update_data_from_table(destination_table, pkey, diff_table, job_config)
+                    report.set_phase('inserting', rows_updated = rows_updated or 0)
+                    rows_inserted = self.__insert_data_from_table(destination_table, pkey, diff_table, job_config)
+                    report.set_phase('committing', rows_inserted = rows_inserted or 0)
+                    # the session can be recycled by the pool
+                    self.__bigquery_manager.drop_table(diff_table, job_config)
+
+                self.__write_watermark(source_table, destination_table, watermarks, job_config)
+                self.__write_source_fingerprint(source_table, destination_table, source_fingerprint, job_config)
+                self.__write_run_token(source_table, destination_table, run_token, job_config)
+                return {'rows_updated': rows_updated or 0, 'rows_inserted': rows_inserted or 0}
+
+            report.set_phase('starting')
+            return self.__new_transaction().run(apply, on_retry = DataIngestor.__on_retry(report))
@@ -0,0 +1,182 @@
+import logging
+import re
+import threading
+from lib.dbmanagement.connector.BigQueryConnector import BigQueryConnector
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+from google.cloud.bigquery import QueryJobConfig
+
+
+class IngestionStateStore():
+    """
+    Class that implements a small key-value store on Bigquery tables, keeping the state of the ingestion
+    of every (source table, destination table) pair (e.g. the watermark of the last successful run).
+
+    Args:
+        bigquery_connection (BigQueryConnector): Bigquery connection from BigQueryConnector.
+        state_table (str): name prefix of the state tables, the state of a destination table is kept
+            in its own table (see state_table_name)
+
+    Notes:
+        the state is written with the job_config of the ingestion transaction, so it advances only if the ingestion commits.
+        A table per destination keeps the transactions of different destinations from conflicting on the state writes
+
+    """
+
+    CREATE_STATE_STMT = """
+        create table if not exists `{state_table}` (
+            source_table STRING NOT NULL,
+            destination_table STRING NOT NULL,
+            state_key STRING NOT NULL,
+            state_value STRING,
+            updated_at TIMESTAMP NOT NULL
+        );
+    """
+
+    READ_STMT = """
+        select state_value
+        from `{state_table}`
+        where source_table = @source_table
+        and destination_table = @destination_table
+        and state_key = @state_key;
+    """
+
+    DELETE_STMT = """
+        delete from `{state_table}`
+        where source_table = @source_table
+        and destination_table = @destination_table
+        and state_key = @state_key;
+    """
+
+    # states of a key prefix (e.g. the committed run tokens) last written more than retention_days days ago
+    DELETE_EXPIRED_STMT = """
+        delete from `{state_table}`
+        where source_table = @source_table
+        and destination_table = @destination_table
+        and SUBSTR(state_key, 1, LENGTH(@state_key)) = @state_key
+        and DATE(updated_at) < DATE_SUB(CURRENT_DATE(), INTERVAL {retention_days} DAY);
+    """
+
+    INSERT_STMT = """
+        insert into `{state_table}` (source_table, destination_table, state_key, state_value, updated_at)
+        values (@source_table, @destination_table, @state_key, @state_value, CURRENT_TIMESTAMP());
+    """
+
+    def __init__(self, bigquery_connection:BigQueryConnector, state_table:str) -> None:
+        self.__bigquery_manager = BigQueryManager(bigquery_connection)
+        self.__state_table = state_table
+        self.__created_tables = set()
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger()
+
+    def state_table_name(self, destination_table:str) -> str:
+        """ method that returns the name of the state table of a destination table
+
+        Args:
+            destination_table (str): name of destination table
+
+        Returns:
+            str: state_table + '_' + destination table name, with the non-alphanumeric characters replaced by '_'
+        """
+        return f"{self.__state_table}_{re.sub(r'[^0-9A-Za-z_]', '_', destination_table)}"
+
+    def create_state_table(self, destination_table:str) -> None:
+        """ method used to create the state table of a destination table, if not exists.
+            It runs once per destination and store, outside the ingestion transaction (DDL)
+
+        Args:
+            destination_table (str): name of destination table
+        """
+        state_table = self.state_table_name(destination_table)
+        with self.__lock:
+            if state_table in self.__created_tables:
+                return
+        self.__bigquery_manager.run_query(IngestionStateStore.CREATE_STATE_STMT.format(state_table = state_table))
+        with self.__lock:
+            self.__created_tables.add(state_table)
+
+    @staticmethod
+    def __parameters(source_table:str, destination_table:str, state_key:str) -> list:
+        return [
+            BigQueryManager.scalar_parameter('source_table', source_table),
+            BigQueryManager.scalar_parameter('destination_table', destination_table),
+            BigQueryManager.scalar_parameter('state_key', state_key),
+        ]
+
+    def get_state(self, source_table:str, destination_table:str, state_key:str, job_config:QueryJobConfig = None) -> str:
+        """ method used to read a state value
+
+        Args:
+            source_table (str): name of source table
+            destination_table (str): name of destination table
+            state_key (str): name of the state
+            job_config (QueryJobConfig, optional): query job used for transaction. If None, method runs without transaction
+
+        Returns:
+            str: the state value, None if the state does not exist
+
+        """
+        rows = list(self.__bigquery_manager.run_query(
+            IngestionStateStore.READ_STMT.format(state_table = self.state_table_name(destination_table)),
+            job_config,
+            IngestionStateStore.__parameters(source_table, destination_table, state_key)
+        ).result())
+        return rows[0][0] if rows else None
+
+    def set_state(self, source_table:str, destination_table:str, state_key:str, state_value:str, job_config:QueryJobConfig = None) -> None:
+        """ method used to write a state value, replacing the previous one
+
+        Args:
+            source_table (str): name of source table
+            destination_table (str): name of destination table
+            state_key (str): name of the state
+            state_value (str): value of the state
+            job_config (QueryJobConfig, optional): query job used for transaction. If None, method runs without transaction
+
+        """
+        parameters = IngestionStateStore.__parameters(source_table, destination_table, state_key)
+        state_table = self.state_table_name(destination_table)
+        try:
+            self.__bigquery_manager.run_query(
+                IngestionStateStore.DELETE_STMT.format(state_table = state_table), job_config, parameters
+            )
+            self.__bigquery_manager.run_query(
+                IngestionStateStore.INSERT_STMT.format(state_table = state_table),
+                job_config,
+                parameters + [BigQueryManager.scalar_parameter('state_value', state_value)]
+            )
+        except Exception as e:
+            self.__logger.error(f'Error writing state {state_key} of {source_table} -> {destination_table} with error {str(e)}')
+            raise e
+
+    def delete_expired_states(self,
+                              source_table:str,
+                              destination_table:str,
+                              state_key_prefix:str,
+                              retention_days:int,
+                              job_config:QueryJobConfig = None
+                              ) -> int:
+        """ method used to delete the states whose key starts with a prefix, written more than retention_days days ago
+
+        Args:
+            source_table (str): name of source table
+            destination_table (str): name of destination table
+            state_key_prefix (str): prefix of the names of the states
+            retention_days (int): number of days a state is kept after its last write
+            job_config (QueryJobConfig, optional): query job used for transaction. If None, method runs without transaction
+
+        Returns:
+            int: number of deleted states
+
+        """
+        try:
+            return self.__bigquery_manager.run_query(
+                IngestionStateStore.DELETE_EXPIRED_STMT.format(
+                    state_table = self.state_table_name(destination_table),
+                    retention_days = int(retention_days)
+                ),
+                job_config,
+                IngestionStateStore.__parameters(source_table, destination_table, state_key_prefix)
+            ).num_dml_affected_rows or 0
+        except Exception as e:
+            self.__logger.error(f'Error deleting expired states {state_key_prefix} of {source_table} -> {destination_table} with error {str(e)}')
+            raise e
@@ -0,0 +1,35 @@
+import pandas
+from pandas import DataFrame, Series
+from lib.data.technicalkey.KeyAllocator import KeyAllocator
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+
+
+class HashKeyAllocator(KeyAllocator):
+    """
+    Class that allocates deterministic TechnicalKeys as a 63 bits hash of primary key, Date_From and version
+    (the number of versions of the key already opened on Date_From), so that the versions of a key opened
+    on the same day get different keys and a retried run gets the same keys.
+    No query is needed to allocate the keys.
+
+    Notes:
+        the keys of different versions are unique in practice but not by construction (about n^2 / 2^64 collisions
+        expected over n versions): SequenceKeyAllocator should be used where uniqueness must be guaranteed
+
+    """
+
+    derived_keys = True
+
+    POSITIVE_INT64_MASK = 0x7FFFFFFFFFFFFFFF
+
+    KEY_EXPRESSION = "(FARM_FINGERPRINT({key_string} || '|' || CAST({date_from} AS STRING) || '|' || CAST({version} AS STRING)) & 0x7FFFFFFFFFFFFFFF)"
+
+    def assign_keys(self, destination_table:str, rows:DataFrame, pkey) -> Series:
+        hashes = pandas.util.hash_pandas_object(rows[BigQueryManager.key_columns(pkey) + ['Date_From', 'Version']], index=False)
+        return (hashes & HashKeyAllocator.POSITIVE_INT64_MASK).astype('int64')
+
+    def key_expression(self, destination_table:str, pkey, date_from_expression:str, count_rows, version_expression:str = "0") -> str:
+        return HashKeyAllocator.KEY_EXPRESSION.format(
+            key_string = BigQueryManager.key_string(pkey),
+            date_from = date_from_expression,
+            version = version_expression
+        )
@@ -0,0 +1,48 @@
+from google.cloud.bigquery import QueryJobConfig
+from pandas import DataFrame, Series
+
+
+class KeyAllocator():
+    """
+    Base class of the TechnicalKey allocators used by DataIngestor.
+    An allocator assigns the keys to a whole DataFrame (client-side ingestion)
+    or returns the SQL expression generating them (server-side ingestion).
+
+    Notes:
+        derived_keys is True if the keys are derived from the versions: DataIngestor then provides the version
+        of every new row, the number of versions of its key already opened on Date_From
+
+    """
+
+    derived_keys = False
+
+    def assign_keys(self, destination_table:str, rows:DataFrame, pkey) -> Series:
+        """ method used to assign a new TechnicalKey to every row
+
+        Args:
+            destination_table (str): name of destination table
+            rows (DataFrame): rows to insert, containing the pkey columns, Date_From and, with derived_keys, Version
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+
+        Returns:
+            pandas.Series: int64 keys aligned to rows index
+
+        """
+        raise NotImplementedError
+
+    def key_expression(self, destination_table:str, pkey, date_from_expression:str, count_rows, version_expression:str = "0") -> str:
+        """ method used to build the SQL expression assigning a new TechnicalKey to every inserted row
+
+        Args:
+            destination_table (str): name of destination table
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            date_from_expression (str): SQL expression of Date_From of the inserted rows
+            count_rows (callable): function returning the number of rows to insert, called only when needed
+            version_expression (str, optional): SQL expression of the number of versions of the key already opened
+                on Date_From, used with derived_keys. Default "0"
+
+        Returns:
+            str: SQL expression
+
+        """
+        raise NotImplementedError
@@ -0,0 +1,129 @@
+import logging
+import threading
+import numpy
+from pandas import DataFrame, Series
+from lib.data.technicalkey.KeyAllocator import KeyAllocator
+from lib.dbmanagement.connector.BigQueryConnector import BigQueryConnector
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+from lib.dbmanagement.transaction.BigqueryTransaction import BigqueryTransaction
+
+
+class SequenceKeyAllocator(KeyAllocator):
+    """
+    Class that allocates sequential TechnicalKeys per destination table, reserving blocks of keys
+    in a small counter table (one row per destination table).
+
+    Args:
+        bigquery_connection (BigQueryConnector): Bigquery connection from BigQueryConnector.
+        counter_table (str): name of counter table, with columns sequence_name STRING and next_value INT64
+        block_size (int, optional): min number of keys reserved by a single counter update, default 10000
+
+    Notes:
+        blocks are reserved in a dedicated transaction, so that concurrent ingestions never conflict on the
+        counter table while running. Keys of a rolled back ingestion are not reused (gaps are allowed).
+        A missing sequence is initialized with the max TechnicalKey of the destination table
+
+    """
+
+    CREATE_COUNTER_STMT = """
+        create table if not exists `{counter_table}` (
+            sequence_name STRING NOT NULL,
+            next_value INT64 NOT NULL
+        );
+    """
+
+    INIT_SEQUENCE_STMT = """
+        insert into `{counter_table}` (sequence_name, next_value)
+        select @sequence_name, coalesce(max(TechnicalKey), 0) + 1
+        from `{destination_table}`;
+    """
+
+    RESERVE_STMT = """
+        update `{counter_table}`
+        set next_value = next_value + @block_size
+        where sequence_name = @sequence_name;
+    """
+
+    READ_STMT = """
+        select next_value
+        from `{counter_table}`
+        where sequence_name = @sequence_name;
+    """
+
+    KEY_EXPRESSION = "({block_start} + ROW_NUMBER() OVER () - 1)"
+
+    def __init__(self,
+                 bigquery_connection:BigQueryConnector,
+                 counter_table:str,
+                 block_size:int = 10000
+            ) -> None:
+        self.__bigquery_connection = bigquery_connection
+        self.__bigquery_manager = BigQueryManager(bigquery_connection)
+        self.__counter_table = counter_table
+        self.__block_size = block_size
+        self.__blocks = dict()
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger()
+
+    def create_counter_table(self) -> None:
+        """ method used to create the counter table, if not exists """
+        self.__bigquery_manager.run_query(SequenceKeyAllocator.CREATE_COUNTER_STMT.format(counter_table = self.__counter_table))
+
+    def __reserve_block(self, destination_table:str, block_size:int) -> int:
+        """ private method that reserves block_size keys in the counter table and returns the first one """
+        bigquery_transaction = BigqueryTransaction(bigquery_connection = self.__bigquery_connection)
+        parameters = [
+            BigQueryManager.scalar_parameter('sequence_name', destination_table),
+            BigQueryManager.scalar_parameter('block_size', block_size)
+        ]
+        try:
+            job_config = bigquery_transaction.begin_transaction()
+            reserved = self.__bigquery_manager.run_query(
+                SequenceKeyAllocator.RESERVE_STMT.format(counter_table = self.__counter_table), job_config, parameters
+            ).num_dml_affected_rows
+            if not reserved:
+                self.__bigquery_manager.run_query(
+                    SequenceKeyAllocator.INIT_SEQUENCE_STMT.format(counter_table = self.__counter_table, destination_table = destination_table),
+                    job_config,
+                    parameters
+                )
+                self.__bigquery_manager.run_query(
+                    SequenceKeyAllocator.RESERVE_STMT.format(counter_table = self.__counter_table), job_config, parameters
+                )
+            next_value = list(self.__bigquery_manager.run_query(
+                SequenceKeyAllocator.READ_STMT.format(counter_table = self.__counter_table), job_config, parameters
+            ).result())[0][0]
+            bigquery_transaction.commit_transaction()
+
+        except Exception as error:
+            bigquery_transaction.rollback_transaction()
+            self.__logger.error(f'Error reserving keys for {destination_table} with error {error}')
+            raise error
+
+        return next_value - block_size
+
+    def allocate(self, destination_table:str, num_keys:int) -> int:
+        """ method used to allocate num_keys consecutive keys
+
+        Args:
+            destination_table (str): name of destination table (sequence name)
+            num_keys (int): number of keys
+
+        Returns:
+            int: first allocated key
+        """
+        with self.__lock:
+            block_start, block_end = self.__blocks.get(destination_table, (0, 0))
+            if block_end - block_start < num_keys:
+                block_size = max(num_keys, self.__block_size)
+                block_start = self.__reserve_block(destination_table, block_size)
+                block_end = block_start + block_size
+            self.__blocks[destination_table] = (block_start + num_keys, block_end)
+        return block_start
+
+    def assign_keys(self, destination_table:str, rows:DataFrame, pkey) -> Series:
+        first_key = self.allocate(destination_table, len(rows))
+        return Series(numpy.arange(first_key, first_key + len(rows), dtype='int64'), index=rows.index)
+
+    def key_expression(self, destination_table:str, pkey, date_from_expression:str, count_rows, version_expression:str = "0") -> str:
+        return SequenceKeyAllocator.KEY_EXPRESSION.format(block_start = self.allocate(destination_table, count_rows()))
@@ -1,6 +1,7 @@
 from google.cloud import bigquery
+from lib.dbmanagement.connector.Connector import Connector
 
-class BigQueryConnector():
+class BigQueryConnector(Connector):
     """
         Class lass that initialize bigquery client object based on specific project id.
 
@@ -0,0 +1,23 @@
+class Connector():
+    """
+    Base class of the connectors: a connector initializes the client of an execution engine.
+    The lib (BigQueryManager, BigquerySession, BigqueryTransaction) only uses the following methods of the client,
+    implemented by google.cloud.bigquery.Client and by the local stand-in LocalClient:
+
+        query(query, job_config=None, location=None) -> job with result(page_size=None), to_dataframe(), to_arrow(),
+            num_dml_affected_rows, session_info and statistics (total_bytes_processed, slot_millis, ...)
+        get_table(table), delete_table(table, not_found_ok=False), load_table_from_file(file_obj, destination, job_config=None)
+        location, close()
+
+    Sessions are created with QueryJobConfig(create_session=True) and reused through the session_id connection property.
+
+    """
+
+    def get_client(self):
+        """ method that returns the client initialized in constructor
+
+        Returns:
+            the client object of the engine
+
+        """
+        raise NotImplementedError
@@ -0,0 +1,35 @@
+from lib.dbmanagement.connector.BigQueryConnector import BigQueryConnector
+from lib.dbmanagement.connector.Connector import Connector
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+
+
+class ConnectorFactory():
+    """
+    Class that creates the connector of an execution engine by name:
+
+        'bigquery': BigQueryConnector (options: project_id, location)
+        'local': LocalConnector, sqlite3 backed stand-in executor (options: database_dir, location)
+
+    """
+
+    ENGINES = {
+        'bigquery': BigQueryConnector,
+        'local': LocalConnector,
+    }
+
+    @staticmethod
+    def create(engine:str, **options) -> Connector:
+        """ method that creates the connector of an engine
+
+        Args:
+            engine (str): name of the engine ('bigquery' or 'local')
+            options: arguments of the connector constructor, options set to None are ignored
+
+        Returns:
+            Connector: the connector of the engine
+
+        """
+        if engine not in ConnectorFactory.ENGINES:
+            raise ValueError(f"Unknown engine {engine}, expected one of {', '.join(ConnectorFactory.ENGINES)}")
+
+        return ConnectorFactory.ENGINES[engine](**{name: value for name, value in options.items() if value is not None})
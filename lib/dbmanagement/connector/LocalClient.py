@@ -0,0 +1,384 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timezone
+import pandas
+import pyarrow
+from google.cloud.bigquery import SchemaField
+from pandas import DataFrame
+from lib.dbmanagement.connector.SqliteTranslator import SqliteTranslator
+
+
+class LocalSessionInfo():
+    """ Class that mimics bigquery SessionInfo, exposing the session id of a query job """
+
+    def __init__(self, session_id:str) -> None:
+        self.session_id = session_id
+
+
+class LocalRowIterator():
+    """ Class that mimics bigquery RowIterator on the rows returned by a local statement """
+
+    def __init__(self, columns:list, rows:list, page_size:int = None) -> None:
+        self.__columns = columns
+        self.__rows = rows
+        self.__page_size = page_size or max(len(rows), 1)
+        self.total_rows = len(rows)
+
+    def __iter__(self):
+        return iter(self.__rows)
+
+    def to_dataframe(self) -> DataFrame:
+        return DataFrame.from_records(self.__rows, columns=self.__columns)
+
+    def to_dataframe_iterable(self, bqstorage_client = None):
+        """ method that returns the rows as DataFrames of page_size rows, bqstorage_client is ignored """
+        for page_start in range(0, len(self.__rows), self.__page_size):
+            yield DataFrame.from_records(self.__rows[page_start:page_start + self.__page_size], columns=self.__columns)
+
+    @staticmethod
+    def arrow_table(columns:list, rows:list) -> pyarrow.Table:
+        """ method that builds an Arrow table from the rows, the column types are inferred from the values """
+        return pyarrow.table({column: pyarrow.array([row[position] for row in rows]) for position, column in enumerate(columns)})
+
+    def to_arrow(self) -> pyarrow.Table:
+        return LocalRowIterator.arrow_table(self.__columns, self.__rows)
+
+    def to_arrow_iterable(self, bqstorage_client = None):
+        """ method that returns the rows as Arrow record batches of page_size rows, bqstorage_client is ignored """
+        for page_start in range(0, len(self.__rows), self.__page_size):
+            yield from LocalRowIterator.arrow_table(self.__columns, self.__rows[page_start:page_start + self.__page_size]).to_batches()
+
+
+class LocalQueryJob():
+    """ Class that mimics bigquery QueryJob for a statement executed by LocalClient """
+
+    def __init__(self, query:str, columns:list, rows:list, num_dml_affected_rows:int, session_id:str = None) -> None:
+        self.job_id = uuid.uuid4().hex
+        self.query = query
+        self.created = self.started = self.ended = datetime.now(timezone.utc)
+        self.num_dml_affected_rows = num_dml_affected_rows
+        self.session_info = LocalSessionInfo(session_id) if session_id else None
+        self.__columns = columns
+        self.__rows = rows
+        self.__row_iterator = LocalRowIterator(columns, rows)
+
+    def result(self, page_size:int = None) -> LocalRowIterator:
+        return LocalRowIterator(self.__columns, self.__rows, page_size) if page_size else self.__row_iterator
+
+    def to_dataframe(self) -> DataFrame:
+        return self.__row_iterator.to_dataframe()
+
+    def to_arrow(self) -> pyarrow.Table:
+        return self.__row_iterator.to_arrow()
+
+
+class LocalLoadJob():
+    """ Class that mimics bigquery LoadJob for a file loaded by LocalClient """
+
+    def __init__(self, destination:str, output_rows:int) -> None:
+        self.job_id = uuid.uuid4().hex
+        self.destination = destination
+        self.output_rows = output_rows
+
+    def result(self):
+        return self
+
+
+class LocalBitXor():
+    """ Class that implements the BIT_XOR aggregate function, NULL values are ignored """
+
+    def __init__(self) -> None:
+        self.value = None
+
+    def step(self, value) -> None:
+        if value is not None:
+            self.value = value if self.value is None else self.value ^ value
+
+    def finalize(self):
+        return self.value
+
+
+class LocalTable():
+    """ Class that mimics bigquery Table metadata for a local table """
+
+    def __init__(self, table_id:str, schema:list, num_rows:int) -> None:
+        self.table_id = table_id
+        self.schema = schema
+        self.num_rows = num_rows
+        # sqlite does not track the modification time of a table
+        self.modified = None
+        # local tables have no modification tracking, the etag changes with the schema
+        self.etag = hashlib.md5(repr([(field.name, field.field_type, field.mode) for field in schema]).encode()).hexdigest()
+
+
+class LocalClient():
+    """
+    Class that implements the subset of bigquery Client API used by the lib on top of sqlite3,
+    in order to run the lib offline (local stand-in executor for tests and comparisons).
+
+    Every dataset is stored in its own sqlite database file and attached on demand,
+    every bigquery session is mapped to a dedicated sqlite connection (temp tables and transactions are session scoped).
+
+    Args:
+        database_dir (str, optional): folder containing the database files. If None, a temporary folder is used
+        location (str, optional): location returned to callers, default 'local'
+
+    """
+
+    SYSTEM_SCHEMAS = {'main', 'temp'}
+
+    # sqlite declared types mapped to bigquery types, the declared type is kept when not listed
+    FIELD_TYPES = {
+        'TEXT': 'STRING',
+        'INT': 'INTEGER',
+        'REAL': 'FLOAT',
+        'BLOB': 'BYTES',
+    }
+
+    def __init__(self, database_dir:str = None, location:str = 'local') -> None:
+        self.location = location
+        self.__logger = logging.getLogger()
+        self.__owns_dir = database_dir is None
+        self.__database_dir = database_dir or tempfile.mkdtemp(prefix='scd2_local_')
+        self.__sessions = dict()
+        self.__sessions_lock = threading.Lock()
+        self.__default_connection = self.__connect()
+
+    def __connect(self) -> dict:
+        connection = sqlite3.connect(
+            os.path.join(self.__database_dir, 'main.db'),
+            isolation_level = None,
+            check_same_thread = False,
+            timeout = 30
+        )
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.create_function('RAND', 0, random.random)
+        connection.create_function('GENERATE_UUID', 0, lambda: str(uuid.uuid4()))
+        connection.create_function('FARM_FINGERPRINT', 1, LocalClient.fingerprint, deterministic=True)
+        connection.create_function('MOD', 2, LocalClient.mod, deterministic=True)
+        connection.create_aggregate('BIT_XOR', 1, LocalBitXor)
+        return {'connection': connection, 'lock': threading.RLock(), 'attached': set()}
+
+    @staticmethod
+    def fingerprint(value) -> int:
+        """ method that mimics FARM_FINGERPRINT returning a signed 64 bits hash of the value (not the same hash function) """
+        if value is None:
+            return None
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, byteorder='big', signed=True)
+
+    @staticmethod
+    def mod(dividend:int, divisor:int) -> int:
+        """ method that mimics the integer MOD function, the result has the sign of the dividend """
+        if dividend is None or divisor is None:
+            return None
+        remainder = abs(dividend) % abs(divisor)
+        return remainder if dividend >= 0 else -remainder
+
+    def __attach(self, session:dict, schema:str) -> None:
+        if schema.lower() in LocalClient.SYSTEM_SCHEMAS or schema in session['attached']:
+            return
+        session['connection'].execute(
+            'ATTACH DATABASE ? AS "{}"'.format(schema),
+            (os.path.join(self.__database_dir, f'{schema}.db'),)
+        )
+        session['connection'].execute(f'PRAGMA "{schema}".journal_mode=WAL')
+        session['attached'].add(schema)
+
+    def __attach_referenced_schemas(self, session:dict, statement:str) -> None:
+        for schema in re.findall(r'"([^"]+)"\."[^"]+"', statement):
+            self.__attach(session, schema)
+        for schema in re.findall(r'\b(?:from|join|into|update|table|exists)\s+(\w+)\.\w+', statement, flags=re.IGNORECASE):
+            self.__attach(session, schema)
+
+    def __resolve_columns(self, session:dict, table:str) -> list:
+        parts = [part.strip('"') for part in table.split('.')]
+        schema, name = (parts[0], parts[1]) if len(parts) == 2 else (None, parts[0])
+        if schema:
+            self.__attach(session, schema)
+            rows = session['connection'].execute('select name from pragma_table_info(?, ?)', (name, schema)).fetchall()
+        else:
+            rows = session['connection'].execute('select name from pragma_table_info(?)', (name,)).fetchall()
+        if not rows:
+            raise ValueError(f'Table {table} not found')
+        return [row[0] for row in rows]
+
+    def __get_session(self, job_config) -> tuple:
+        """ private method that returns the (session_id, session) pair where a job should run """
+        if job_config is not None and getattr(job_config, 'create_session', False):
+            session_id = uuid.uuid4().hex
+            with self.__sessions_lock:
+                self.__sessions[session_id] = self.__connect()
+            return session_id, self.__sessions[session_id]
+
+        for connection_property in (getattr(job_config, 'connection_properties', None) or []):
+            if connection_property.key == 'session_id':
+                with self.__sessions_lock:
+                    if connection_property.value not in self.__sessions:
+                        raise ValueError(f'Session {connection_property.value} does not exist or has been aborted')
+                    return connection_property.value, self.__sessions[connection_property.value]
+
+        return None, self.__default_connection
+
+    def query(self, query:str, job_config = None, location:str = None) -> LocalQueryJob:
+        """ method that runs a BigQuery statement on the local sqlite database
+
+        Args:
+            query (str): query statement (BigQuery Standard SQL)
+            job_config (QueryJobConfig, optional): job config carrying session information
+            location (str, optional): ignored, kept for compatibility with bigquery Client
+
+        Returns:
+            LocalQueryJob: the executed job
+
+        """
+        session_id, session = self.__get_session(job_config)
+
+        if re.match(r'\s*call\s+bq\.abort_session\s*\(\s*\)\s*;?\s*$', query, flags=re.IGNORECASE):
+            self.__abort_session(session_id)
+            return LocalQueryJob(query, [], [], None, session_id)
+
+        translator = SqliteTranslator(column_resolver = lambda table: self.__resolve_columns(session, table))
+        parameters = self.__bind_parameters(getattr(job_config, 'query_parameters', None) or [])
+        columns, rows, affected_rows = [], [], None
+
+        with session['lock']:
+            for statement in translator.translate(query):
+                self.__attach_referenced_schemas(session, statement)
+                self.__logger.debug("local stmt -> " + statement)
+                cursor = session['connection'].execute(
+                    statement,
+                    {name: value for name, value in parameters.items() if f':{name}' in statement}
+                )
+                if cursor.description:
+                    columns = [column[0] for column in cursor.description]
+                    rows = cursor.fetchall()
+                elif re.match(r'\s*(insert|update|delete)\b', statement, flags=re.IGNORECASE):
+                    affected_rows = (affected_rows or 0) + cursor.rowcount
+
+        return LocalQueryJob(query, columns, rows, affected_rows, session_id)
+
+    @staticmethod
+    def __bind_parameters(query_parameters:list) -> dict:
+        """ private method that converts bigquery query parameters into sqlite named parameters,
+            array parameters are bound as JSON arrays, the structs of an array as JSON objects """
+        parameters = dict()
+        for parameter in query_parameters:
+            if hasattr(parameter, 'values'):
+                parameters[parameter.name] = json.dumps(
+                    [getattr(value, 'struct_values', value) for value in parameter.values], default=str
+                )
+            else:
+                parameters[parameter.name] = parameter.value
+        return parameters
+
+    def __abort_session(self, session_id:str) -> None:
+        with self.__sessions_lock:
+            session = self.__sessions.pop(session_id, None)
+        if session:
+            with session['lock']:
+                if session['connection'].in_transaction:
+                    session['connection'].rollback()
+                session['connection'].close()
+
+    def create_dataset(self, dataset:str, exists_ok:bool = False) -> None:
+        """ method that creates (attaches) a local dataset, the project prefix is ignored """
+        schema = dataset.split('.')[-1]
+        if os.path.exists(os.path.join(self.__database_dir, f'{schema}.db')) and not exists_ok:
+            raise ValueError(f'Dataset {dataset} already exists')
+        with self.__default_connection['lock']:
+            self.__attach(self.__default_connection, schema)
+
+    def __split_table_id(self, table) -> tuple:
+        parts = str(table).replace('`', '').split('.')[-2:]
+        return (parts[0], parts[1]) if len(parts) == 2 else ('main', parts[0])
+
+    def get_table(self, table) -> LocalTable:
+        """ method that returns the metadata (schema and number of rows) of a local table """
+        schema, name = self.__split_table_id(table)
+        session = self.__default_connection
+        with session['lock']:
+            self.__attach(session, schema)
+            columns = session['connection'].execute(
+                'select name, type, "notnull" from pragma_table_info(?, ?)', (name, schema)
+            ).fetchall()
+            if not columns:
+                raise ValueError(f'Table {table} not found')
+            num_rows = session['connection'].execute(f'select count(*) from "{schema}"."{name}"').fetchone()[0]
+
+        return LocalTable(
+            table_id = f'{schema}.{name}',
+            schema = [
+                SchemaField(
+                    name = column,
+                    field_type = LocalClient.FIELD_TYPES.get(field_type.upper(), field_type.upper() or 'STRING'),
+                    mode = 'REQUIRED' if not_null else 'NULLABLE'
+                )
+                for column, field_type, not_null in columns
+            ],
+            num_rows = num_rows
+        )
+
+    def delete_table(self, table, not_found_ok:bool = False) -> None:
+        """ method that drops a local table """
+        schema, name = self.__split_table_id(table)
+        session = self.__default_connection
+        with session['lock']:
+            self.__attach(session, schema)
+            session['connection'].execute(f'drop table {"if exists " if not_found_ok else ""}"{schema}"."{name}"')
+
+    def load_table_from_file(self, file_obj, destination, job_config = None) -> LocalLoadJob:
+        """ method that loads a Parquet file in a local table, replacing its content (WRITE_TRUNCATE)
+
+        Args:
+            file_obj (IO[bytes]): Parquet file
+            destination (str): name of table
+            job_config (LoadJobConfig, optional): ignored, kept for compatibility with bigquery Client
+
+        Returns:
+            LocalLoadJob: the executed job
+
+        """
+        rows = pandas.read_parquet(file_obj)
+        schema, name = self.__split_table_id(destination)
+        columns = ", ".join(f'"{column}"' for column in rows.columns)
+        values = rows.astype(object).where(rows.notna(), None)
+        for column in values.columns:
+            if pandas.api.types.is_datetime64_any_dtype(rows[column]):
+                values[column] = values[column].map(lambda value: value.isoformat(sep=' ') if value is not None else None)
+
+        session = self.__default_connection
+        with session['lock']:
+            self.__attach(session, schema)
+            connection = session['connection']
+            connection.execute('BEGIN')
+            try:
+                connection.execute(f'drop table if exists "{schema}"."{name}"')
+                connection.execute(f'create table "{schema}"."{name}" ({columns})')
+                connection.executemany(
+                    f'insert into "{schema}"."{name}" ({columns}) values ({", ".join("?" * len(rows.columns))})',
+                    values.itertuples(index=False, name=None)
+                )
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+        return LocalLoadJob(f'{schema}.{name}', len(rows))
+
+    def close(self) -> None:
+        """ method that aborts the open sessions and removes temporary database files """
+        for session_id in list(self.__sessions):
+            self.__abort_session(session_id)
+        self.__default_connection['connection'].close()
+        if self.__owns_dir:
+            shutil.rmtree(self.__database_dir, ignore_errors=True)
@@ -0,0 +1,29 @@
+from lib.dbmanagement.connector.Connector import Connector
+from lib.dbmanagement.connector.LocalClient import LocalClient
+
+class LocalConnector(Connector):
+    """
+        Class that initialize a local client object backed by sqlite3, exposing the same interface as the bigquery client
+        used by the lib. It is a stand-in executor used to run the lib offline.
+
+        Args:
+            database_dir (str, optional): folder containing the local database files, default a temporary folder.
+            location (str, optional): location of the local client, default 'local'.
+
+    """
+
+    def __init__(self, database_dir:str = None, location:str = "local") -> None:
+
+        # Create a local client
+        self.__client = LocalClient(
+            database_dir = database_dir,
+            location = location)
+
+    def get_client(self):
+        """ method that returns local client initialized in constructor
+
+        Returns:
+            LocalClient: the local client object
+
+        """
+        return self.__client
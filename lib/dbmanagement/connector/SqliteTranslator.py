@@ -0,0 +1,278 @@
+import re
+
+
+class SqliteTranslator():
+    """
+    Class that translates the subset of BigQuery Standard SQL issued by the lib into SQLite statements.
+
+    Args:
+        column_resolver (callable): function that receives a table reference (as written in the translated
+            statement) and returns the list of its column names, used to expand `select * except(...)`.
+
+    Notes:
+        query parameters (@name) are translated into named placeholders (:name), array parameters
+        are expected to be bound as JSON arrays.
+        The translation is a best-effort rewriting that covers the statements generated by this lib
+        (comparer, ingestor and table management), it is not a general purpose BigQuery dialect converter
+
+    """
+
+    STRING_PLACEHOLDER = "__sqlite_str_{}__"
+
+    IDENTIFIER_PATTERN = r'(?:"[^"]+"(?:\."[^"]+")?|\w+(?:\.\w+)?)'
+
+    COLUMN_TYPES = {
+        'string': 'text',
+        'int64': 'integer',
+        'float64': 'real',
+        'bool': 'integer',
+        'bytes': 'blob',
+    }
+
+    def __init__(self, column_resolver) -> None:
+        self.__column_resolver = column_resolver
+
+    def translate(self, query:str) -> list:
+        """ method that translates a BigQuery script into a list of SQLite statements
+
+        Args:
+            query (str): BigQuery statement or script
+
+        Returns:
+            list: list of SQLite statements, in execution order
+
+        """
+        code, strings = self.__extract_literals(query)
+
+        code = re.sub(r'\b(except|intersect|union)\s+distinct\b', r'\1', code, flags=re.IGNORECASE)
+        code = re.sub(r'\bis\s+not\s+distinct\s+from\b', 'is', code, flags=re.IGNORECASE)
+        code = re.sub(r'\bis\s+distinct\s+from\b', 'is not', code, flags=re.IGNORECASE)
+        code = re.sub(r'\b(?:date|datetime|timestamp)\s+(__sqlite_str_\d+__)', r'\1', code, flags=re.IGNORECASE)
+        code = re.sub(r'\bcurrent_date\s*\(\s*\)', "date('now')", code, flags=re.IGNORECASE)
+        code = re.sub(r'\bcurrent_(?:datetime|timestamp)\s*\(\s*\)', "datetime('now')", code, flags=re.IGNORECASE)
+        code = re.sub(r'\bas\s+(?:date|datetime|timestamp)\b', 'as text', code, flags=re.IGNORECASE)
+        code = re.sub(
+            r'\b(string|int64|float64|bool|bytes)\b',
+            lambda match: SqliteTranslator.COLUMN_TYPES[match.group(1).lower()],
+            code,
+            flags=re.IGNORECASE
+        )
+        code = re.sub(
+            r'\bcreate\s+or\s+replace\s+(temp|temporary)\s+table\s+(' + SqliteTranslator.IDENTIFIER_PATTERN + ')',
+            r'drop table if exists temp.\2; create temp table \2',
+            code,
+            flags=re.IGNORECASE
+        )
+        code = self.__rewrite_interval_calls(code)
+        code = re.sub(r'\bin\s+unnest\s*\(\s*@(\w+)\s*\)', r'in (select value from json_each(:\1))', code, flags=re.IGNORECASE)
+        code = self.__rewrite_struct_fields(code)
+        code = re.sub(r'\bunnest\s*\(\s*@(\w+)\s*\)', r'json_each(:\1)', code, flags=re.IGNORECASE)
+        code = re.sub(r'@(\w+)', r':\1', code)
+
+        statements = []
+        for statement in code.split(';'):
+            if not statement.strip():
+                continue
+            for statement in self.__rewrite_create_or_replace(statement):
+                statement = self.__rewrite_add_column_if_not_exists(statement)
+                if not statement:
+                    continue
+                statement = self.__strip_table_layout(statement)
+                statement = self.__expand_struct_to_json_string(statement)
+                statement = self.__expand_struct_of_columns_to_json_string(statement)
+                statement = self.__expand_star_except(statement)
+                statement = self.__expand_to_json_string(statement)
+                statements.append(self.__restore_literals(statement, strings).strip())
+
+        return statements
+
+    def __extract_literals(self, query:str) -> tuple:
+        """ private method that replaces string literals with placeholders, converts backtick identifiers
+            into SQLite quoted identifiers and strips comments
+
+        Args:
+            query (str): BigQuery statement
+
+        Returns:
+            tuple: the statement without literals and the list of SQLite string literals
+
+        """
+        code = []
+        strings = []
+        i = 0
+        while i < len(query):
+            char = query[i]
+            if char in ("'", '"'):
+                value = []
+                i += 1
+                while i < len(query) and query[i] != char:
+                    if query[i] == '\\' and i + 1 < len(query):
+                        i += 1
+                    value.append(query[i])
+                    i += 1
+                strings.append("'" + "".join(value).replace("'", "''") + "'")
+                code.append(SqliteTranslator.STRING_PLACEHOLDER.format(len(strings) - 1))
+            elif char == '`':
+                end = query.index('`', i + 1)
+                parts = query[i + 1:end].split('.')[-2:]
+                code.append(".".join(f'"{part}"' for part in parts))
+                i = end
+            elif char == '#' or query.startswith('--', i):
+                while i < len(query) and query[i] != '\n':
+                    i += 1
+                continue
+            elif query.startswith('/*', i):
+                i = query.index('*/', i) + 1
+            else:
+                code.append(char)
+            i += 1
+        return "".join(code), strings
+
+    def __rewrite_struct_fields(self, code:str) -> str:
+        """ private method that rewrites the fields of the structs of an aliased array parameter (`unnest(@name) as alias`)
+            into json_extract calls on the JSON objects """
+        for alias in re.findall(r'\bunnest\s*\(\s*@\w+\s*\)\s+as\s+(\w+)', code, flags=re.IGNORECASE):
+            code = re.sub(r'\b' + alias + r'\.(\w+)', "json_extract(" + alias + r".value, '$.\1')", code)
+        return code
+
+    def __restore_literals(self, statement:str, strings:list) -> str:
+        return re.sub(r'__sqlite_str_(\d+)__', lambda match: strings[int(match.group(1))], statement)
+
+    def __rewrite_interval_calls(self, code:str) -> str:
+        """ private method that rewrites DATE_SUB/DATE_ADD/DATETIME_SUB/DATETIME_ADD calls into SQLite modifiers """
+        pattern = re.compile(r'\b(date|datetime)_(sub|add)\s*\(', flags=re.IGNORECASE)
+        match = pattern.search(code)
+        while match:
+            start, depth, end = match.end(), 1, match.end()
+            while depth:
+                depth += {'(': 1, ')': -1}.get(code[end], 0)
+                end += 1
+            arguments = code[start:end - 1]
+            expression, interval = arguments.rsplit(',', 1)
+            amount, unit = re.match(r'\s*interval\s+(-?\d+)\s+(\w+)\s*$', interval, flags=re.IGNORECASE).groups()
+            sign = '-' if match.group(2).lower() == 'sub' else '+'
+            replacement = f"{match.group(1).lower()}({self.__rewrite_interval_calls(expression)}, '{sign}{amount} {unit.lower()}')"
+            code = code[:match.start()] + replacement + code[end:]
+            match = pattern.search(code, match.start() + len(replacement))
+        return code
+
+    def __rewrite_create_or_replace(self, statement:str) -> list:
+        """ private method that rewrites CREATE OR REPLACE TABLE into SQLite statements: drop and create,
+            or create a new table, drop the old one and rename when the table is replaced with a query (that can read it).
+            CREATE OR REPLACE VIEW is rewritten into drop and create """
+        view = re.match(
+            r'\s*create\s+or\s+replace\s+view\s+(' + SqliteTranslator.IDENTIFIER_PATTERN + ')',
+            statement,
+            flags=re.IGNORECASE
+        )
+        if view:
+            return [f'drop view if exists {view.group(1)}', f'create view {view.group(1)}{statement[view.end():]}']
+        match = re.match(
+            r'\s*create\s+or\s+replace\s+table\s+(' + SqliteTranslator.IDENTIFIER_PATTERN + ')',
+            statement,
+            flags=re.IGNORECASE
+        )
+        if not match:
+            return [statement]
+        table, definition = match.group(1), statement[match.end():]
+        if not re.search(r'\bas\s*\(?\s*(?:select|with)\b', definition, flags=re.IGNORECASE):
+            return [f'drop table if exists {table}', f'create table {table}{definition}']
+        name = table.split('.')[-1].strip('"')
+        new_table = table[:len(table) - len(table.split('.')[-1])] + f'"{name}__replace"'
+        return [f'create table {new_table}{definition}', f'drop table {table}', f'alter table {new_table} rename to "{name}"']
+
+    def __rewrite_add_column_if_not_exists(self, statement:str) -> str:
+        """ private method that rewrites ALTER TABLE ... ADD COLUMN IF NOT EXISTS into ADD COLUMN,
+            or into no statement (empty string) if the column already exists """
+        match = re.match(
+            r'\s*alter\s+table\s+(' + SqliteTranslator.IDENTIFIER_PATTERN + r')\s+add\s+column\s+if\s+not\s+exists\s+(\w+)',
+            statement,
+            flags=re.IGNORECASE
+        )
+        if not match:
+            return statement
+        if match.group(2).lower() in [column.lower() for column in self.__column_resolver(match.group(1))]:
+            return ""
+        return f'alter table {match.group(1)} add column {match.group(2)}{statement[match.end():]}'
+
+    def __strip_table_layout(self, statement:str) -> str:
+        """ private method that removes PARTITION BY / CLUSTER BY options of CREATE TABLE statements,
+            window clauses of the AS SELECT query are kept """
+        if not re.match(r'\s*create\b', statement, flags=re.IGNORECASE):
+            return statement
+        query = re.search(r'\bas\s*\(?\s*(?:select|with)\b', statement, flags=re.IGNORECASE)
+        head, tail = (statement[:query.start()], statement[query.start():]) if query else (statement, '')
+        head = re.sub(r'\bpartition\s+by\s+(?:\w+\s*\([^)]*\)|\w+)', '', head, flags=re.IGNORECASE)
+        head = re.sub(r'\bcluster\s+by\s+\w+(?:\s*,\s*\w+)*', '', head, flags=re.IGNORECASE)
+        return head + tail
+
+    def __expand_star_except(self, statement:str) -> str:
+        """ private method that expands `* except(...)` using the columns of the table in the following FROM clause """
+        pattern = re.compile(r'(\w+\.)?\*\s*except\s*\(([^)]*)\)', flags=re.IGNORECASE)
+        match = pattern.search(statement)
+        while match:
+            table = re.search(r'\bfrom\s+(' + SqliteTranslator.IDENTIFIER_PATTERN + ')', statement[match.end():], flags=re.IGNORECASE)
+            if not table:
+                raise ValueError(f'Unable to expand "* except" without a FROM table in statement: {statement}')
+            excluded = {column.strip().strip('"').lower() for column in match.group(2).split(',')}
+            prefix = match.group(1) or ''
+            columns = [
+                f'{prefix}"{column}"'
+                for column in self.__column_resolver(table.group(1))
+                if column.lower() not in excluded
+            ]
+            replacement = ", ".join(columns)
+            statement = statement[:match.start()] + replacement + statement[match.end():]
+            match = pattern.search(statement, match.start() + len(replacement))
+        return statement
+
+    def __expand_struct_to_json_string(self, statement:str) -> str:
+        """ private method that rewrites `TO_JSON_STRING((select as struct alias.* except(...)))` of a table alias
+            into a SQLite json_object call on the columns of the table, except the listed ones """
+        pattern = re.compile(
+            r'\bto_json_string\s*\(\s*\(\s*select\s+as\s+struct\s+(\w+)\.\*(?:\s*except\s*\(([^)]*)\))?\s*\)\s*\)',
+            flags=re.IGNORECASE
+        )
+        match = pattern.search(statement)
+        while match:
+            alias = match.group(1)
+            excluded = [column.strip().lower() for column in (match.group(2) or '').split(',')]
+            table = re.search(r'(' + SqliteTranslator.IDENTIFIER_PATTERN + r')\s+as\s+' + alias + r'\b', statement, flags=re.IGNORECASE)
+            if not table:
+                raise ValueError(f'Unable to translate TO_JSON_STRING of {alias} in statement: {statement}')
+            replacement = "json_object({})".format(", ".join(
+                f"'{column}', {alias}.\"{column}\"" for column in self.__column_resolver(table.group(1))
+                if column.lower() not in excluded
+            ))
+            statement = statement[:match.start()] + replacement + statement[match.end():]
+            match = pattern.search(statement, match.start() + len(replacement))
+        return statement
+
+    @staticmethod
+    def __expand_struct_of_columns_to_json_string(statement:str) -> str:
+        """ private method that rewrites `TO_JSON_STRING(STRUCT(column, ...))` of a list of columns
+            into a SQLite json_object call on the same columns """
+        pattern = re.compile(r'\bto_json_string\s*\(\s*struct\s*\(([^()]*)\)\s*\)', flags=re.IGNORECASE)
+        return pattern.sub(
+            lambda match: "json_object({})".format(", ".join(
+                "'{}', {}".format(column.strip().rsplit('.', 1)[-1].strip('"'), column.strip())
+                for column in match.group(1).split(',')
+            )),
+            statement
+        )
+
+    def __expand_to_json_string(self, statement:str) -> str:
+        """ private method that rewrites `TO_JSON_STRING(alias)` of a table alias into a SQLite json_object call """
+        pattern = re.compile(r'\bto_json_string\s*\(\s*(\w+)\s*\)', flags=re.IGNORECASE)
+        match = pattern.search(statement)
+        while match:
+            alias = match.group(1)
+            table = re.search(r'(' + SqliteTranslator.IDENTIFIER_PATTERN + r')\s+as\s+' + alias + r'\b', statement, flags=re.IGNORECASE)
+            if not table:
+                raise ValueError(f'Unable to translate TO_JSON_STRING of {alias} in statement: {statement}')
+            replacement = "json_object({})".format(", ".join(
+                f"'{column}', {alias}.\"{column}\"" for column in self.__column_resolver(table.group(1))
+            ))
+            statement = statement[:match.start()] + replacement + statement[match.end():]
+            match = pattern.search(statement, match.start() + len(replacement))
+        return statement
@@ -1,6 +1,14 @@
-from google.cloud.bigquery import Client, QueryJobConfig, job
+from google.cloud.bigquery import (ArrayQueryParameter, Client, LoadJobConfig, QueryJobConfig, ScalarQueryParameter,
+                                   SourceFormat, StructQueryParameter, WriteDisposition, job)
+import io
 import logging
+import uuid
+from datetime import date, datetime
+import numpy
+import pandas
 from pandas import DataFrame
+from lib.monitoring.QueryStatistics import QueryStatistics
+from lib.monitoring.Tracer import Tracer
 
 
 class BigQueryManager():
@@ -9,55 +17,388 @@ class BigQueryManager():
 
     Args:
         bigquery_client (Client): client of Bigquery.
+        staging_threshold (int, optional): number of rows above which insert_records loads the records
+            in a staging table (Parquet load job) instead of rendering them in the insert statement, default 10000.
+        staging_dataset (str, optional): dataset of the staging tables. If None, the dataset of the destination table is used
+        schema_registry (SchemaRegistry, optional): cache of the table schemas used to cast the staged records.
+            If None, the destination schema is read at every staged insert
 
     """
 
+    STAGED_INSERT_STMT = """
+        insert into `{destination_table}` ({columns})
+        select *{computed_columns}
+        from (
+            select {select_columns}
+            from `{staging_table}`
+        );
+    """
+
+    # SCD2 destination layout: closed versions are partitioned by Date_To, valid versions (open-ended Date_To, beyond the
+    # 2159-12-31 upper bound of the partition range) are stored in the __UNPARTITIONED__ partition.
+    # Clustered by validity and key, so that diff and invalidation prune the history
+    SCD2_LAYOUT = """
+        partition by DATETIME_TRUNC(Date_To, {partition_granularity})
+        cluster by Is_valid, {pkey_columns}
+    """
+
+    # string of a composite key: the fingerprints of the key columns never contain the separator,
+    # so that different keys have different strings
+    KEY_COLUMN_STRING = "coalesce(CAST(FARM_FINGERPRINT(CAST({column} AS STRING)) AS STRING), '')"
+
+    CREATE_SCD2_TABLE_STMT = """
+        create table if not exists `{destination_table}`
+        {layout}
+        as
+        select
+            CAST(NULL AS INT64) as TechnicalKey,
+            src.*,
+            CAST(NULL AS DATETIME) as Date_From,
+            CAST(NULL AS DATETIME) as Date_To,
+            CAST(NULL AS STRING) as Is_valid{fingerprint_select}
+        from `{source_table}` as src
+        where false;
+    """
+
+    # a table cannot be replaced with a different partitioning spec: the rows are copied in a new table, swapped in with renames
+    MIGRATE_SCD2_TABLE_STMT = """
+        drop table if exists `{migrated_table}`;
+        create table `{migrated_table}`
+        {layout}
+        as
+        select *
+        from `{destination_table}`;
+        alter table `{destination_table}` rename to `{previous_name}`;
+        alter table `{migrated_table}` rename to `{table_name}`;
+        drop table `{previous_table}`;
+    """
+
+    # legacy SQL type names returned by table schema mapped to standard SQL names used in CAST
+    STANDARD_SQL_TYPES = {
+        'INTEGER': 'INT64',
+        'FLOAT': 'FLOAT64',
+        'BOOLEAN': 'BOOL',
+    }
+
+    # python types mapped to bigquery query parameter types
+    PARAMETER_TYPES = [
+        (bool, 'BOOL'),
+        (int, 'INT64'),
+        (float, 'FLOAT64'),
+        (datetime, 'DATETIME'),
+        (date, 'DATE'),
+        (str, 'STRING'),
+    ]
+
     def __init__(
             self,
-            bigquery_client:Client
+            bigquery_client:Client,
+            staging_threshold:int = 10000,
+            staging_dataset:str = None,
+            schema_registry = None
         ) -> None:
 
         self.__client = bigquery_client
+        self.__staging_threshold = staging_threshold
+        self.__staging_dataset = staging_dataset
+        self.__schema_registry = schema_registry
         self.__logger = logging.getLogger()
 
 
-    def run_query(self, query:str, job_config:QueryJobConfig = None) -> job.QueryJob:
+    def run_query(self, query:str, job_config:QueryJobConfig = None, query_parameters:list = None) -> job.QueryJob:
         """ method that runs a sql query on bigquery
 
         Args:
             query (str): query statement
+            job_config (QueryJobConfig, optional): query job used for transaction. If None, method runs without transaction
+            query_parameters (list, optional): query parameters referenced in the statement as @name
 
         Returns:
             pandas.DataFrame: pandas DataFrame contains the results of query
 
         """
 
-        query_job = self.__client.query(query, location=self.__client.location, job_config=job_config)
+        if query_parameters:
+            # copy the job config, so that the transaction job config is not modified
+            job_config = QueryJobConfig.from_api_repr(job_config.to_api_repr()) if job_config else QueryJobConfig()
+            job_config.query_parameters = query_parameters
 
-        # Wait for the query to complete
-        query_job.result()
+        # Wait for the query to complete, recording its statistics
+        query_job, _ = QueryStatistics.run(
+            lambda: self.__client.query(query, location=self.__client.location, job_config=job_config)
+        )
 
         return query_job
 
-    def insert_records(self, destination_table:str, rows:DataFrame, job_config:QueryJobConfig = None) -> None:
+    def insert_records(self, destination_table:str, rows:DataFrame, job_config:QueryJobConfig = None, computed_columns:dict = None) -> None:
         """ method that insert records to a table from a pandas dataframe
 
         Args:
             destination_table (str): name of table
             rows (DataFrame): pandas.DataFrame containing the new records
             job_config (QueryJobConfig, optional): query job used for transaction. If None, method runs without transaction
+            computed_columns (dict, optional): couples column -> SQL expression of columns computed by the insert
+                from the columns of rows (cast to the destination types), default None
 
 
         Notes:
-            dataframe 'rows' should respect table schema
+            dataframe 'rows' should respect table schema, columns are matched by name.
+            Above staging_threshold rows, or when there are computed columns, records are loaded in a staging table
+            and moved in the destination table with an insert ... select running on job_config
+        """
+
+        try:
+            staged = len(rows) > self.__staging_threshold or bool(computed_columns)
+            with Tracer.span('insert_records', destination_table = destination_table, staged = staged) as span:
+                if staged:
+                    query_job = self.__insert_records_staged(destination_table, rows, job_config, computed_columns)
+                else:
+                    query_job = self.__insert_records_literal(destination_table, rows, job_config)
+                inserted_rows = query_job.num_dml_affected_rows
+                span.set(rows = inserted_rows)
+            self.__logger.info(f"DML query inserts {inserted_rows} rows from {destination_table}.")
+            return inserted_rows
+        except Exception as e:
+            self.__logger.error(f'Error inserting data in table {destination_table} with error {str(e)}')
+            raise e
+
+    @staticmethod
+    def to_sql_literal(value) -> str:
+        """ method that renders a python value as a bigquery SQL literal
+
+        Args:
+            value: python (or numpy/pandas) scalar, list (ARRAY) or dict (STRUCT)
+
+        Returns:
+            str: SQL literal
         """
+        if isinstance(value, (list, tuple, numpy.ndarray)):
+            return "[" + ", ".join(BigQueryManager.to_sql_literal(element) for element in list(value)) + "]"
+        if isinstance(value, dict):
+            return "STRUCT(" + ", ".join(f"{BigQueryManager.to_sql_literal(field_value)} AS {field}" for field, field_value in value.items()) + ")"
+        if value is None or value is pandas.NaT or (not isinstance(value, str) and pandas.isna(value)):
+            return "NULL"
+        if hasattr(value, 'item'):
+            value = value.item()
+        if isinstance(value, bool):
+            return "TRUE" if value else "FALSE"
+        if isinstance(value, (int, float)):
+            return repr(value)
+        if isinstance(value, datetime):
+            return "'" + value.isoformat(sep=' ') + "'"
+        if isinstance(value, date):
+            return "'" + value.isoformat() + "'"
+        return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+    def __insert_records_literal(self, destination_table:str, rows:DataFrame, job_config:QueryJobConfig = None) -> job.QueryJob:
+        """ private method that inserts records rendering them as literals in the insert statement """
 
         insert_stmt = """
-                insert into `{destination_table}`
+                insert into `{destination_table}` ({columns})
                 values {assignments};
             """.format(
                 destination_table = destination_table,
-                assignments = ",".join([str(el) for el in list(rows.itertuples(index=False, name=None))])
+                columns = ", ".join(rows.columns),
+                assignments = ",".join([
+                    "(" + ", ".join(BigQueryManager.to_sql_literal(value) for value in row) + ")"
+                    for row in rows.itertuples(index=False, name=None)
+                ])
+            )
+
+        self.__logger.debug("insert stmt -> " + insert_stmt)
+        return self.run_query(insert_stmt, job_config)
+
+    def create_scd2_table(self,
+                          destination_table:str,
+                          source_table:str,
+                          pkey:str,
+                          fingerprint_column:str = None,
+                          partition_granularity:str = 'MONTH'
+                          ) -> None:
+        """ method that creates (if not exists) an SCD2 destination table with the schema of the source table,
+            partitioned on Date_To and clustered on Is_valid and pkey
+
+        Args:
+            destination_table (str): name of destination table
+            source_table (str): name of source table
+            pkey (str): name of primary (or surrogate) key
+            fingerprint_column (str, optional): name of the fingerprint column, added as last column (see TableComparer)
+            partition_granularity (str, optional): granularity of Date_To partitions (DAY, MONTH, YEAR), default MONTH
+
+        Notes:
+            technical columns are created NULLABLE
+        """
+        create_stmt = BigQueryManager.CREATE_SCD2_TABLE_STMT.format(
+            destination_table = destination_table,
+            source_table = source_table,
+            layout = BigQueryManager.SCD2_LAYOUT.format(
+                partition_granularity = partition_granularity,
+                pkey_columns = ", ".join(BigQueryManager.key_columns(pkey))
+            ).strip(),
+            fingerprint_select = f",\n            CAST(NULL AS INT64) as {fingerprint_column}" if fingerprint_column else ""
+        )
+
+        self.__logger.debug("create stmt -> " + create_stmt)
+        self.run_query(create_stmt)
+
+    def migrate_scd2_table(self, destination_table:str, pkey:str, partition_granularity:str = 'MONTH') -> bool:
+        """ method that rewrites an existing SCD2 destination table partitioned on Date_To and clustered on Is_valid and pkey
+
+        Args:
+            destination_table (str): name of destination table
+            pkey (str): name of primary (or surrogate) key
+            partition_granularity (str, optional): granularity of Date_To partitions (DAY, MONTH, YEAR), default MONTH
+
+        Returns:
+            bool: True if the table has been rewritten, False if it already has the layout
+
+        Notes:
+            the rows are copied with a CREATE TABLE ... AS SELECT in <destination_table>__migrated, then the tables are swapped
+            renaming the old table <destination_table>__premigration (dropped at the end), so the table should not be written
+            by other jobs during the migration. Table options and column modes are not kept
+        """
+        table = self.__client.get_table(destination_table)
+        time_partitioning = getattr(table, 'time_partitioning', None)
+        if (time_partitioning is not None
+                and time_partitioning.field == 'Date_To'
+                and time_partitioning.type_ == partition_granularity
+                and getattr(table, 'clustering_fields', None) == ['Is_valid'] + BigQueryManager.key_columns(pkey)):
+            return False
+
+        table_name = destination_table.split('.')[-1]
+        migrate_stmt = BigQueryManager.MIGRATE_SCD2_TABLE_STMT.format(
+            destination_table = destination_table,
+            migrated_table = f"{destination_table}__migrated",
+            table_name = table_name,
+            previous_name = f"{table_name}__premigration",
+            previous_table = f"{destination_table}__premigration",
+            layout = BigQueryManager.SCD2_LAYOUT.format(
+                partition_granularity = partition_granularity,
+                pkey_columns = ", ".join(BigQueryManager.key_columns(pkey))
+            ).strip()
+        )
+
+        self.__logger.debug("migrate stmt -> " + migrate_stmt)
+        self.run_query(migrate_stmt)
+        return True
+
+    def drop_table(self, table:str, job_config:QueryJobConfig = None) -> None:
+        """ method that drops a table (or a session temp table), if exists
+
+        Args:
+            table (str): name of table
+            job_config (QueryJobConfig, optional): query job used for transaction (or session). If None, method runs without transaction
+        """
+        self.run_query(f"drop table if exists `{table}`;", job_config)
+
+    def get_column_types(self, table:str) -> dict:
+        """ method that returns the standard SQL type of the scalar columns of a table
+
+        Args:
+            table (str): name of table
+
+        Returns:
+            dict: dict containing the couple column -> type, REPEATED and RECORD columns with their full type
+                (e.g. ARRAY<STRUCT<Street STRING, Zip INT64>>, see standard_sql_type)
+        """
+        return {field.name: BigQueryManager.standard_sql_type(field) for field in self.__client.get_table(table).schema}
+
+    @staticmethod
+    def standard_sql_type(field) -> str:
+        """ method that returns the standard SQL type of a table field, with the types of the nested fields
+
+        Args:
+            field (SchemaField): field of the table schema
+
+        Returns:
+            str: standard SQL type, ARRAY<...> for REPEATED fields and STRUCT<...> for RECORD fields
+        """
+        if field.field_type in ('RECORD', 'STRUCT'):
+            field_type = "STRUCT<{}>".format(", ".join(
+                f"{nested_field.name} {BigQueryManager.standard_sql_type(nested_field)}" for nested_field in field.fields
+            ))
+        else:
+            field_type = BigQueryManager.STANDARD_SQL_TYPES.get(field.field_type, field.field_type)
+        return f"ARRAY<{field_type}>" if field.mode == 'REPEATED' else field_type
+
+    @staticmethod
+    def is_nested_type(column_type:str) -> bool:
+        """ method that returns True if a standard SQL type is an ARRAY or a STRUCT """
+        return column_type.startswith(('ARRAY<', 'STRUCT<'))
+
+    def __staging_table_name(self, destination_table:str) -> str:
+        staging_dataset = self.__staging_dataset or destination_table.rsplit('.', 1)[0]
+        return f"{staging_dataset}.scd2_staging_{uuid.uuid4().hex}"
+
+    def __insert_records_staged(self, destination_table:str, rows:DataFrame, job_config:QueryJobConfig = None, computed_columns:dict = None) -> job.QueryJob:
+        """ private method that loads records in a staging table from an in-memory Parquet file
+            and moves them in the destination table with an insert ... select
+
+        Notes:
+            the load job runs outside the session (load jobs cannot join a transaction), while the insert ... select
+            runs on job_config, so the records are written in the destination table only if the transaction commits.
+            The staging table is always deleted
+        """
+        staging_table = self.__staging_table_name(destination_table)
+        computed_columns = computed_columns or {}
+
+        parquet_file = io.BytesIO()
+        rows.to_parquet(parquet_file, index=False)
+        parquet_file.seek(0)
+
+        try:
+            self.__client.load_table_from_file(
+                parquet_file,
+                staging_table,
+                job_config = LoadJobConfig(
+                    source_format = SourceFormat.PARQUET,
+                    write_disposition = WriteDisposition.WRITE_TRUNCATE
+                )
+            ).result()
+
+            column_types = (self.__schema_registry or self).get_column_types(destination_table)
+
+            insert_stmt = BigQueryManager.STAGED_INSERT_STMT.format(
+                destination_table = destination_table,
+                columns = ", ".join(list(rows.columns) + list(computed_columns)),
+                computed_columns = "".join(f", {expression} as {column}" for column, expression in computed_columns.items()),
+                select_columns = ", ".join(
+                    f"CAST({column} AS {column_types[column]}) as {column}"
+                    if column in column_types and not BigQueryManager.is_nested_type(column_types[column]) else column
+                    for column in rows.columns
+                ),
+                staging_table = staging_table
+            )
+
+            self.__logger.debug("insert stmt -> " + insert_stmt)
+            return self.run_query(insert_stmt, job_config)
+        finally:
+            self.__client.delete_table(staging_table, not_found_ok = True)
+
+
+    def insert_from_query(self, destination_table:str, select_stmt:str, job_config:QueryJobConfig = None, columns:list = None) -> int:
+        """ method that insert records to a table from the result of a select statement, without downloading them
+
+        Args:
+            destination_table (str): name of table
+            select_stmt (str): select statement producing the new records
+            job_config (QueryJobConfig, optional): query job used for transaction. If None, method runs without transaction
+            columns (list, optional): destination columns filled by the select statement, in select order
+
+        Returns:
+            int: number of inserted rows
+
+        Notes:
+            without columns, columns of select statement should respect table schema (positional order)
+        """
+
+        insert_stmt = """
+                insert into `{destination_table}`{columns}
+                {select_stmt};
+            """.format(
+                destination_table = destination_table,
+                columns = f" ({', '.join(columns)})" if columns else "",
+                select_stmt = select_stmt
             )
 
         self.__logger.debug("insert stmt -> " + insert_stmt)
@@ -71,7 +412,106 @@ class BigQueryManager():
             raise e
 
 
-    def update_records(self, destination_table:str, assignments:dict, filter_cond:str, job_config = None) -> None:
+    @staticmethod
+    def __parameter_type(value) -> str:
+        return next(
+            (bigquery_type for python_type, bigquery_type in BigQueryManager.PARAMETER_TYPES if isinstance(value, python_type)),
+            'STRING'
+        )
+
+    @staticmethod
+    def scalar_parameter(name:str, value) -> ScalarQueryParameter:
+        """ method that builds a scalar query parameter, typed on the value
+
+        Args:
+            name (str): name of the parameter, referenced in the statement as @name
+            value: python value
+
+        Returns:
+            ScalarQueryParameter: the scalar query parameter
+        """
+        value = value.item() if hasattr(value, 'item') else value
+        return ScalarQueryParameter(name, BigQueryManager.__parameter_type(value), value)
+
+    @staticmethod
+    def array_parameter(name:str, values:list) -> ArrayQueryParameter:
+        """ method that builds an array query parameter, to pass values as data instead of SQL text
+
+        Args:
+            name (str): name of the parameter, referenced in the statement as @name
+            values (list): list of python values of the same type
+
+        Returns:
+            ArrayQueryParameter: the array query parameter, typed on the first value
+        """
+        values = [value.item() if hasattr(value, 'item') else value for value in values]
+        return ArrayQueryParameter(name, BigQueryManager.__parameter_type(values[0]) if values else 'STRING', values)
+
+    @staticmethod
+    def struct_array_parameter(name:str, records:list) -> ArrayQueryParameter:
+        """ method that builds an array of struct query parameter, e.g. to pass the values of a composite key
+
+        Args:
+            name (str): name of the parameter, referenced in the statement as @name
+            records (list): list of dicts with the same fields, typed on the first record
+
+        Returns:
+            ArrayQueryParameter: the array query parameter
+        """
+        return ArrayQueryParameter(name, 'STRUCT', [
+            StructQueryParameter(None, *[BigQueryManager.scalar_parameter(field, value) for field, value in record.items()])
+            for record in records
+        ])
+
+    @staticmethod
+    def key_columns(pkey) -> list:
+        """ method that returns the columns of a primary key
+
+        Args:
+            pkey (str | list): name of primary key column, or list of names of the columns of a composite key
+
+        Returns:
+            list: names of the key columns
+        """
+        return [pkey] if isinstance(pkey, str) else list(pkey)
+
+    @staticmethod
+    def key_string(pkey) -> str:
+        """ method that returns the SQL expression of the key as a string, to hash it
+
+        Args:
+            pkey (str | list): name of primary key column, or list of names of the columns of a composite key
+
+        Returns:
+            str: SQL expression, CAST(pkey AS STRING) for a single column
+        """
+        key_columns = BigQueryManager.key_columns(pkey)
+        if len(key_columns) == 1:
+            return f"CAST({key_columns[0]} AS STRING)"
+        return " || '|' || ".join(BigQueryManager.KEY_COLUMN_STRING.format(column = column) for column in key_columns)
+
+    @staticmethod
+    def key_join(pkey, left:str, right:str) -> str:
+        """ method that returns the join condition on the key columns of two relations
+
+        Args:
+            pkey (str | list): name of primary key column, or list of names of the columns of a composite key
+            left (str): alias of the first relation
+            right (str): alias of the second relation
+
+        Returns:
+            str: SQL condition
+        """
+        return " and ".join(f"{left}.{column} = {right}.{column}" for column in BigQueryManager.key_columns(pkey))
+
+    def update_records(self,
+                       destination_table:str,
+                       assignments:dict,
+                       filter_cond:str,
+                       job_config = None,
+                       query_parameters:list = None,
+                       join_relation:str = None
+                       ) -> None:
         """ method that insert records to a table from a pandas dataframe
 
         Args:
@@ -79,25 +519,31 @@ class BigQueryManager():
             assignments (dict): dict containing the couple column -> value
             filter_cond (str) : filter statement
             job_config (QueryJobConfig, optional): query job used for transaction. If None, method runs without transaction
+            query_parameters (list, optional): query parameters referenced in filter_cond as @name
+            join_relation (str, optional): relation joined to the table (with its alias), e.g. a keys subquery:
+                the table is aliased dest and filter_cond holds the join condition. Default None
 
 
         Notes:
-            column names should exists in the destination table
+            column names should exists in the destination table.
+            With join_relation, every row of the table should match at most one row of the relation
         """
 
         update_stmt = """
-                update `{destination_table}`
-                set {assignments}
+                update `{destination_table}`{alias}
+                set {assignments}{from_clause}
                 where {filter_cond};
             """.format(
                 destination_table = destination_table,
+                alias = " as dest" if join_relation else "",
                 assignments = ",".join([str(column) + "=" + str(value) for column, value in assignments.items()]),
+                from_clause = f"\n                from {join_relation}" if join_relation else "",
                 filter_cond = filter_cond
             )
 
         self.__logger.debug("update stmt -> " + update_stmt)
         try:
-            query_job = self.run_query(update_stmt, job_config)
+            query_job = self.run_query(update_stmt, job_config, query_parameters)
             affected_rows = query_job.num_dml_affected_rows
             self.__logger.info(f"DML query updates {affected_rows} rows from {destination_table}.")
             return affected_rows
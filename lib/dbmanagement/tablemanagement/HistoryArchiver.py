@@ -0,0 +1,217 @@
+import logging
+from google.cloud.bigquery import QueryJobConfig
+from lib.dbmanagement.connector.BigQueryConnector import BigQueryConnector
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+from lib.dbmanagement.transaction.BigqueryTransaction import BigqueryTransaction
+from lib.dbmanagement.transaction.RetryPolicy import RetryPolicy
+from lib.monitoring.Tracer import Tracer
+
+
+class HistoryArchiver():
+    """
+    Class that moves the closed versions of an SCD2 destination table older than a retention threshold
+    into a history table with the same schema, so that comparison and invalidation read a table whose size
+    depends on the current versions only. A view over the two tables gives back the full history.
+
+    Args:
+        bigquery_connection (BigQueryConnector): Bigquery connection from BigQueryConnector.
+        batch_size (int, optional): max number of versions moved by a transaction, default 1000000.
+            The versions closed on the same day are moved together, so a batch can exceed it
+        session_pool (BigquerySessionPool, optional): pool of warm sessions used by the transactions, default None
+        retry_policy (RetryPolicy, optional): policy used to retry a batch aborted by a concurrent ingestion, default None
+
+    Notes:
+        a batch is inserted in the history table and deleted from the destination table in the same transaction,
+        so a version is never lost nor duplicated and a failed archive can be run again
+
+    """
+
+    # history layout: partitioned as the destination table and clustered by key, the versions are all closed
+    HISTORY_LAYOUT = """
+        partition by DATETIME_TRUNC(Date_To, {partition_granularity})
+        cluster by {pkey_columns}
+    """
+
+    CREATE_HISTORY_TABLE_STMT = """
+        create table if not exists `{history_table}`
+        {layout}
+        as
+        select *
+        from `{destination_table}`
+        where false;
+    """
+
+    # a version closed on a day ends (Date_To) the day before: the versions closed more than retention_days days ago
+    # end before CURRENT_DATE() - (retention_days + 1), so a version closed today or yesterday is never archived
+    CLOSED_VERSIONS_STMT = """
+        select Date_To, count(*) as versions
+        from `{destination_table}`
+        where Is_valid = 'no'
+        and Date_To < DATETIME(DATE_SUB(CURRENT_DATE(), INTERVAL {cutoff_days} DAY))
+        group by Date_To
+        order by Date_To
+    """
+
+    BATCH_FILTER = "Is_valid = 'no' and Date_To >= @archive_from and Date_To <= @archive_to"
+
+    CREATE_VIEW_STMT = """
+        create or replace view `{view}` as
+        select {columns} from `{destination_table}`
+        union all
+        select {columns} from `{history_table}`;
+    """
+
+    def __init__(self,
+                 bigquery_connection:BigQueryConnector,
+                 batch_size:int = 1000000,
+                 session_pool = None,
+                 retry_policy:RetryPolicy = None
+                 ) -> None:
+        if batch_size < 1:
+            raise ValueError('Batch size should be at least 1')
+        self.__bigquery_connection = bigquery_connection
+        self.__bigquery_manager = BigQueryManager(bigquery_connection)
+        self.__batch_size = batch_size
+        self.__session_pool = session_pool
+        self.__retry_policy = retry_policy
+        self.__logger = logging.getLogger()
+
+    @staticmethod
+    def history_table_name(destination_table:str) -> str:
+        """ method that returns the default name of the history table of a destination table """
+        return f"{destination_table}_history"
+
+    def create_history_table(self,
+                             destination_table:str,
+                             pkey,
+                             history_table:str = None,
+                             partition_granularity:str = 'MONTH'
+                             ) -> None:
+        """ method that creates (if not exists) the history table with the schema of the destination table,
+            partitioned on Date_To and clustered on pkey
+
+        Args:
+            destination_table (str): name of destination table
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            history_table (str, optional): name of history table, default destination_table + '_history'
+            partition_granularity (str, optional): granularity of Date_To partitions (DAY, MONTH, YEAR), default MONTH
+        """
+        create_stmt = HistoryArchiver.CREATE_HISTORY_TABLE_STMT.format(
+            history_table = history_table or HistoryArchiver.history_table_name(destination_table),
+            destination_table = destination_table,
+            layout = HistoryArchiver.HISTORY_LAYOUT.format(
+                partition_granularity = partition_granularity,
+                pkey_columns = ", ".join(BigQueryManager.key_columns(pkey))
+            ).strip()
+        )
+
+        self.__logger.debug("create stmt -> " + create_stmt)
+        self.__bigquery_manager.run_query(create_stmt)
+
+    def __plan_batches(self, closed_versions:list) -> list:
+        """ private method that groups the (Date_To, versions) pairs, in Date_To order, in batches of about batch_size versions,
+            returning the (first Date_To, last Date_To, versions) of every batch """
+        batches = []
+        for date_to, versions in closed_versions:
+            if batches and batches[-1][2] + versions <= self.__batch_size:
+                batches[-1] = (batches[-1][0], date_to, batches[-1][2] + versions)
+            else:
+                batches.append((date_to, date_to, versions))
+        return batches
+
+    def __archive_batch(self, destination_table:str, history_table:str, columns:list, batch:tuple, job_config:QueryJobConfig) -> int:
+        """ private method that moves the closed versions of a batch in the history table, in the transaction of job_config """
+        query_parameters = [
+            BigQueryManager.scalar_parameter('archive_from', batch[0]),
+            BigQueryManager.scalar_parameter('archive_to', batch[1])
+        ]
+        job_config = QueryJobConfig.from_api_repr(job_config.to_api_repr())
+        job_config.query_parameters = query_parameters
+
+        rows_archived = self.__bigquery_manager.insert_from_query(
+            history_table,
+            f"select {', '.join(columns)} from `{destination_table}` where {HistoryArchiver.BATCH_FILTER}",
+            job_config,
+            columns
+        ) or 0
+        rows_deleted = self.__bigquery_manager.run_query(
+            f"delete from `{destination_table}` where {HistoryArchiver.BATCH_FILTER};", job_config
+        ).num_dml_affected_rows or 0
+
+        if rows_deleted != rows_archived:
+            raise RuntimeError(f'Archived {rows_archived} versions of {destination_table} but deleted {rows_deleted}')
+        return rows_archived
+
+    def archive(self, destination_table:str, retention_days:int, history_table:str = None) -> dict:
+        """ method that moves the versions of the destination table closed more than retention_days days ago
+            into the history table, in batches of about batch_size versions, a transaction per batch
+
+        Args:
+            destination_table (str): name of destination table
+            retention_days (int): number of whole days a closed version stays in the destination table after the day
+                it was closed, at least 1
+            history_table (str, optional): name of history table, default destination_table + '_history'.
+                It should exist (see create_history_table)
+
+        Returns:
+            dict: number of moved versions ('rows_archived') and of committed batches ('batches')
+
+        Notes:
+            the versions closed on a day are moved in the same batch. Batches are committed in Date_To order:
+            if a batch fails, the previous ones stay archived and the error is raised
+
+        """
+        if retention_days < 1:
+            raise ValueError('Retention should be at least 1 day, so that the versions closed by a running ingestion are not archived')
+        history_table = history_table or HistoryArchiver.history_table_name(destination_table)
+        columns = list(self.__bigquery_manager.get_column_types(destination_table))
+
+        with Tracer.span('archive', destination_table = destination_table, history_table = history_table) as span:
+            closed_versions = [
+                (row[0], row[1]) for row in self.__bigquery_manager.run_query(HistoryArchiver.CLOSED_VERSIONS_STMT.format(
+                    destination_table = destination_table,
+                    cutoff_days = int(retention_days) + 1
+                )).result()
+            ]
+            batches = self.__plan_batches(closed_versions)
+
+            rows_archived = 0
+            for batch in batches:
+                with Tracer.span('archive.batch', archive_from = str(batch[0]), archive_to = str(batch[1])) as batch_span:
+                    transaction = BigqueryTransaction(
+                        bigquery_connection = self.__bigquery_connection,
+                        session_pool = self.__session_pool,
+                        retry_policy = self.__retry_policy
+                    )
+                    batch_rows = transaction.run(
+                        lambda job_config: self.__archive_batch(destination_table, history_table, columns, batch, job_config)
+                    )
+                    batch_span.set(rows = batch_rows)
+                rows_archived += batch_rows
+                self.__logger.info(f'Archived {batch_rows} versions of {destination_table} closed from {batch[0]} to {batch[1]}')
+
+            span.set(rows = rows_archived, batches = len(batches))
+
+        return {'rows_archived': rows_archived, 'batches': len(batches)}
+
+    def create_unified_view(self, destination_table:str, view:str, history_table:str = None) -> None:
+        """ method that creates (or replaces) a view with the versions of the destination table and of the history table
+
+        Args:
+            destination_table (str): name of destination table
+            view (str): name of the view
+            history_table (str, optional): name of history table, default destination_table + '_history'
+
+        Notes:
+            the columns are listed explicitly, in destination order: the view should be created again
+            when the destination schema changes
+        """
+        create_stmt = HistoryArchiver.CREATE_VIEW_STMT.format(
+            view = view,
+            columns = ", ".join(self.__bigquery_manager.get_column_types(destination_table)),
+            destination_table = destination_table,
+            history_table = history_table or HistoryArchiver.history_table_name(destination_table)
+        )
+
+        self.__logger.debug("create view stmt -> " + create_stmt)
+        self.__bigquery_manager.run_query(create_stmt)
@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from google.cloud.bigquery import Client
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+
+
+class SchemaRegistry():
+    """
+    Class that caches the schema of the tables read from table metadata, so that the statements are generated
+    with explicit column lists without a metadata round-trip per run, and checks that source and destination
+    schemas line up before a session is opened.
+    An entry is kept for ttl seconds, then the table metadata is fetched again: the columns are parsed again
+    only if the etag of the table has changed.
+
+    Args:
+        bigquery_client (Client): Bigquery client (or local client)
+        ttl (float, optional): seconds an entry is used without reading the table metadata, default 300
+
+    """
+
+    TECH_COLUMNS = ['TechnicalKey', 'Date_From', 'Date_To', 'Is_valid']
+
+    def __init__(self, bigquery_client:Client, ttl:float = 300) -> None:
+        self.__client = bigquery_client
+        self.__ttl = ttl
+        self.__entries = dict()
+        self.__compatible = set()
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger()
+
+    def __entry(self, table:str) -> dict:
+        """ private method that returns the cached entry of a table, refreshing it when the ttl is expired """
+        with self.__lock:
+            entry = self.__entries.get(table)
+            if entry and time.monotonic() - entry['fetched_at'] < self.__ttl:
+                return entry
+
+        table_metadata = self.__client.get_table(table)
+        etag = getattr(table_metadata, 'etag', None)
+
+        with self.__lock:
+            if not entry or entry['etag'] != etag or etag is None:
+                column_types = {field.name: BigQueryManager.standard_sql_type(field) for field in table_metadata.schema}
+                entry = {'column_types': column_types, 'etag': etag}
+                self.__logger.debug(f'Schema of {table} loaded with etag {etag}')
+            entry = {**entry, 'fetched_at': time.monotonic()}
+            self.__entries[table] = entry
+        return entry
+
+    def get_column_types(self, table:str) -> dict:
+        """ method that returns the standard SQL type of the columns of a table, in declaration order
+
+        Args:
+            table (str): name of table
+
+        Returns:
+            dict: dict containing the couple column -> type, REPEATED and RECORD columns with their full type
+                (see BigQueryManager.standard_sql_type)
+
+        """
+        return dict(self.__entry(table)['column_types'])
+
+    def get_columns(self, table:str) -> list:
+        """ method that returns the columns of a table (nested ones included), in declaration order
+
+        Args:
+            table (str): name of table
+
+        Returns:
+            list: names of the columns
+
+        """
+        return list(self.__entry(table)['column_types'])
+
+    def invalidate(self, table:str = None) -> None:
+        """ method that removes a table (or every table, if None) from the cache
+
+        Args:
+            table (str, optional): name of table, default None
+        """
+        with self.__lock:
+            if table:
+                self.__entries.pop(table, None)
+            else:
+                self.__entries.clear()
+
+    @staticmethod
+    def __drift(source_types:dict, destination_types:dict, fingerprint_column:str = None) -> list:
+        """ private method that lists the differences between the source columns and the destination columns,
+            the types of the source columns typed None are not compared """
+        tech_columns = SchemaRegistry.TECH_COLUMNS + ([fingerprint_column] if fingerprint_column else [])
+        business_types = {column: column_type for column, column_type in destination_types.items() if column not in tech_columns}
+        drift = [f'missing tech column {column}' for column in tech_columns if column not in destination_types]
+        drift += [f'column {column} missing in destination' for column in source_types if column not in business_types]
+        drift += [f'column {column} missing in source' for column in business_types if column not in source_types]
+        drift += [
+            f'column {column} is {source_types[column]} in source and {business_types[column]} in destination'
+            for column in source_types
+            if column in business_types and source_types[column] is not None and source_types[column] != business_types[column]
+        ]
+        return drift
+
+    def check_compatibility(self, source_table:str, destination_table:str, fingerprint_column:str = None, excluded_columns:list = None) -> list:
+        """ method that checks that the destination table has the tech columns and the same business columns
+            (names and types, with the full schema of ARRAY and STRUCT columns) of the source table
+
+        Args:
+            source_table (str): name of source table
+            destination_table (str): name of destination table
+            fingerprint_column (str, optional): name of the destination column storing the row fingerprint, default None
+            excluded_columns (list, optional): source columns that are not stored in the destination table
+                (e.g. the snapshot date of a backfill), default None
+
+        Returns:
+            list: the business columns, in source declaration order
+
+        Notes:
+            raises ValueError describing the drift if the schemas do not line up.
+            The result is cached for the etags of the two tables
+
+        """
+        excluded_columns = tuple(excluded_columns or ())
+        source_entry, destination_entry = self.__entry(source_table), self.__entry(destination_table)
+        source_types = {column: column_type for column, column_type in source_entry['column_types'].items() if column not in excluded_columns}
+        key = (source_table, source_entry['etag'], destination_table, destination_entry['etag'], fingerprint_column, excluded_columns)
+        if key in self.__compatible and None not in (source_entry['etag'], destination_entry['etag']):
+            return list(source_types)
+
+        drift = SchemaRegistry.__drift(source_types, destination_entry['column_types'], fingerprint_column)
+        if drift:
+            raise ValueError(f"Schema drift between {source_table} and {destination_table}: {'; '.join(drift)}")
+
+        with self.__lock:
+            self.__compatible.add(key)
+        return list(source_types)
+
+    def check_columns(self, source_name:str, columns:list, destination_table:str, fingerprint_column:str = None) -> list:
+        """ method that checks that the destination table has the tech columns and the same business columns
+            of a source without table schema (e.g. a DataFrame), on the names only
+
+        Args:
+            source_name (str): name of the source, used in the error message
+            columns (list): columns of the source
+            destination_table (str): name of destination table
+            fingerprint_column (str, optional): name of the destination column storing the row fingerprint, default None
+
+        Returns:
+            list: the business columns, in source order
+
+        Notes:
+            raises ValueError describing the drift if the columns do not line up.
+            The types are not compared: the source values are cast to the destination types
+
+        """
+        drift = SchemaRegistry.__drift(dict.fromkeys(columns), self.__entry(destination_table)['column_types'], fingerprint_column)
+        if drift:
+            raise ValueError(f"Schema drift between {source_name} and {destination_table}: {'; '.join(drift)}")
+        return list(columns)
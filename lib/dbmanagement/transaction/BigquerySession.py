@@ -1,5 +1,7 @@
 from google.cloud.bigquery.query import ConnectionProperty
 from google.cloud.bigquery import Client, QueryJobConfig, LoadJobConfig
+from lib.monitoring.QueryStatistics import QueryStatistics
+from lib.monitoring.Tracer import Tracer
 
 class BigquerySession (object):
     """ContextManager wrapping a bigquerySession."""
@@ -15,15 +17,15 @@ class BigquerySession (object):
 
     def start_session (self):
         """Initiate a Bigquery session and return the session_id."""
-        res = self.__client.query(
-            "SELECT 3;",  # a query can't fail
-            job_config = QueryJobConfig(
-                create_session = True,
-                use_legacy_sql = False,
-                write_disposition="WRITE_APPEND",
-                ),
-        )
-        res.result()  # wait job completion
+        with Tracer.span('session.start'):
+            res, _ = QueryStatistics.run(lambda: self.__client.query(
+                "SELECT 3;",  # a query can't fail
+                job_config = QueryJobConfig(
+                    create_session = True,
+                    use_legacy_sql = False,
+                    write_disposition="WRITE_APPEND",
+                    ),
+            ))  # wait job completion
 
         self.__session_id = res.session_info.session_id
         self.__session_job = QueryJobConfig(
@@ -52,11 +54,11 @@ class BigquerySession (object):
             # abort the session in any case to have a clean state at the end
             # (sometimes in case of script failure, the table is locked in
             # the session)
-            job = self.__client.query(
-                "CALL BQ.ABORT_SESSION();",
-                self.__session_job,
-            )
-            job.result()
+            with Tracer.span('session.end', session_id = self.__session_id):
+                QueryStatistics.run(lambda: self.__client.query(
+                    "CALL BQ.ABORT_SESSION();",
+                    self.__session_job,
+                ))
 
     def __exit__ (self, exc_type, exc_value, traceback):
         """Abort the opened session."""
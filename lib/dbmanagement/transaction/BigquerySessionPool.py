@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+from collections import deque
+from google.cloud.bigquery import Client
+from lib.dbmanagement.transaction.BigquerySession import BigquerySession
+from lib.monitoring.QueryStatistics import QueryStatistics
+
+
+class BigquerySessionPool():
+    """
+    Class that keeps a pool of warm bigquery sessions, so that a transaction does not pay
+    the creation (SELECT on a new session) and the abort (BQ.ABORT_SESSION) of its session.
+
+    Args:
+        bigquery_client (Client): client of Bigquery.
+        size (int, optional): max number of idle sessions kept in the pool, default 2
+        idle_ttl (float, optional): seconds after which an idle session is aborted instead of reused, default 600
+        health_check_after (float, optional): seconds of idleness after which a session is checked
+            with a SELECT before being reused, default 60. If 0, sessions are always checked
+
+    Notes:
+        a session is released in the pool only after COMMIT or ROLLBACK, so it has no open transaction.
+        Temp tables created in the session survive the release, callers should drop them (see DataIngestor.apply_changes)
+
+    """
+
+    HEALTH_CHECK_STMT = "SELECT 1;"
+
+    def __init__(self,
+                 bigquery_client:Client,
+                 size:int = 2,
+                 idle_ttl:float = 600,
+                 health_check_after:float = 60
+            ) -> None:
+        self.__client = bigquery_client
+        self.__size = size
+        self.__idle_ttl = idle_ttl
+        self.__health_check_after = health_check_after
+        self.__idle_sessions = deque()
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger()
+
+    def __create_session(self) -> tuple:
+        session = BigquerySession(bigquery_client = self.__client)
+        job_config = session.start_session()
+        return session, job_config
+
+    def __abort(self, session:BigquerySession) -> None:
+        try:
+            session.end_session()
+        except Exception as error:
+            self.__logger.warning(f'Error aborting session {session.get_session_id()} with error {error}')
+
+    def __is_healthy(self, job_config) -> bool:
+        try:
+            QueryStatistics.run(lambda: self.__client.query(BigquerySessionPool.HEALTH_CHECK_STMT, job_config = job_config))
+            return True
+        except Exception as error:
+            self.__logger.warning(f'Session health check failed with error {error}')
+            return False
+
+    def warm_up(self) -> None:
+        """ method that creates sessions until the pool holds size idle sessions """
+        while True:
+            with self.__lock:
+                if len(self.__idle_sessions) >= self.__size:
+                    return
+            session, job_config = self.__create_session()
+            self.release(session, job_config)
+
+    def acquire(self) -> tuple:
+        """ method that returns a warm session, or a new one if the pool has no usable session
+
+        Returns:
+            tuple: the BigquerySession and the QueryJobConfig running jobs in the session
+        """
+        while True:
+            with self.__lock:
+                if not self.__idle_sessions:
+                    break
+                session, job_config, released_at = self.__idle_sessions.pop()
+
+            idle_time = time.monotonic() - released_at
+            if idle_time > self.__idle_ttl:
+                self.__logger.info(f'Evicting session {session.get_session_id()} idle for {idle_time:.0f} s')
+                self.__abort(session)
+            elif idle_time >= self.__health_check_after and not self.__is_healthy(job_config):
+                self.__abort(session)
+            else:
+                QueryStatistics.REGISTRY.increment('scd2_session_pool_acquired_total', 1, {'source': 'pool'})
+                return session, job_config
+
+        QueryStatistics.REGISTRY.increment('scd2_session_pool_acquired_total', 1, {'source': 'new'})
+        return self.__create_session()
+
+    def release(self, session:BigquerySession, job_config, reusable:bool = True) -> None:
+        """ method that gives a session back to the pool
+
+        Args:
+            session (BigquerySession): session returned by acquire
+            job_config (QueryJobConfig): job config of the session
+            reusable (bool, optional): False if the session state is unknown (e.g. failed rollback), so it is aborted. Default True
+        """
+        with self.__lock:
+            if reusable and len(self.__idle_sessions) < self.__size:
+                self.__idle_sessions.append((session, job_config, time.monotonic()))
+                return
+        self.__abort(session)
+
+    def close(self) -> None:
+        """ method that aborts every idle session """
+        with self.__lock:
+            sessions = list(self.__idle_sessions)
+            self.__idle_sessions.clear()
+        for session, _, _ in sessions:
+            self.__abort(session)
+
+
+QueryStatistics.REGISTRY.describe('scd2_session_pool_acquired_total', 'Sessions handed out by the session pool, warm or newly created')
@@ -1,33 +1,47 @@
 """ContextManager wrapping a bigquery session."""
 import logging
+import time
 from logging import Logger
 from google.cloud.bigquery import Client
 from lib.dbmanagement.transaction.BigquerySession import BigquerySession
+from lib.dbmanagement.transaction.RetryPolicy import RetryPolicy
+from lib.monitoring.QueryStatistics import QueryStatistics
+from lib.monitoring.Tracer import Tracer
 
 
 class BigqueryTransaction (): #TODO this class should contain the logic of BigQuerySession
 
     def __init__(
         self,
-        bigquery_connection
+        bigquery_connection,
+        session_pool = None,
+        retry_policy:RetryPolicy = None
     ) -> None:
-        """"""
+        """session_pool (BigquerySessionPool, optional): pool of warm sessions. If None, every transaction creates and aborts its session
+        retry_policy (RetryPolicy, optional): policy used by run to retry a unit of work aborted by a concurrent transaction.
+            If None, run does not retry"""
         self.__bigquery_connection:Client = bigquery_connection
+        self.__session_pool = session_pool
+        self.__retry_policy = retry_policy
         self.__job_config = None
         self.__logger = logging.getLogger()
         self.__bigquery_session:BigquerySession = None
 
     def begin_transaction (self):
-        self.__bigquery_session = BigquerySession(bigquery_client = self.__bigquery_connection)
-        self.__job_config = self.__bigquery_session.start_session()
+        with Tracer.span('transaction.begin', pooled = bool(self.__session_pool)):
+            if self.__session_pool:
+                self.__bigquery_session, self.__job_config = self.__session_pool.acquire()
+            else:
+                self.__bigquery_session = BigquerySession(bigquery_client = self.__bigquery_connection)
+                self.__job_config = self.__bigquery_session.start_session()
 
-        self.__logger.warn(str(self.__job_config))
-        self.__logger.warn(self.__bigquery_session.get_session_id())
+            self.__logger.warn(str(self.__job_config))
+            self.__logger.warn(self.__bigquery_session.get_session_id())
 
-        self.__bigquery_connection.query(
-            "BEGIN TRANSACTION;",
-            job_config = self.__job_config,
-        ).result()
+            QueryStatistics.run(lambda: self.__bigquery_connection.query(
+                "BEGIN TRANSACTION;",
+                job_config = self.__job_config,
+            ))
 
         return self.__job_config
 
@@ -37,39 +51,87 @@ class BigqueryTransaction (): #TODO this class should contain the logic of BigQu
         # throws Exception if transaction not initialized
         self.__check_existing_job()
 
-        job = self.__bigquery_connection.query(
-            "COMMIT TRANSACTION;",
-            job_config = self.__job_config,
-        )
+        with Tracer.span('transaction.commit'):
+            _, result = QueryStatistics.run(lambda: self.__bigquery_connection.query(
+                "COMMIT TRANSACTION;",
+                job_config = self.__job_config,
+            ))
 
-        result = job.result()
-
-        self.__bigquery_session.end_session()
-        self.__job_config = None
+            self.__end_session()
 
         return result
 
 
-    def rollback_transaction (self):
+    def rollback_transaction (self, reusable:bool = True):
+        """reusable (bool, optional): False if the session may keep state of the rolled back work (e.g. session temp tables),
+            so it is aborted instead of recycled by the pool. Default True"""
 
         # throws Exception if transaction not initialized
         self.__check_existing_job()
 
-        job = self.__bigquery_connection.query(
-            "ROLLBACK TRANSACTION;",
-            job_config=self.__job_config,
-        )
+        with Tracer.span('transaction.rollback'):
+            try:
+                _, result = QueryStatistics.run(lambda: self.__bigquery_connection.query(
+                    "ROLLBACK TRANSACTION;",
+                    job_config=self.__job_config,
+                ))
+            except Exception:
+                # the session state is unknown, it is aborted instead of recycled
+                self.__end_session(reusable = False)
+                raise
 
-        result = job.result()
-
-        self.__bigquery_session.end_session()
-        self.__job_config = None
+            self.__end_session(reusable)
 
         return result
 
+    def run(self, unit_of_work, on_retry = None):
+        """runs unit_of_work(job_config) in a new transaction and commits it, returning its result.
+        On failure the transaction is rolled back and, if the retry policy allows it, the whole unit of work
+        is run again in a new transaction after the backoff delay: it should not keep state across attempts.
+        on_retry (callable, optional): function called with the number of the failed attempt and its error before a retry"""
+        attempt = 1
+        while True:
+            try:
+                job_config = self.begin_transaction()
+                result = unit_of_work(job_config)
+                self.commit_transaction()
+                return result
+
+            except Exception as error:
+                self.__rollback_failed_attempt(error)
+                if not self.__retry_policy or not self.__retry_policy.should_retry(error, attempt):
+                    raise error
+
+                delay = self.__retry_policy.delay(attempt)
+                self.__logger.warning(f'Attempt {attempt} aborted by a concurrent transaction, retrying in {delay:.1f}s: {error}')
+                if on_retry:
+                    on_retry(attempt, error)
+                with Tracer.span('transaction.backoff', attempt = attempt, delay_ms = delay * 1000):
+                    time.sleep(delay)
+                attempt += 1
+
+    def __rollback_failed_attempt (self, error:Exception):
+        """rolls back the transaction of a failed attempt, if it was begun, keeping the error of the attempt.
+        Its session is aborted: the temp tables created by the failed unit of work are dropped with it"""
+        self.__logger.error(f'Rollback with error: {error}')
+        if not self.get_job_config:
+            return
+        try:
+            self.rollback_transaction(reusable = False)
+        except Exception as rollback_error:
+            # an aborted transaction may have no active transaction to roll back, its session is aborted
+            self.__logger.warning(f'Rollback failed with error: {rollback_error}')
+
     def close_transaction(self):
         self.__check_existing_job()
-        self.__bigquery_session.end_session()
+        self.__end_session(reusable = False)
+
+    def __end_session (self, reusable:bool = True):
+        """gives the session back to the pool (after COMMIT or ROLLBACK) or aborts it"""
+        if self.__session_pool:
+            self.__session_pool.release(self.__bigquery_session, self.__job_config, reusable)
+        else:
+            self.__bigquery_session.end_session()
         self.__job_config = None
 
     @property
@@ -0,0 +1,81 @@
+import random
+
+
+class RetryPolicy():
+    """
+    Class that decides if a failed transaction is retried and how long to wait before the next attempt:
+    exponential backoff with jitter, on the errors raised by concurrent DML on the same table.
+
+    Args:
+        max_attempts (int, optional): max number of attempts of the unit of work, the first one included. Default 5
+        initial_delay (float, optional): seconds waited after the first failure, default 1
+        max_delay (float, optional): max seconds waited between two attempts, default 60
+        multiplier (float, optional): growth of the delay at every attempt, default 2
+        jitter (float, optional): fraction of the delay drawn at random (0 no jitter, 1 full jitter), so that
+            transactions aborted together do not retry together. Default 0.5
+
+    """
+
+    # messages of the errors raised when a transaction is aborted by a concurrent one,
+    # 'database is locked' is raised by the local stand-in executor
+    RETRIABLE_ERRORS = (
+        'due to concurrent update',
+        'could not serialize access',
+        'database is locked',
+    )
+
+    def __init__(self,
+                 max_attempts:int = 5,
+                 initial_delay:float = 1,
+                 max_delay:float = 60,
+                 multiplier:float = 2,
+                 jitter:float = 0.5
+            ) -> None:
+        if max_attempts < 1:
+            raise ValueError('At least one attempt is required')
+        if not 0 <= jitter <= 1:
+            raise ValueError('Jitter should be between 0 and 1')
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def is_retriable(self, error:Exception) -> bool:
+        """ method that returns True if the error is a conflict with a concurrent transaction
+
+        Args:
+            error (Exception): error raised by the unit of work or by the commit
+
+        Returns:
+            bool: True if the unit of work can be run again
+
+        """
+        message = str(error).lower()
+        return any(retriable_error in message for retriable_error in RetryPolicy.RETRIABLE_ERRORS)
+
+    def should_retry(self, error:Exception, attempt:int) -> bool:
+        """ method that returns True if a new attempt should follow the failed one
+
+        Args:
+            error (Exception): error of the failed attempt
+            attempt (int): number of the failed attempt, starting from 1
+
+        Returns:
+            bool: True if the error is retriable and the attempts are not exhausted
+
+        """
+        return attempt < self.max_attempts and self.is_retriable(error)
+
+    def delay(self, attempt:int) -> float:
+        """ method that returns the seconds to wait after a failed attempt
+
+        Args:
+            attempt (int): number of the failed attempt, starting from 1
+
+        Returns:
+            float: seconds to wait, between (1 - jitter) and 1 times the exponential delay
+
+        """
+        delay = min(self.max_delay, self.initial_delay * self.multiplier ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
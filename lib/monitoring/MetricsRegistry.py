@@ -0,0 +1,67 @@
+import threading
+
+
+class MetricsRegistry():
+    """
+    Class that implements a thread-safe in-process registry of counters, rendered in the Prometheus text format
+    (see https://prometheus.io/docs/instrumenting/exposition_formats/).
+
+    Notes:
+        counters are cumulative since process start, every counter is identified by name and labels
+
+    """
+
+    def __init__(self) -> None:
+        self.__counters = dict()
+        self.__descriptions = dict()
+        self.__lock = threading.Lock()
+
+    def describe(self, name:str, description:str) -> None:
+        """ method used to set the description (HELP line) of a counter """
+        self.__descriptions[name] = description
+
+    def increment(self, name:str, value:float = 1, labels:dict = None) -> None:
+        """ method used to increment a counter
+
+        Args:
+            name (str): name of the counter
+            value (float, optional): increment, default 1
+            labels (dict, optional): labels of the counter
+
+        """
+        key = (name, tuple(sorted((labels or dict()).items())))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def get(self, name:str, labels:dict = None) -> float:
+        """ method that returns the value of a counter, 0 if never incremented """
+        with self.__lock:
+            return self.__counters.get((name, tuple(sorted((labels or dict()).items()))), 0)
+
+    def render(self) -> str:
+        """ method that renders the counters in the Prometheus text format
+
+        Returns:
+            str: the exposition text
+        """
+        with self.__lock:
+            counters = sorted(self.__counters.items())
+
+        lines, last_name = [], None
+        for (name, labels), value in counters:
+            if name != last_name:
+                if name in self.__descriptions:
+                    lines.append(f"# HELP {name} {self.__descriptions[name]}")
+                lines.append(f"# TYPE {name} counter")
+                last_name = name
+            label_text = ",".join(
+                '{}="{}"'.format(label, str(label_value).replace('\\', '\\\\').replace('"', '\\"')) for label, label_value in labels
+            )
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """ method that removes all the counters """
+        with self.__lock:
+            self.__counters.clear()
@@ -0,0 +1,247 @@
+import contextvars
+import logging
+import re
+import time
+from datetime import datetime
+from lib.monitoring.MetricsRegistry import MetricsRegistry
+from lib.monitoring.Tracer import Tracer
+
+
+class RunReport():
+    """
+    Class that collects the statistics of the statements issued during an ingestion run.
+    The report is active in the current context (thread) between __enter__ and __exit__,
+    every statement recorded by QueryStatistics.record in the meantime is added to it.
+
+    Args:
+        source_table (str): name of source table
+        destination_table (str): name of destination table
+        operation (str, optional): name of the ingestion method, default 'ingest_data'
+        on_close (callable, optional): function called with the report at the end of the run (e.g. to publish it)
+        on_phase (callable, optional): function called with the report at every phase change, and at the end of the run
+
+    """
+
+    def __init__(self,
+                 source_table:str,
+                 destination_table:str,
+                 operation:str = 'ingest_data',
+                 on_close = None,
+                 on_phase = None
+            ) -> None:
+        self.__on_close = on_close
+        self.__on_phase = on_phase
+        self.source_table = source_table
+        self.destination_table = destination_table
+        self.operation = operation
+        self.statements = []
+        self.phase = None
+        self.counts = dict()
+        self.status = None
+        self.wall_ms = None
+        self.__start = None
+        self.__token = None
+
+    def set_phase(self, phase:str, **counts) -> None:
+        """ method used to set the current phase of the run and to update its row counts
+
+        Args:
+            phase (str): name of the phase
+            counts: row counts of the run (e.g. rows_updated=10)
+
+        """
+        self.phase = phase
+        self.counts.update(counts)
+        if self.__on_phase:
+            self.__on_phase(self)
+
+    def __enter__(self):
+        self.__start = time.perf_counter()
+        self.__token = QueryStatistics.CURRENT_REPORT.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        QueryStatistics.CURRENT_REPORT.reset(self.__token)
+        self.wall_ms = (time.perf_counter() - self.__start) * 1000
+        self.status = 'failed' if exc_type else 'succeeded'
+
+        labels = {'destination_table': self.destination_table, 'status': self.status}
+        QueryStatistics.REGISTRY.increment('scd2_runs_total', 1, labels)
+        QueryStatistics.REGISTRY.increment('scd2_run_wall_seconds_total', self.wall_ms / 1000, labels)
+        if self.__on_close:
+            self.__on_close(self)
+        self.set_phase(self.status)
+        return False
+
+    def summary(self) -> dict:
+        """ method that aggregates the statistics of the run
+
+        Returns:
+            dict: totals of the run ('totals'), totals by statement type ('by_statement_type') and the list of statements
+        """
+        by_statement_type = dict()
+        for statement in self.statements:
+            QueryStatistics.accumulate(by_statement_type.setdefault(statement['statement_type'], dict()), statement)
+
+        totals = dict()
+        for statement in self.statements:
+            QueryStatistics.accumulate(totals, statement)
+
+        return {
+            'source_table': self.source_table,
+            'destination_table': self.destination_table,
+            'operation': self.operation,
+            'status': self.status,
+            'phase': self.phase,
+            'counts': dict(self.counts),
+            'wall_ms': self.wall_ms,
+            'totals': totals,
+            'by_statement_type': by_statement_type,
+            'statements': list(self.statements),
+        }
+
+
+class QueryStatistics():
+    """
+    Class that records the statistics of every statement issued by the lib (job id, wall time, queue time,
+    bytes processed and billed, slot milliseconds, cache hit and DML affected rows).
+    Statistics are added to the active RunReport and to the process metrics registry (REGISTRY).
+
+    """
+
+    CURRENT_REPORT = contextvars.ContextVar('scd2_run_report', default=None)
+
+    REGISTRY = MetricsRegistry()
+
+    # statement fields summed by the reports, mapped to the counters of the registry
+    COUNTERS = {
+        'wall_ms': ('scd2_statement_wall_seconds_total', 'Wall time of the statements, from submission to result', 1 / 1000),
+        'queue_ms': ('scd2_statement_queue_seconds_total', 'Time spent by the statements waiting to start', 1 / 1000),
+        'bytes_processed': ('scd2_statement_bytes_processed_total', 'Bytes processed by the statements', 1),
+        'bytes_billed': ('scd2_statement_bytes_billed_total', 'Bytes billed for the statements', 1),
+        'slot_ms': ('scd2_statement_slot_milliseconds_total', 'Slot milliseconds consumed by the statements', 1),
+        'cache_hits': ('scd2_statement_cache_hits_total', 'Statements answered from the query cache', 1),
+        'dml_affected_rows': ('scd2_statement_dml_affected_rows_total', 'Rows affected by DML statements', 1),
+    }
+
+    @staticmethod
+    def __number(value):
+        return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+    @staticmethod
+    def __milliseconds(start, end):
+        if isinstance(start, datetime) and isinstance(end, datetime):
+            return (end - start).total_seconds() * 1000
+        return None
+
+    @staticmethod
+    def statement_type(query_job) -> str:
+        """ method that returns the statement type of a job: the type returned by bigquery,
+            or the first keyword of the statement """
+        statement_type = getattr(query_job, 'statement_type', None)
+        if isinstance(statement_type, str) and statement_type:
+            return statement_type
+        query = getattr(query_job, 'query', None)
+        keyword = re.match(r'\s*(\w+)', query) if isinstance(query, str) else None
+        return keyword.group(1).upper() if keyword else 'UNKNOWN'
+
+    @staticmethod
+    def from_job(query_job, wall_time:float) -> dict:
+        """ method that reads the statistics of a completed query job
+
+        Args:
+            query_job (QueryJob): completed query job
+            wall_time (float): seconds between the submission of the job and its result
+
+        Returns:
+            dict: statistics of the statement
+        """
+        job_id = getattr(query_job, 'job_id', None)
+        cache_hit = getattr(query_job, 'cache_hit', None)
+        return {
+            'job_id': job_id if isinstance(job_id, str) else None,
+            'statement_type': QueryStatistics.statement_type(query_job),
+            'wall_ms': wall_time * 1000,
+            'queue_ms': QueryStatistics.__milliseconds(getattr(query_job, 'created', None), getattr(query_job, 'started', None)),
+            'execution_ms': QueryStatistics.__milliseconds(getattr(query_job, 'started', None), getattr(query_job, 'ended', None)),
+            'bytes_processed': QueryStatistics.__number(getattr(query_job, 'total_bytes_processed', None)),
+            'bytes_billed': QueryStatistics.__number(getattr(query_job, 'total_bytes_billed', None)),
+            'slot_ms': QueryStatistics.__number(getattr(query_job, 'slot_millis', None)),
+            'cache_hit': cache_hit if isinstance(cache_hit, bool) else None,
+            'dml_affected_rows': QueryStatistics.__number(getattr(query_job, 'num_dml_affected_rows', None)),
+        }
+
+    @staticmethod
+    def accumulate(totals:dict, statement:dict) -> dict:
+        """ method that adds the statistics of a statement to totals
+
+        Args:
+            totals (dict): aggregated statistics, updated in place
+            statement (dict): statistics of a statement (see from_job)
+
+        Returns:
+            dict: totals
+        """
+        totals['statements'] = totals.get('statements', 0) + 1
+        totals['cache_hits'] = totals.get('cache_hits', 0) + (1 if statement['cache_hit'] else 0)
+        for field in ('wall_ms', 'queue_ms', 'bytes_processed', 'bytes_billed', 'slot_ms', 'dml_affected_rows'):
+            totals[field] = totals.get(field, 0) + (statement[field] or 0)
+        return totals
+
+    @staticmethod
+    def record(query_job, wall_time:float) -> dict:
+        """ method used to record the statistics of a completed query job, in the active RunReport
+            (if any) and in the metrics registry
+
+        Args:
+            query_job (QueryJob): completed query job
+            wall_time (float): seconds between the submission of the job and its result
+
+        Returns:
+            dict: statistics of the statement
+        """
+        statement = QueryStatistics.from_job(query_job, wall_time)
+        logging.getLogger().debug(f"query statistics -> {statement}")
+
+        report = QueryStatistics.CURRENT_REPORT.get()
+        if report is not None:
+            report.statements.append(statement)
+
+        labels = {'statement_type': statement['statement_type']}
+        QueryStatistics.REGISTRY.increment('scd2_statements_total', 1, labels)
+        for field, value in QueryStatistics.accumulate(dict(), statement).items():
+            if field in QueryStatistics.COUNTERS and value:
+                name, _, scale = QueryStatistics.COUNTERS[field]
+                QueryStatistics.REGISTRY.increment(name, value * scale, labels)
+
+        return statement
+
+    @staticmethod
+    def run(submit):
+        """ method that submits a query job, waits for its result and records its statistics
+
+        Args:
+            submit (callable): function submitting the query job (e.g. lambda: client.query(...))
+
+        Returns:
+            tuple: the query job and its result
+        """
+        with Tracer.span('statement') as span:
+            start = time.perf_counter()
+            query_job = submit()
+            result = query_job.result()
+            statement = QueryStatistics.record(query_job, time.perf_counter() - start)
+            span.set(
+                statement_type = statement['statement_type'],
+                job_id = statement['job_id'],
+                rows = statement['dml_affected_rows'],
+                bytes = statement['bytes_processed']
+            )
+        return query_job, result
+
+
+QueryStatistics.REGISTRY.describe('scd2_statements_total', 'Statements issued by the lib')
+QueryStatistics.REGISTRY.describe('scd2_runs_total', 'Ingestion runs')
+QueryStatistics.REGISTRY.describe('scd2_run_wall_seconds_total', 'Wall time of the ingestion runs')
+for counter_name, counter_description, _ in QueryStatistics.COUNTERS.values():
+    QueryStatistics.REGISTRY.describe(counter_name, counter_description)
@@ -0,0 +1,228 @@
+import contextvars
+import json
+import threading
+import time
+import tracemalloc
+import uuid
+
+
+class InMemorySpanExporter():
+    """ Class that keeps the finished spans in memory (e.g. for tests) """
+
+    def __init__(self) -> None:
+        self.spans = []
+        self.__lock = threading.Lock()
+
+    def export(self, span:dict) -> None:
+        with self.__lock:
+            self.spans.append(span)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.spans.clear()
+
+
+class JsonLinesSpanExporter():
+    """
+    Class that appends the finished spans to a JSON-lines file, one span per line.
+
+    Args:
+        path (str): path of the file
+
+    """
+
+    def __init__(self, path:str) -> None:
+        self.__path = path
+        self.__lock = threading.Lock()
+
+    def export(self, span:dict) -> None:
+        line = json.dumps(span, default = str)
+        with self.__lock:
+            with open(self.__path, 'a') as spans_file:
+                spans_file.write(line + '\n')
+
+
+class Span():
+    """
+    Class that records a traced phase: start/end time, attributes (e.g. rows, bytes), error
+    and the Python peak memory allocated during the phase (if memory tracing is enabled).
+
+    Args:
+        name (str): name of the phase
+        attributes (dict): attributes of the phase
+        exporter: exporter of the finished span
+        trace_memory (bool): True if tracemalloc peak memory is recorded
+
+    Notes:
+        the tracemalloc peak is process-wide: a span whose lifetime overlaps a span of another thread
+        (e.g. concurrent runs or shards) cannot tell its own peak, its peak memory is None
+
+    """
+
+    # threads with open memory traced spans, and a counter incremented when spans of different threads overlap
+    __memory_lock = threading.Lock()
+    __memory_threads = dict()
+    __overlaps = 0
+
+    def __init__(self, name:str, attributes:dict, exporter, trace_memory:bool) -> None:
+        self.name = name
+        self.attributes = attributes
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = None
+        self.trace_id = None
+        self.__exporter = exporter
+        self.__trace_memory = trace_memory
+        self.__token = None
+        self.__start = None
+        self.__start_time = None
+        self.__start_memory = 0
+        self.__peak_memory = 0
+        self.__overlaps_at_start = None
+
+    def set(self, **attributes) -> None:
+        """ method used to add attributes to the span (e.g. rows=10, bytes=1024) """
+        self.attributes.update(attributes)
+
+    def __observe_peak(self, peak:int) -> None:
+        self.__peak_memory = max(self.__peak_memory, peak)
+
+    def __enter__(self):
+        self.parent = Tracer.CURRENT_SPAN.get()
+        self.trace_id = self.parent.trace_id if self.parent else uuid.uuid4().hex
+        if self.__trace_memory and tracemalloc.is_tracing():
+            thread = threading.get_ident()
+            with Span.__memory_lock:
+                concurrent = any(other_thread != thread for other_thread in Span.__memory_threads)
+                Span.__memory_threads[thread] = Span.__memory_threads.get(thread, 0) + 1
+                if concurrent:
+                    # the peak is not reset, the open spans of the other threads are measuring it
+                    Span.__overlaps += 1
+                else:
+                    current, peak = tracemalloc.get_traced_memory()
+                    if self.parent:
+                        # the peak reached so far belongs to the parent span, it is kept before resetting it
+                        self.parent.__observe_peak(peak)
+                    tracemalloc.reset_peak()
+                    self.__start_memory = self.__peak_memory = current
+                    self.__overlaps_at_start = Span.__overlaps
+        self.__token = Tracer.CURRENT_SPAN.set(self)
+        self.__start_time = time.time()
+        self.__start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration_ms = (time.perf_counter() - self.__start) * 1000
+        Tracer.CURRENT_SPAN.reset(self.__token)
+
+        peak_memory = None
+        if self.__trace_memory and tracemalloc.is_tracing():
+            thread = threading.get_ident()
+            with Span.__memory_lock:
+                Span.__memory_threads[thread] = Span.__memory_threads.get(thread, 1) - 1
+                if not Span.__memory_threads[thread]:
+                    del Span.__memory_threads[thread]
+                # no span of another thread was open during the span
+                if self.__overlaps_at_start is not None and self.__overlaps_at_start == Span.__overlaps:
+                    self.__observe_peak(tracemalloc.get_traced_memory()[1])
+                    peak_memory = self.__peak_memory - self.__start_memory
+                    if self.parent:
+                        self.parent.__observe_peak(self.__peak_memory)
+
+        self.__exporter.export({
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent.span_id if self.parent else None,
+            'name': self.name,
+            'start_time': self.__start_time,
+            'end_time': self.__start_time + duration_ms / 1000,
+            'duration_ms': duration_ms,
+            'peak_memory_bytes': peak_memory,
+            'error': repr(exc_value) if exc_value else None,
+            'attributes': self.attributes,
+        })
+        return False
+
+
+class NoopSpan():
+    """ Class of the span returned when tracing is disabled, every method does nothing """
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Tracer():
+    """
+    Class that implements span-based tracing of the ingestion phases.
+    Tracing is disabled by default: Tracer.span returns a shared no-op span, so instrumented code pays a single check.
+
+        Tracer.configure(JsonLinesSpanExporter('spans.jsonl'), trace_memory=True)
+        with Tracer.span('compare_tables', source_table=src_table) as span:
+            ...
+            span.set(rows=len(data))
+
+    Notes:
+        memory tracing starts tracemalloc, that slows down Python allocations: it should be enabled only while investigating.
+        The peak memory is recorded only for the spans that do not overlap spans of other threads (see Span)
+
+    """
+
+    CURRENT_SPAN = contextvars.ContextVar('scd2_current_span', default=None)
+
+    NOOP_SPAN = NoopSpan()
+
+    EXPORTER = None
+
+    TRACE_MEMORY = False
+
+    __started_tracemalloc = False
+
+    @staticmethod
+    def configure(exporter, trace_memory:bool = False) -> None:
+        """ method used to enable tracing
+
+        Args:
+            exporter: exporter of the finished spans (object with an export(span:dict) method)
+            trace_memory (bool, optional): if True, the Python peak memory of every span is recorded with tracemalloc. Default False
+
+        """
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            Tracer.__started_tracemalloc = True
+        Tracer.TRACE_MEMORY = trace_memory
+        Tracer.EXPORTER = exporter
+
+    @staticmethod
+    def disable() -> None:
+        """ method used to disable tracing, stopping tracemalloc if started by configure """
+        Tracer.EXPORTER = None
+        Tracer.TRACE_MEMORY = False
+        if Tracer.__started_tracemalloc:
+            tracemalloc.stop()
+            Tracer.__started_tracemalloc = False
+
+    @staticmethod
+    def is_enabled() -> bool:
+        """ method that returns True if tracing is enabled, to skip computing expensive attributes otherwise """
+        return Tracer.EXPORTER is not None
+
+    @staticmethod
+    def span(name:str, **attributes):
+        """ method that returns the span of a phase, to be used as context manager
+
+        Args:
+            name (str): name of the phase
+            attributes: attributes of the phase
+
+        Returns:
+            Span: the span, a no-op span if tracing is disabled
+
+        """
+        if Tracer.EXPORTER is None:
+            return Tracer.NOOP_SPAN
+        return Span(name, attributes, Tracer.EXPORTER, Tracer.TRACE_MEMORY)
@@ -0,0 +1,266 @@
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from lib.data.ingestor.DataIngestor import DataIngestor
+
+
+class IngestionRun():
+    """
+    Class that holds the status of an ingestion run submitted to IngestionRunner.
+
+    Args:
+        source_table (str): name of source table
+        destination_table (str): name of destination table
+        pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+        operation (str): ingestion method of DataIngestor ('ingest_data' or 'apply_changes')
+        run_token (str, optional): idempotency token of the run (see DataIngestor.ingest_data), default None
+
+    """
+
+    def __init__(self, source_table:str, destination_table:str, pkey, operation:str, run_token:str = None) -> None:
+        self.run_id = uuid.uuid4().hex
+        self.run_token = run_token
+        self.source_table = source_table
+        self.destination_table = destination_table
+        self.pkey = pkey
+        self.operation = operation
+        self.status = 'queued'
+        self.phase = 'queued'
+        self.counts = dict()
+        self.error = None
+        self.report = None
+        self.triggers = 1
+        self.submitted_at = datetime.now(timezone.utc)
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def key(self) -> tuple:
+        """ the triggers of the same key are coalesced in the same run """
+        pkey = self.pkey if isinstance(self.pkey, str) else tuple(self.pkey)
+        return (self.source_table, self.destination_table, pkey, self.operation)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self) -> dict:
+        """ method that returns the status of the run as a JSON serializable dict """
+        return {
+            'run_id': self.run_id,
+            'source_table': self.source_table,
+            'destination_table': self.destination_table,
+            'pkey': self.pkey,
+            'operation': self.operation,
+            'run_token': self.run_token,
+            'triggers': self.triggers,
+            'status': self.status,
+            'phase': self.phase,
+            'counts': dict(self.counts),
+            'error': self.error,
+            'report': self.report['totals'] if self.report else None,
+            'submitted_at': self.submitted_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'wall_ms': (self.finished_at - self.started_at).total_seconds() * 1000 if self.finished_at and self.started_at else None,
+        }
+
+
+class IngestionRunner():
+    """
+    Class that runs DataIngestor ingestions on a bounded pool of background threads,
+    returning a run id immediately and keeping the status of every run.
+
+    Args:
+        ingestor (DataIngestor): ingestor shared by the runs
+        max_workers (int, optional): number of concurrent runs, default 4
+        max_pending (int, optional): max number of queued runs, waiting for a worker. Above it submit raises RuntimeError. Default 100
+        result_ttl (float, optional): seconds a finished run is kept, default 3600
+        coalesce_window (float, optional): if set, a new run waits coalesce_window seconds before starting, and every trigger
+            of the same source, destination, pkey and operation submitted while the run is still queued joins it, getting
+            its run id. If None, every trigger is a run. Default None
+
+    Notes:
+        the runs of the same destination table are serialized: a run waits (without taking a worker) until the previous run
+        on its destination ends, while the runs of different destinations proceed in parallel.
+        A run that has started never absorbs new triggers, so every trigger is followed by a run reading the source after it
+
+    """
+
+    def __init__(self,
+                 ingestor:DataIngestor,
+                 max_workers:int = 4,
+                 max_pending:int = 100,
+                 result_ttl:float = 3600,
+                 coalesce_window:float = None
+            ) -> None:
+        self.__ingestor = ingestor
+        self.__executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'scd2_run')
+        self.__slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self.__result_ttl = result_ttl
+        self.__coalesce_window = coalesce_window
+        self.__runs = dict()
+        # queued runs by key, joined by the following triggers
+        self.__queued_runs = dict()
+        # destinations with a running run, and the runs waiting for them
+        self.__busy_destinations = set()
+        self.__waiting_runs = dict()
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger()
+
+    def submit(self, source_table:str, destination_table:str, pkey, operation:str = 'ingest_data', run_token:str = None) -> str:
+        """ method used to enqueue an ingestion run
+
+        Args:
+            source_table (str): name of source table
+            destination_table (str): name of destination table
+            pkey (str | list): name of primary (or surrogate) key, or list of the columns of a composite key
+            operation (str, optional): ingestion method of DataIngestor ('ingest_data' or 'apply_changes'), default 'ingest_data'
+            run_token (str, optional): idempotency token of the run: a run resubmitted with the token of a committed run
+                does nothing (the ingestor requires a state store). Default None
+
+        Returns:
+            str: run id, the id of the queued run joined by the trigger when it is coalesced
+
+        Raises:
+            RuntimeError: if max_pending runs are already waiting for a worker
+
+        """
+        if operation not in ('ingest_data', 'apply_changes'):
+            raise ValueError(f'Unknown ingestion operation {operation}')
+
+        self.__expire_runs()
+        run = IngestionRun(source_table, destination_table, pkey, operation, run_token)
+        # lookup and registration in the same critical section, so that concurrent triggers of a key get a single run
+        with self.__lock:
+            queued_run = self.__queued_runs.get(run.key) if self.__coalesce_window is not None else None
+            if queued_run:
+                queued_run.triggers += 1
+                self.__logger.info(f'Trigger of {source_table} -> {destination_table} coalesced in run {queued_run.run_id}')
+                return queued_run.run_id
+
+            if not self.__slots.acquire(blocking = False):
+                raise RuntimeError('Too many pending ingestion runs')
+
+            self.__runs[run.run_id] = run
+            if self.__coalesce_window is not None:
+                self.__queued_runs[run.key] = run
+
+        try:
+            if self.__coalesce_window:
+                timer = threading.Timer(self.__coalesce_window, self.__dispatch, [run])
+                timer.daemon = True
+                timer.start()
+            else:
+                self.__dispatch(run)
+        except Exception:
+            with self.__lock:
+                self.__queued_runs.pop(run.key, None)
+            self.__slots.release()
+            raise
+
+        self.__logger.info(f'Run {run.run_id} queued for {source_table} -> {destination_table}')
+        return run.run_id
+
+    def __dispatch(self, run:IngestionRun) -> None:
+        """ private method that gives a run to the workers, or parks it while its destination is busy """
+        with self.__lock:
+            if run.destination_table in self.__busy_destinations:
+                self.__waiting_runs.setdefault(run.destination_table, deque()).append(run)
+                return
+            self.__busy_destinations.add(run.destination_table)
+        self.__executor.submit(self.__execute, run)
+
+    def __release_destination(self, destination_table:str) -> None:
+        """ private method that starts the next run waiting for the destination, or frees the destination """
+        with self.__lock:
+            waiting_runs = self.__waiting_runs.get(destination_table)
+            next_run = waiting_runs.popleft() if waiting_runs else None
+            if waiting_runs is not None and not waiting_runs:
+                del self.__waiting_runs[destination_table]
+            if not next_run:
+                self.__busy_destinations.discard(destination_table)
+                return
+        self.__executor.submit(self.__execute, next_run)
+
+    def __on_phase(self, run:IngestionRun, report) -> None:
+        run.phase = report.phase
+        run.counts = dict(report.counts)
+        if report.status:
+            run.report = report.summary()
+
+    def __execute(self, run:IngestionRun) -> None:
+        """ private method that runs an ingestion in a worker thread, updating its status """
+        with self.__lock:
+            # from now on the following triggers need a new run
+            if self.__queued_runs.get(run.key) is run:
+                del self.__queued_runs[run.key]
+        run.started_at = datetime.now(timezone.utc)
+        run.status = 'running'
+        status = 'failed'
+        try:
+            run_token = {'run_token': run.run_token} if run.run_token else dict()
+            getattr(self.__ingestor, run.operation)(
+                run.source_table, run.destination_table, run.pkey, progress = lambda report: self.__on_phase(run, report), **run_token
+            )
+            status = 'succeeded'
+        except Exception as error:
+            run.error = str(error)
+            self.__logger.error(f'Run {run.run_id} failed with error {error}')
+        finally:
+            # finished_at is set before the final status, so that a finished run always has it
+            run.finished_at = datetime.now(timezone.utc)
+            run.status = status
+            self.__slots.release()
+            self.__release_destination(run.destination_table)
+
+    def __expire_runs(self) -> None:
+        """ private method that removes the finished runs older than result_ttl """
+        now = datetime.now(timezone.utc)
+        with self.__lock:
+            for run_id in [
+                run_id for run_id, run in self.__runs.items()
+                if run.is_finished and (now - run.finished_at).total_seconds() > self.__result_ttl
+            ]:
+                del self.__runs[run_id]
+
+    def get_run(self, run_id:str) -> dict:
+        """ method that returns the status of a run
+
+        Args:
+            run_id (str): run id returned by submit
+
+        Returns:
+            dict: the status of the run (see IngestionRun.to_dict), None if the run does not exist or is expired
+
+        """
+        self.__expire_runs()
+        with self.__lock:
+            run = self.__runs.get(run_id)
+        return run.to_dict() if run else None
+
+    def wait(self, run_id:str, timeout:float = None) -> dict:
+        """ method that waits for the end of a run
+
+        Args:
+            run_id (str): run id returned by submit
+            timeout (float, optional): max seconds to wait. If None, waits forever
+
+        Returns:
+            dict: the status of the run (see get_run)
+
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.__lock:
+            run = self.__runs.get(run_id)
+        while run and not run.is_finished and (deadline is None or time.monotonic() < deadline):
+            time.sleep(0.05)
+        return self.get_run(run_id)
+
+    def shutdown(self, wait:bool = True) -> None:
+        """ method that stops the workers, waiting for the running ingestions if wait is True """
+        self.__executor.shutdown(wait = wait)
@@ -0,0 +1,135 @@
+""" Manifest-driven runner of SCD2 ingestions on many table pairs.
+
+Run it from the repository folder:
+
+    python -m lib.runner.ManifestRunner manifest.yaml --project-id my-prj
+"""
+import argparse
+import json
+import logging
+import time
+from lib.data.ingestor.DataIngestor import DataIngestor
+from lib.runner.IngestionRunner import IngestionRunner
+
+
+class ManifestRunner():
+    """
+    Class that runs the ingestion of the table pairs listed in a manifest concurrently, on top of IngestionRunner,
+    and returns a consolidated report.
+
+    The manifest is a JSON or YAML document like
+
+        concurrency: 4                  # optional, default max_workers
+        operation: ingest_data          # optional, ingest_data or apply_changes
+        tables:
+          - src_table: transformation_scd2.table_1_partners_input
+            dest_table: transformation_scd2.table_2_partners_output
+            pkey: PartnerID             # or the list of columns of a composite key, e.g. [PartnerID, Country]
+            operation: apply_changes    # optional, overrides the manifest operation
+
+    Args:
+        ingestor (DataIngestor): ingestor shared by the runs, every run opens its own session and transaction
+        max_workers (int, optional): default number of concurrent runs, default 4
+
+    """
+
+    def __init__(self, ingestor:DataIngestor, max_workers:int = 4) -> None:
+        self.__ingestor = ingestor
+        self.__max_workers = max_workers
+        self.__logger = logging.getLogger()
+
+    @staticmethod
+    def load_manifest(path:str) -> dict:
+        """ method that reads a manifest from a JSON or YAML file
+
+        Args:
+            path (str): path of the manifest, YAML if the extension is .yaml or .yml
+
+        Returns:
+            dict: the manifest
+
+        Notes:
+            YAML manifests require PyYAML
+        """
+        with open(path) as manifest_file:
+            if path.endswith(('.yaml', '.yml')):
+                try:
+                    import yaml
+                except ImportError as error:
+                    raise ValueError(f'PyYAML is required to read the YAML manifest {path} (pip install PyYAML), or use a JSON manifest') from error
+                return yaml.safe_load(manifest_file)
+            return json.load(manifest_file)
+
+    @staticmethod
+    def __validate(manifest:dict) -> list:
+        tables = manifest.get('tables') if isinstance(manifest, dict) else None
+        if not tables:
+            raise ValueError('Manifest without tables')
+        for position, table in enumerate(tables):
+            missing = [field for field in ('src_table', 'dest_table', 'pkey') if not table.get(field)]
+            if missing:
+                raise ValueError(f'Table {position} of manifest without {", ".join(missing)}')
+        return tables
+
+    def run(self, manifest:dict) -> dict:
+        """ method that runs the ingestion of every table pair of the manifest and waits for all of them
+
+        Args:
+            manifest (dict): the manifest (see load_manifest)
+
+        Returns:
+            dict: consolidated report with the overall status ('succeeded' if every pair succeeded), wall time,
+                number of succeeded and failed pairs and the status of every pair (see IngestionRun.to_dict)
+
+        """
+        tables = ManifestRunner.__validate(manifest)
+        concurrency = manifest.get('concurrency') or self.__max_workers
+        runner = IngestionRunner(self.__ingestor, max_workers = concurrency, max_pending = len(tables), result_ttl = float('inf'))
+
+        start = time.perf_counter()
+        try:
+            run_ids = [
+                runner.submit(table['src_table'], table['dest_table'], table['pkey'],
+                              table.get('operation') or manifest.get('operation') or 'ingest_data')
+                for table in tables
+            ]
+            runs = [runner.wait(run_id) for run_id in run_ids]
+        finally:
+            runner.shutdown()
+        wall_ms = (time.perf_counter() - start) * 1000
+
+        failed = [run for run in runs if run['status'] != 'succeeded']
+        for run in failed:
+            self.__logger.error(f"Ingestion {run['source_table']} -> {run['destination_table']} failed with error {run['error']}")
+
+        return {
+            'status': 'failed' if failed else 'succeeded',
+            'wall_ms': wall_ms,
+            'concurrency': concurrency,
+            'succeeded': len(runs) - len(failed),
+            'failed': len(failed),
+            'tables': runs,
+        }
+
+
+if __name__ == "__main__":
+    from lib.dbmanagement.connector.ConnectorFactory import ConnectorFactory
+
+    parser = argparse.ArgumentParser(description = 'Run Transformation SCD2 on the table pairs of a manifest')
+    parser.add_argument('manifest', help = 'path of JSON or YAML manifest')
+    parser.add_argument('--project-id', default = 'my-prj')
+    parser.add_argument('--engine', choices = sorted(ConnectorFactory.ENGINES), default = 'bigquery')
+    parser.add_argument('--database-dir', help = 'folder of the local database files (local engine)')
+    parser.add_argument('--concurrency', type = int, default = 4)
+    arguments = parser.parse_args()
+
+    manifest = ManifestRunner.load_manifest(arguments.manifest)
+    if arguments.engine == 'local':
+        connector = ConnectorFactory.create(arguments.engine, database_dir = arguments.database_dir)
+    else:
+        connector = ConnectorFactory.create(arguments.engine, project_id = arguments.project_id)
+    ingestor = DataIngestor(connector.get_client())
+    report = ManifestRunner(ingestor, max_workers = arguments.concurrency).run(manifest)
+
+    print(json.dumps(report, indent = 2, default = str))
+    exit(0 if report['status'] == 'succeeded' else 1)
@@ -14,7 +14,11 @@ CREATE TABLE IF NOT EXISTS `my-prj.transformation_scd2.table_2_partners_output`
     Date_From DATETIME NOT NULL,
     Date_To DATETIME NOT NULL,
     Is_valid STRING NOT NULL
-);
+)
+-- closed versions are partitioned by month of Date_To, valid versions (Date_To 9999-12-31, beyond the 2159-12-31
+-- upper bound of the partition range) are stored in the __UNPARTITIONED__ partition
+PARTITION BY DATETIME_TRUNC(Date_To, MONTH)
+CLUSTER BY Is_valid, PartnerID;
 
 -- populate table with data
 INSERT INTO `my-prj.transformation_scd2.table_2_partners_output` (TechnicalKey, PartnerID, Name, Canton, Date_From, Date_To, Is_valid) VALUES
@@ -0,0 +1,60 @@
+from lib.data.changedetection.ChecksumChangeDetector import ChecksumChangeDetector
+from lib.data.changedetection.MetadataChangeDetector import MetadataChangeDetector
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from datetime import datetime
+from unittest import mock
+
+
+class TestChangeDetector():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.client = LocalConnector().get_client()
+        self.client.create_dataset('test')
+        self.client.query("""
+            create table `test.source` (PartnerID INT64 NOT NULL, Name STRING);
+            insert into `test.source` values (101, 'Store A'), (102, 'Store B');
+        """)
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        self.client.close()
+
+    ### Tests
+
+    def test_checksum_changes_with_the_rows(self):
+        detector = ChecksumChangeDetector(self.client)
+        fingerprint = detector.source_fingerprint('test.source')
+
+        assert detector.source_fingerprint('test.source') == fingerprint
+        assert fingerprint.startswith('2|')
+
+        self.client.query("update `test.source` set Name = 'Store B2' where PartnerID = 102")
+        updated_fingerprint = detector.source_fingerprint('test.source')
+        self.client.query("insert into `test.source` values (102, 'Store B2')")
+        duplicated_fingerprint = detector.source_fingerprint('test.source')
+
+        assert updated_fingerprint != fingerprint
+        assert duplicated_fingerprint != updated_fingerprint
+
+    def test_metadata_uses_modification_time_and_rows(self):
+        client = mock.MagicMock()
+        client.get_table.return_value = mock.MagicMock(modified=datetime(2023, 1, 1, 12, 0), num_rows=42)
+        detector = MetadataChangeDetector(client)
+
+        assert detector.source_fingerprint('test.source') == '2023-01-01T12:00:00|42'
+
+    def test_metadata_without_modification_time_never_skips(self):
+        assert MetadataChangeDetector(self.client).source_fingerprint('test.source') is None
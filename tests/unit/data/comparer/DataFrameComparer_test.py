@@ -0,0 +1,118 @@
+from lib.data.comparer.DataFrameComparer import DataFrameComparer
+from lib.data.comparer.TableComparer import TableComparer
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+import numpy
+import pandas
+import time
+import pytest
+from pandas import DataFrame
+
+
+class TestDataFrameComparer():
+
+    SAMPLE_SETUP_STMT = """
+        create table `transformation_scd2.table_1_partners_input` (PartnerID INTEGER NOT NULL, Name STRING, Canton STRING);
+        create table `transformation_scd2.table_2_partners_output` (
+            TechnicalKey INTEGER NOT NULL, PartnerID INTEGER NOT NULL, Name STRING, Canton STRING,
+            Date_From DATETIME NOT NULL, Date_To DATETIME NOT NULL, Is_valid STRING NOT NULL
+        );
+        insert into `transformation_scd2.table_1_partners_input` values
+            (101, 'Store A', 'ZH'), (103, 'Store C', NULL), (104, 'Salon D', 'GE'), (105, 'Bookshop E', 'BS'), (106, 'Shop F', 'VD');
+        insert into `transformation_scd2.table_2_partners_output` values
+            (456789, 101, 'Store A', 'ZH', '2000-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (123456, 102, 'Store B', 'BE', '2001-04-08 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (789012, 103, 'Store C', NULL, '2011-11-15 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (345678, 104, 'Salon D', 'GE', '2002-02-08 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (111111, 105, 'Bookshop E', 'BE', '2020-01-01 00:00:00', '2023-04-30 00:00:00', 'no'),
+            (901234, 105, 'Bookshop E', 'ZH', '2023-05-01 00:00:00', '9999-01-01 00:00:00', 'yes');
+    """
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.client = LocalConnector().get_client()
+        self.client.create_dataset('transformation_scd2')
+        self.client.query(TestDataFrameComparer.SAMPLE_SETUP_STMT)
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        self.client.close()
+
+    def __sorted(self, data:DataFrame) -> DataFrame:
+        return data.sort_values(by=['operation', 'PartnerID']).reset_index(drop=True)
+
+    ### Tests
+
+    def test_compare_dataframes(self):
+        destination = DataFrame({'id': [1, 2, 3, 4], 'name': ['a', 'b', None, 'd']})
+        # 1 unchanged, 2 updated, 3 unchanged with NULL, 4 deleted, 5 new and duplicated; columns in another order
+        source = DataFrame({'name': ['a', 'B', None, 'e', 'e'], 'id': [1, 2, 3, 5, 5]})
+
+        differences = DataFrameComparer.compare_dataframes(source, destination)
+
+        assert list(differences.columns) == ['id', 'name', 'operation']
+        assert differences.values.tolist() == [[2, 'B', 1], [5, 'e', 1], [2, 'b', 2], [4, 'd', 2]]
+
+    def test_compare_dataframes_aligns_types(self):
+        destination = DataFrame({'id': pandas.Series([1, 2], dtype='Int64'), 'amount': [1.5, 2.0]})
+        source = DataFrame({'id': [1, 2], 'amount': ['1.5', '2.5']})
+
+        differences = DataFrameComparer.compare_dataframes(source, destination)
+
+        assert differences['operation'].tolist() == [1, 2]
+        assert differences['amount'].tolist() == [2.5, 2.0]
+
+    def test_compare_dataframes_rejects_different_columns(self):
+        with pytest.raises(ValueError):
+            DataFrameComparer.compare_dataframes(DataFrame({'id': [1], 'other': [1]}), DataFrame({'id': [1], 'name': ['a']}))
+
+    def test_compare_tables_matches_table_comparer(self, tmp_path):
+        source = self.client.query("select * from `transformation_scd2.table_1_partners_input`").to_dataframe()
+        source.to_parquet(tmp_path / 'partners.parquet', index=False)
+        source.to_csv(tmp_path / 'partners.csv', index=False)
+
+        expected = TableComparer(self.client).compare_tables(
+            'transformation_scd2.table_1_partners_input', 'transformation_scd2.table_2_partners_output')
+        comparer = DataFrameComparer(self.client)
+
+        for source_file in (source, str(tmp_path / 'partners.parquet'), str(tmp_path / 'partners.csv')):
+            differences = comparer.compare_tables(source_file, 'transformation_scd2.table_2_partners_output', 'PartnerID')
+            assert self.__sorted(differences).equals(self.__sorted(expected))
+
+    def test_compare_tables_in_fingerprint_mode(self):
+        self.client.query("alter table `transformation_scd2.table_2_partners_output` add column Row_Hash INT64")
+        source = DataFrame({'PartnerID': [101], 'Name': ['Store A'], 'Canton': ['ZH']})
+
+        differences = DataFrameComparer(self.client, fingerprint_column='Row_Hash').compare_tables(
+            source, 'transformation_scd2.table_2_partners_output', 'PartnerID')
+
+        assert list(differences.columns) == ['PartnerID', 'Name', 'Canton', 'Row_Hash', 'operation']
+        assert differences['Row_Hash'].isna().all()
+
+    def test_unsupported_source(self):
+        with pytest.raises(ValueError):
+            DataFrameComparer.read_source('partners.json')
+
+    def test_compare_dataframes_throughput(self):
+        num_rows = 1000000
+        destination = DataFrame({'id': numpy.arange(num_rows), 'amount': numpy.arange(num_rows) * 1.5, 'code': numpy.arange(num_rows) % 7})
+        source = destination.copy()
+        source.loc[::10, 'amount'] = -1.0
+
+        start = time.perf_counter()
+        differences = DataFrameComparer.compare_dataframes(source, destination)
+        elapsed = time.perf_counter() - start
+
+        assert len(differences) == 2 * num_rows // 10
+        assert elapsed < 5
@@ -1,8 +1,13 @@
 from lib.data.comparer.TableComparer import TableComparer
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
 from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+import datetime
+import pandas
+import pyarrow
 import logging
 from pandas import DataFrame
 from unittest import mock
+import pytest
 
 
 class TestTableComparer():
@@ -47,3 +52,195 @@ class TestTableComparer():
         data_to_ingest = comparer.compare_tables('source_table', 'dest_table')
 
         assert data_to_ingest.equals(test_data)
+
+    @mock.patch('google.cloud.bigquery.Client')
+    def test_compare_tables_on_fingerprint(self, mock_bigquery):
+        comparer = TableComparer(bigquery_connection=mock_bigquery, fingerprint_column='Row_Hash')
+        comparer.compare_tables('source_table', 'dest_table', 'id')
+
+        sql_difference_query = mock_bigquery.query.call_args[0][0]
+
+        assert 'FARM_FINGERPRINT(TO_JSON_STRING(src)) as Row_Hash' in sql_difference_query
+        assert 'dest_keys.id = src_table.id' in sql_difference_query
+        assert 'except distinct' not in sql_difference_query
+
+    @mock.patch('google.cloud.bigquery.Client')
+    def test_compare_tables_on_fingerprint_requires_pkey(self, mock_bigquery):
+        comparer = TableComparer(bigquery_connection=mock_bigquery, fingerprint_column='Row_Hash')
+
+        with pytest.raises(ValueError):
+            comparer.compare_tables('source_table', 'dest_table')
+
+    def test_compare_tables_in_batches(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('test')
+        client.query("""
+            create table `test.source_table` (id INT64, col1 STRING);
+            create table `test.dest_table` (TechnicalKey INT64, id INT64, col1 STRING, Date_From DATETIME, Date_To DATETIME, Is_valid STRING);
+            insert into `test.source_table` values (101, 'a'), (102, 'b2'), (104, 'd');
+            insert into `test.dest_table` values
+                (1, 101, 'a', '2022-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+                (2, 102, 'b', '2022-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+                (3, 103, 'c', '2022-01-01 00:00:00', '9999-01-01 00:00:00', 'yes');
+        """)
+        comparer = TableComparer(bigquery_connection=client)
+
+        batches = list(comparer.compare_tables_in_batches('test.source_table', 'test.dest_table', 'id', batch_size=2))
+        full_result = comparer.compare_tables('test.source_table', 'test.dest_table', 'id')
+        client.close()
+
+        assert [len(batch) for batch in batches] == [2, 2]
+        # deleted/updated versions first
+        assert pandas.concat(batches)['operation'].tolist() == [2, 2, 1, 1]
+        assert sorted(pandas.concat(batches).to_dict(orient='records'), key=str) == sorted(full_result.to_dict(orient='records'), key=str)
+
+    def test_add_fingerprint_column(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('test')
+        client.query("""
+            create table `test.source_table` (id INT64, col1 STRING);
+            create table `test.dest_table` (TechnicalKey INT64, id INT64, col1 STRING, Date_From DATETIME, Date_To DATETIME, Is_valid STRING);
+            insert into `test.source_table` values (101, 'a'), (102, 'b2'), (104, 'd');
+            insert into `test.dest_table` values
+                (1, 101, 'a', '2022-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+                (2, 102, 'b', '2022-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+                (3, 103, 'c', '2021-01-01 00:00:00', '2021-12-31 00:00:00', 'no');
+        """)
+        comparer = TableComparer(bigquery_connection=client, fingerprint_column='Row_Hash')
+
+        comparer.add_fingerprint_column('test.dest_table')
+        # the column already exists: only the missing fingerprints are computed
+        comparer.add_fingerprint_column('test.dest_table')
+        fingerprints = client.query("select id, Row_Hash from `test.dest_table` order by id").to_dataframe()
+        differences = comparer.compare_tables('test.source_table', 'test.dest_table', 'id')
+        client.close()
+
+        # closed versions keep a NULL fingerprint
+        assert fingerprints['Row_Hash'].notna().tolist() == [True, True, False]
+        # the fingerprint of the unchanged version 101 matches the source one
+        assert sorted(zip(differences['id'], differences['operation'])) == [(102, 1), (102, 2), (104, 1)]
+
+    def test_compare_tables_incremental(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('test')
+        client.query("""
+            create table `test.source_table` (id INT64, col1 STRING, last_modified DATETIME);
+            create table `test.dest_table` (
+                TechnicalKey INT64, id INT64, col1 STRING, last_modified DATETIME, Date_From DATETIME, Date_To DATETIME, Is_valid STRING
+            );
+            insert into `test.source_table` values
+                (101, 'a2', '2023-02-01 00:00:00'), (103, 'c', '2023-01-01 00:00:00'), (104, 'd', '2023-02-01 00:00:00');
+            insert into `test.dest_table` values
+                (1, 101, 'a', '2023-01-01 00:00:00', '2023-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+                (2, 102, 'b', '2023-01-01 00:00:00', '2023-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+                (3, 103, 'c_old', '2022-01-01 00:00:00', '2022-01-01 00:00:00', '9999-01-01 00:00:00', 'yes');
+        """)
+        comparer = TableComparer(bigquery_connection=client, watermark_column='last_modified')
+
+        current_watermark = comparer.current_watermark('test.source_table')
+        result = comparer.compare_tables('test.source_table', 'test.dest_table', 'id', ('2023-01-01 00:00:00', current_watermark))
+        client.close()
+
+        assert current_watermark == '2023-02-01 00:00:00'
+        # 103 differs but is not changed since the previous watermark, so it is not read
+        assert sorted(zip(result['id'], result['col1'], result['operation'])) == [
+            (101, 'a', 2), (101, 'a2', 1), (102, 'b', 2), (104, 'd', 1)
+        ]
+
+    def test_compare_tables_incremental_with_null_source_key(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('test')
+        client.query("""
+            create table `test.source_table` (id INT64, col1 STRING, last_modified DATETIME);
+            create table `test.dest_table` (
+                TechnicalKey INT64, id INT64, col1 STRING, last_modified DATETIME, Date_From DATETIME, Date_To DATETIME, Is_valid STRING
+            );
+            insert into `test.source_table` values (101, 'a', '2023-01-01 00:00:00'), (NULL, 'x', '2022-01-01 00:00:00');
+            insert into `test.dest_table` values
+                (1, 101, 'a', '2023-01-01 00:00:00', '2023-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+                (2, 102, 'b', '2023-01-01 00:00:00', '2023-01-01 00:00:00', '9999-01-01 00:00:00', 'yes');
+        """)
+        comparer = TableComparer(bigquery_connection=client, watermark_column='last_modified')
+
+        result = comparer.compare_tables('test.source_table', 'test.dest_table', 'id', ('2023-01-01 00:00:00', '2023-01-01 00:00:00'))
+        client.close()
+
+        # the NULL key of the source does not hide the deletion of 102
+        assert list(zip(result['id'], result['operation'])) == [(102, 2)]
+
+    @mock.patch('google.cloud.bigquery.Client')
+    def test_compare_tables_incremental_time_travel(self, mock_bigquery):
+        comparer = TableComparer(bigquery_connection=mock_bigquery, time_travel=True)
+        now = pandas.Timestamp.now(tz='UTC')
+        watermarks = (str(now - pandas.Timedelta(days=1)), str(now))
+        comparer.compare_tables('source_table', 'dest_table', 'id', watermarks)
+
+        sql_difference_query = mock_bigquery.query.call_args[0][0]
+        query_parameters = mock_bigquery.query.call_args[1]['job_config'].query_parameters
+
+        assert 'for system_time as of CAST(@previous_watermark AS TIMESTAMP)' in sql_difference_query
+        assert 'not exists (select 1 from `source_table` as current_src for system_time as of CAST(@current_watermark AS TIMESTAMP)' in sql_difference_query
+        assert [parameter.value for parameter in query_parameters] == list(watermarks)
+
+    @mock.patch('google.cloud.bigquery.Client')
+    def test_time_travel_out_of_window_compares_whole_tables(self, mock_bigquery):
+        comparer = TableComparer(bigquery_connection=mock_bigquery, time_travel=True)
+        now = pandas.Timestamp.now(tz='UTC')
+        comparer.compare_tables('source_table', 'dest_table', 'id', (str(now - pandas.Timedelta(days=8)), str(now)))
+
+        sql_difference_query = mock_bigquery.query.call_args[0][0]
+
+        assert 'system_time' not in sql_difference_query
+
+    @mock.patch('google.cloud.bigquery.Client')
+    def test_compare_tables_incremental_requires_pkey(self, mock_bigquery):
+        comparer = TableComparer(bigquery_connection=mock_bigquery, time_travel=True)
+
+        with pytest.raises(ValueError):
+            comparer.compare_tables('source_table', 'dest_table', watermarks=('2023-01-01', '2023-02-01'))
+
+    def test_compare_tables_typed_download(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('test')
+        client.query("""
+            create table `test.source_table` (id INT64, col1 STRING, Canton STRING);
+            create table `test.dest_table` (TechnicalKey INT64, id INT64, col1 STRING, Canton STRING, Date_From DATETIME, Date_To DATETIME, Is_valid STRING);
+            insert into `test.source_table` values (101, 'a', 'ZH'), (102, 'b2', 'BE'), (104, NULL, 'ZH');
+            insert into `test.dest_table` values
+                (1, 101, 'a', 'ZH', '2022-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+                (2, 102, 'b', 'BE', '2022-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+                (3, 103, 'c', 'ZH', '2022-01-01 00:00:00', '9999-01-01 00:00:00', 'yes');
+        """)
+        object_result = TableComparer(bigquery_connection=client).compare_tables('test.source_table', 'test.dest_table', 'id')
+        comparer = TableComparer(bigquery_connection=client, dtypes={'Canton': 'category'})
+        typed_result = comparer.compare_tables('test.source_table', 'test.dest_table', 'id')
+        projected_result = comparer.compare_tables('test.source_table', 'test.dest_table', 'id', columns=['id'])
+        typed_batches = list(comparer.compare_tables_in_batches('test.source_table', 'test.dest_table', 'id', batch_size=2))
+        client.close()
+
+        assert isinstance(typed_result['Canton'].dtype, pandas.CategoricalDtype)
+        assert typed_result['id'].dtype == pandas.Int64Dtype()
+        assert typed_result['col1'].dtype == pandas.StringDtype('pyarrow')
+        assert not (typed_result.dtypes == object).any()
+        assert sorted(typed_result.astype(object).where(typed_result.notna(), None).to_dict(orient='records'), key=str) \
+            == sorted(object_result.astype(object).where(object_result.notna(), None).to_dict(orient='records'), key=str)
+        assert list(projected_result.columns) == ['id', 'operation']
+        assert sorted(projected_result['id'].tolist()) == [102, 102, 103, 104]
+        assert [len(batch) for batch in typed_batches] == [2, 2]
+        assert all(isinstance(batch['Canton'].dtype, pandas.CategoricalDtype) for batch in typed_batches)
+
+    def test_to_typed_dataframe_maps_arrow_types(self):
+        arrow_table = pyarrow.table({
+            'id': pyarrow.array([1, None], pyarrow.int64()),
+            'valid': pyarrow.array([True, None]),
+            'day': pyarrow.array([datetime.date(2023, 1, 1), None], pyarrow.date32()),
+            'Canton': pyarrow.array(['ZH', 'ZH'])
+        })
+
+        rows = TableComparer.to_typed_dataframe(arrow_table, {'Canton': 'category', 'id': 'Int32'})
+
+        assert rows['id'].dtype == pandas.Int32Dtype()
+        assert rows['valid'].dtype == pandas.BooleanDtype()
+        assert rows['day'].dtype == pandas.ArrowDtype(pyarrow.date32())
+        assert rows['day'][0] == datetime.date(2023, 1, 1)
+        assert rows['Canton'].cat.categories.tolist() == ['ZH']
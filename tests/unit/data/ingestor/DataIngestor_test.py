@@ -1,10 +1,42 @@
+from lib.data.changedetection.ChecksumChangeDetector import ChecksumChangeDetector
+from lib.data.comparer.TableComparer import TableComparer
 from lib.data.ingestor.DataIngestor import DataIngestor
+from lib.data.state.IngestionStateStore import IngestionStateStore
+from lib.data.technicalkey.SequenceKeyAllocator import SequenceKeyAllocator
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+from lib.dbmanagement.tablemanagement.SchemaRegistry import SchemaRegistry
+from lib.dbmanagement.transaction.BigquerySessionPool import BigquerySessionPool
+from lib.dbmanagement.transaction.RetryPolicy import RetryPolicy
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.monitoring.Tracer import InMemorySpanExporter, Tracer
 import logging
+import threading
+import pytest
 from unittest import mock
 from pandas import DataFrame
 
 
 class TestDataIngestor():
+    SAMPLE_SOURCE_TABLE_ID = 'transformation_scd2.table_1_partners_input'
+    SAMPLE_DEST_TABLE_ID = 'transformation_scd2.table_2_partners_output'
+    PKEY = 'PartnerID'
+
+    SAMPLE_SETUP_STMT = """
+        create table `transformation_scd2.table_1_partners_input` (PartnerID INTEGER NOT NULL, Name STRING, Canton STRING);
+        create table `transformation_scd2.table_2_partners_output` (
+            TechnicalKey INTEGER NOT NULL, PartnerID INTEGER NOT NULL, Name STRING, Canton STRING,
+            Date_From DATETIME NOT NULL, Date_To DATETIME NOT NULL, Is_valid STRING NOT NULL
+        );
+        insert into `transformation_scd2.table_1_partners_input` values
+            (101, 'Store A', 'ZH'), (103, 'Store C', 'BS'), (104, 'Salon D', 'GE'), (105, 'Bookshop E', 'BS'), (106, 'Shop F', 'VD');
+        insert into `transformation_scd2.table_2_partners_output` values
+            (456789, 101, 'Store A', 'ZH', '2000-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (123456, 102, 'Store B', 'BE', '2001-04-08 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (789012, 103, 'Store C', 'BS', '2011-11-15 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (345678, 104, 'Salon D', 'GE', '2002-02-08 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (111111, 105, 'Bookshop E', 'BE', '2020-01-01 00:00:00', '2023-04-30 00:00:00', 'no'),
+            (901234, 105, 'Bookshop E', 'ZH', '2023-05-01 00:00:00', '9999-01-01 00:00:00', 'yes');
+    """
 
   ### Class setup/teardown
 
@@ -33,3 +65,750 @@ class TestDataIngestor():
         ingestor = DataIngestor(bigquery_connection=mock_bigquery)
         res = ingestor.ingest_data('source_table', 'dest_table', 'pkey')
         assert res == 0
+
+    def __run_local(self, server_side:bool, fingerprint_column:str = None, **ingestor_args) -> tuple:
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        if ingestor_args.get('staging_dataset'):
+            # sqlite locks a whole dataset while the ingestion transaction writes, so staging tables have their own dataset
+            client.create_dataset(ingestor_args['staging_dataset'])
+
+        if fingerprint_column:
+            TableComparer(client, fingerprint_column=fingerprint_column).add_fingerprint_column(TestDataIngestor.SAMPLE_DEST_TABLE_ID)
+
+        ingestor = DataIngestor(bigquery_connection=client, fingerprint_column=fingerprint_column, **ingestor_args)
+        if server_side:
+            res = ingestor.apply_changes(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        else:
+            res = ingestor.ingest_data(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+
+        result = client.query(f"select * except(TechnicalKey) from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`").to_dataframe()
+        result = result.drop(columns=[fingerprint_column]) if fingerprint_column else result
+        client.close()
+        return res, result.sort_values(by=['PartnerID', 'Date_From']).reset_index(drop=True)
+
+    def test_apply_changes_matches_ingest_data(self):
+        client_side_result, client_side_rows = self.__run_local(server_side=False)
+        server_side_result, server_side_rows = self.__run_local(server_side=True)
+
+        assert client_side_result == 0
+        # 102 deleted, 105 updated, 106 inserted
+        assert server_side_result == {'rows_updated': 2, 'rows_inserted': 2}
+        assert server_side_rows.equals(client_side_rows)
+        assert list(server_side_rows['Is_valid']) == ['yes', 'no', 'yes', 'yes', 'no', 'no', 'yes', 'yes']
+
+    def test_fingerprint_mode_matches_ingest_data(self):
+        _, client_side_rows = self.__run_local(server_side=False)
+        server_side_result, server_side_rows = self.__run_local(server_side=True, fingerprint_column='Row_Hash')
+        _, fingerprint_client_side_rows = self.__run_local(server_side=False, fingerprint_column='Row_Hash')
+
+        assert server_side_result == {'rows_updated': 2, 'rows_inserted': 2}
+        assert server_side_rows.equals(client_side_rows)
+        assert fingerprint_client_side_rows.equals(client_side_rows)
+
+    def test_ingest_data_invalidates_keys_in_chunks(self):
+        _, client_side_rows = self.__run_local(server_side=False)
+        _, chunked_rows = self.__run_local(server_side=False, invalidation_chunk_size=1)
+
+        assert chunked_rows.equals(client_side_rows)
+
+    @mock.patch('google.cloud.bigquery.Client')
+    def test_ingest_data_invalidates_keys_as_query_parameter(self, mock_bigquery):
+        data_to_ingest = DataFrame({'pkey': [101, 102, 103, 103], 'col1': ['a', 'b', 'c', 'd'], 'operation': [2, 2, 1, 2]})
+
+        with mock.patch('lib.data.comparer.TableComparer.TableComparer.compare_tables', return_value=data_to_ingest):
+            ingestor = DataIngestor(bigquery_connection=mock_bigquery, invalidation_chunk_size=2)
+            ingestor.ingest_data('source_table', 'dest_table', 'pkey')
+
+        update_calls = [call for call in mock_bigquery.query.call_args_list if 'update' in call[0][0]]
+
+        assert len(update_calls) == 2
+        assert 'in unnest(@pkeys)' in update_calls[0][0][0]
+        assert [list(call[1]['job_config'].query_parameters[0].values) for call in update_calls] == [[101, 102], [103]]
+
+    def test_sequence_key_allocator_assigns_new_keys(self):
+        for server_side in (False, True):
+            client = LocalConnector().get_client()
+            client.create_dataset('transformation_scd2')
+            client.create_dataset('scd2_state')
+            client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+            # sqlite locks a whole dataset while the ingestion transaction writes, so the counter table has its own dataset
+            key_allocator = SequenceKeyAllocator(client, 'scd2_state.scd2_sequences')
+            key_allocator.create_counter_table()
+
+            ingestor = DataIngestor(bigquery_connection=client, key_allocator=key_allocator)
+            if server_side:
+                ingestor.apply_changes(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+            else:
+                ingestor.ingest_data(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+
+            new_keys = client.query(f"""
+                select TechnicalKey from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` where TechnicalKey > 901234 order by TechnicalKey
+            """).to_dataframe()
+            client.close()
+
+            # 105 updated, 106 inserted
+            assert new_keys['TechnicalKey'].tolist() == [901235, 901236]
+
+    def test_typed_download_matches_ingest_data(self):
+        _, client_side_rows = self.__run_local(server_side=False)
+        _, typed_rows = self.__run_local(server_side=False, dtypes={'Canton': 'category'})
+        _, typed_batch_rows = self.__run_local(server_side=False, dtypes={'Canton': 'category'}, batch_size=2)
+        _, typed_staged_rows = self.__run_local(server_side=False, dtypes={'Canton': 'category'}, staging_threshold=0, staging_dataset='staging')
+
+        assert typed_rows.equals(client_side_rows)
+        assert typed_batch_rows.equals(client_side_rows)
+        assert typed_staged_rows.equals(client_side_rows)
+
+    def test_ingest_data_in_batches_matches_ingest_data(self):
+        _, client_side_rows = self.__run_local(server_side=False)
+        _, batch_rows = self.__run_local(server_side=False, batch_size=1)
+        _, fingerprint_batch_rows = self.__run_local(server_side=False, fingerprint_column='Row_Hash', batch_size=2)
+
+        assert batch_rows.equals(client_side_rows)
+        assert fingerprint_batch_rows.equals(client_side_rows)
+
+    def test_incremental_ingestion_reads_changed_rows(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query("""
+            create table `transformation_scd2.source` (PartnerID INT64 NOT NULL, Name STRING, Last_Modified DATETIME);
+            create table `transformation_scd2.dest` (
+                TechnicalKey INT64 NOT NULL, PartnerID INT64 NOT NULL, Name STRING, Last_Modified DATETIME,
+                Date_From DATETIME NOT NULL, Date_To DATETIME NOT NULL, Is_valid STRING NOT NULL
+            );
+            insert into `transformation_scd2.source` values
+                (101, 'Store A', '2023-01-01 00:00:00'), (102, 'Store B', '2023-01-01 00:00:00'), (103, 'Store C', '2023-01-01 00:00:00');
+        """)
+        state_store = IngestionStateStore(client, 'transformation_scd2.scd2_state')
+        ingestor = DataIngestor(bigquery_connection=client, state_store=state_store, watermark_column='Last_Modified')
+
+        # first run compares the whole tables
+        ingestor.ingest_data('transformation_scd2.source', 'transformation_scd2.dest', 'PartnerID')
+        assert state_store.get_state('transformation_scd2.source', 'transformation_scd2.dest', 'watermark') == '2023-01-01 00:00:00'
+
+        # 101 updated, 102 deleted, 104 inserted, 103 unchanged
+        client.query("""
+            update `transformation_scd2.source` set Name = 'Store A2', Last_Modified = '2023-02-01 00:00:00' where PartnerID = 101;
+            delete from `transformation_scd2.source` where PartnerID = 102;
+            insert into `transformation_scd2.source` values (104, 'Store D', '2023-02-01 00:00:00');
+        """)
+        ingestor.ingest_data('transformation_scd2.source', 'transformation_scd2.dest', 'PartnerID')
+
+        result = client.query("""
+            select PartnerID, Name, Is_valid from `transformation_scd2.dest` order by PartnerID, Is_valid
+        """).to_dataframe()
+        watermark = state_store.get_state('transformation_scd2.source', 'transformation_scd2.dest', 'watermark')
+        client.close()
+
+        assert result.to_dict(orient='list') == {
+            'PartnerID': [101, 101, 102, 103, 104],
+            'Name': ['Store A', 'Store A2', 'Store B', 'Store C', 'Store D'],
+            'Is_valid': ['no', 'yes', 'no', 'yes', 'yes']
+        }
+        assert watermark == '2023-02-01 00:00:00'
+
+    def test_incremental_watermark_advances_only_on_commit(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query("""
+            create table `transformation_scd2.source` (PartnerID INT64 NOT NULL, Name STRING, Last_Modified DATETIME);
+            create table `transformation_scd2.dest` (
+                TechnicalKey INT64 NOT NULL, PartnerID INT64 NOT NULL, Name STRING, Last_Modified DATETIME,
+                Date_From DATETIME NOT NULL, Date_To DATETIME NOT NULL, Is_valid STRING NOT NULL
+            );
+            insert into `transformation_scd2.source` values (101, 'Store A', '2023-01-01 00:00:00');
+        """)
+        state_store = IngestionStateStore(client, 'transformation_scd2.scd2_state')
+        state_store.create_state_table('transformation_scd2.dest')
+        state_store.set_state('transformation_scd2.source', 'transformation_scd2.dest', 'watermark', '2022-01-01 00:00:00')
+        ingestor = DataIngestor(bigquery_connection=client, state_store=state_store, watermark_column='Last_Modified')
+
+        with mock.patch('lib.dbmanagement.tablemanagement.BigQueryManager.BigQueryManager.insert_records', side_effect=Exception('insert failed')):
+            with pytest.raises(Exception):
+                ingestor.ingest_data('transformation_scd2.source', 'transformation_scd2.dest', 'PartnerID')
+
+        watermark = state_store.get_state('transformation_scd2.source', 'transformation_scd2.dest', 'watermark')
+        client.close()
+
+        assert watermark == '2022-01-01 00:00:00'
+
+    def test_ingest_data_publishes_run_report(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+
+        ingestor = DataIngestor(bigquery_connection=client)
+        ingestor.ingest_data(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        report = ingestor.get_last_run_report()
+        client.close()
+
+        statement_types = [statement['statement_type'] for statement in report['statements']]
+
+        assert report['status'] == 'succeeded'
+        # session, transaction, diff, invalidation, same day versions of the keys, insertion, commit and session abort
+        assert statement_types == ['SELECT', 'BEGIN', 'WITH', 'UPDATE', 'SELECT', 'INSERT', 'COMMIT', 'CALL']
+        assert report['by_statement_type']['UPDATE']['dml_affected_rows'] == 2
+        assert report['by_statement_type']['INSERT']['dml_affected_rows'] == 2
+
+    def test_concurrent_runs_share_the_ingestor(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.create_dataset('other_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT.replace('transformation_scd2.', 'other_scd2.'))
+        ingestor = DataIngestor(bigquery_connection=client)
+        phases = []
+
+        threads = [
+            threading.Thread(target=ingestor.ingest_data, args=(
+                TestDataIngestor.SAMPLE_SOURCE_TABLE_ID.replace('transformation_scd2', dataset),
+                TestDataIngestor.SAMPLE_DEST_TABLE_ID.replace('transformation_scd2', dataset),
+                TestDataIngestor.PKEY,
+                lambda report: phases.append((report.destination_table, report.phase))
+            ))
+            for dataset in ('transformation_scd2', 'other_scd2')
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        valid_rows = [
+            list(client.query(f"select count(*) from `{dataset}.table_2_partners_output` where Is_valid = 'yes'").result())[0][0]
+            for dataset in ('transformation_scd2', 'other_scd2')
+        ]
+        client.close()
+
+        assert valid_rows == [5, 5]
+        assert ('other_scd2.table_2_partners_output', 'succeeded') in phases
+        assert ('transformation_scd2.table_2_partners_output', 'succeeded') in phases
+
+    def test_apply_changes_with_session_pool(self):
+        _, expected_rows = self.__run_local(server_side=True)
+
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        pool = BigquerySessionPool(client, size=1)
+        ingestor = DataIngestor(bigquery_connection=client, session_pool=pool)
+
+        ingestor.apply_changes(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        result = ingestor.apply_changes(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        statement_types = [statement['statement_type'] for statement in ingestor.get_last_run_report()['statements']]
+        rows = client.query(f"select * except(TechnicalKey) from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`").to_dataframe()
+        pool.close()
+        client.close()
+
+        # second run on the warm session: no session creation nor abort
+        assert result == {'rows_updated': 0, 'rows_inserted': 0}
+        assert statement_types[0] == 'BEGIN' and statement_types[-1] == 'COMMIT'
+        assert rows.sort_values(by=['PartnerID', 'Date_From']).reset_index(drop=True).equals(expected_rows)
+
+    def test_ingest_data_traces_phases(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        exporter = InMemorySpanExporter()
+        Tracer.configure(exporter, trace_memory=True)
+
+        try:
+            DataIngestor(bigquery_connection=client).ingest_data(
+                TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        finally:
+            Tracer.disable()
+            client.close()
+
+        spans = {span['name']: span for span in exporter.spans}
+        root = spans['ingest_data']
+
+        assert {'session.start', 'transaction.begin', 'compare_tables', 'to_dataframe', 'invalidate',
+                'insert', 'assign_keys', 'insert_records', 'transaction.commit', 'session.end', 'statement'} <= set(spans)
+        assert root['parent_id'] is None
+        assert all(span['trace_id'] == root['trace_id'] for span in exporter.spans)
+        assert spans['compare_tables']['parent_id'] == root['span_id']
+        assert spans['to_dataframe']['attributes']['rows'] == 4
+        assert spans['invalidate']['attributes']['rows'] == 2
+        assert spans['insert']['attributes']['rows'] == 2
+        assert root['peak_memory_bytes'] >= spans['to_dataframe']['peak_memory_bytes'] > 0
+
+    def test_ingest_dataframe_matches_ingest_data(self, tmp_path):
+        _, expected_rows = self.__run_local(server_side=False)
+
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        client.query(f"select * from `{TestDataIngestor.SAMPLE_SOURCE_TABLE_ID}`").to_dataframe().to_parquet(tmp_path / 'partners.parquet')
+
+        ingestor = DataIngestor(bigquery_connection=client)
+        res = ingestor.ingest_dataframe(str(tmp_path / 'partners.parquet'), TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        report = ingestor.get_last_run_report()
+        rows = client.query(f"select * except(TechnicalKey) from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`").to_dataframe()
+        client.close()
+
+        assert res == 0
+        assert report['operation'] == 'ingest_dataframe' and report['status'] == 'succeeded'
+        assert rows.sort_values(by=['PartnerID', 'Date_From']).reset_index(drop=True).equals(expected_rows)
+
+    def test_ingest_dataframe_computes_fingerprints(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.create_dataset('staging')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        comparer = TableComparer(client, fingerprint_column='Row_Hash')
+        comparer.add_fingerprint_column(TestDataIngestor.SAMPLE_DEST_TABLE_ID)
+        source_rows = client.query(f"select * from `{TestDataIngestor.SAMPLE_SOURCE_TABLE_ID}`").to_dataframe()
+
+        ingestor = DataIngestor(bigquery_connection=client, fingerprint_column='Row_Hash', staging_dataset='staging',
+                                schema_registry=SchemaRegistry(client))
+        with pytest.raises(ValueError):
+            ingestor.ingest_dataframe(source_rows.assign(Region='CH'), TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        drift_report = ingestor.get_last_run_report()
+
+        ingestor.ingest_dataframe(source_rows, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        missing_fingerprints = client.query(f"""
+            select count(*) from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` where Is_valid = 'yes' and Row_Hash is null
+        """).result()
+        differences = comparer.compare_tables(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        client.close()
+
+        assert drift_report['statements'] == []
+        assert list(missing_fingerprints)[0][0] == 0
+        # the fingerprints of the new versions are the ones of the source rows
+        assert differences.empty
+
+    def test_backfill_builds_history_from_snapshots(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query("""
+            create table `transformation_scd2.partners_snapshots` (Snapshot_Date DATE, PartnerID INTEGER NOT NULL, Name STRING, Canton STRING);
+            create table `transformation_scd2.table_2_partners_output` (
+                TechnicalKey INTEGER NOT NULL, PartnerID INTEGER NOT NULL, Name STRING, Canton STRING,
+                Date_From DATETIME NOT NULL, Date_To DATETIME NOT NULL, Is_valid STRING NOT NULL
+            );
+            insert into `transformation_scd2.partners_snapshots` values
+                ('2023-01-01', 101, 'Store A', 'ZH'), ('2023-01-01', 102, 'Store B', NULL), ('2023-01-01', 103, 'Store C', 'BS'),
+                ('2023-01-02', 101, 'Store A', 'ZH'), ('2023-01-02', 102, 'Store B', 'BE'),
+                ('2023-01-03', 101, 'Store A', 'ZH'), ('2023-01-03', 102, 'Store B', 'BE'), ('2023-01-03', 103, 'Store C', 'BS'),
+                ('2023-01-03', 104, 'Salon D', 'GE');
+        """)
+
+        ingestor = DataIngestor(bigquery_connection=client)
+        result = ingestor.backfill('transformation_scd2.partners_snapshots', TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY, 'Snapshot_Date')
+        rows = client.query(f"""
+            select PartnerID, Canton, Date_From, Date_To, Is_valid from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` order by PartnerID, Date_From
+        """).to_dataframe()
+        keys = client.query(f"select count(distinct TechnicalKey) from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`").result()
+
+        with pytest.raises(ValueError):
+            ingestor.backfill('transformation_scd2.partners_snapshots', TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY, 'Snapshot_Date')
+        client.close()
+
+        assert result == {'rows_inserted': 6}
+        assert list(keys)[0][0] == 6
+        # 101 unchanged, 102 changed on day 2, 103 missing on day 2, 104 new on day 3
+        assert rows.fillna('NULL').astype(str).values.tolist() == [
+            ['101', 'ZH', '2023-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'],
+            ['102', 'NULL', '2023-01-01 00:00:00', '2023-01-01 00:00:00', 'no'],
+            ['102', 'BE', '2023-01-02 00:00:00', '9999-01-01 00:00:00', 'yes'],
+            ['103', 'BS', '2023-01-01 00:00:00', '2023-01-01 00:00:00', 'no'],
+            ['103', 'BS', '2023-01-03 00:00:00', '9999-01-01 00:00:00', 'yes'],
+            ['104', 'GE', '2023-01-03 00:00:00', '9999-01-01 00:00:00', 'yes'],
+        ]
+
+    def test_backfill_matches_daily_runs(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        client.query(f"""
+            create table `transformation_scd2.day_1` as select DATE '2023-01-01' as Snapshot_Date, * from `{TestDataIngestor.SAMPLE_SOURCE_TABLE_ID}`;
+            create table `transformation_scd2.day_2` as select DATE '2023-01-02' as Snapshot_Date, * from `{TestDataIngestor.SAMPLE_SOURCE_TABLE_ID}`;
+            update `transformation_scd2.day_2` set Canton = 'TI' where PartnerID = 101;
+            delete from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` where true;
+        """)
+
+        result = DataIngestor(bigquery_connection=client).backfill(
+            ['transformation_scd2.day_1', 'transformation_scd2.day_2'], TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY, 'Snapshot_Date')
+        valid_rows = client.query(f"""
+            select PartnerID, Name, Canton from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` where Is_valid = 'yes' order by PartnerID
+        """).to_dataframe()
+        client.close()
+
+        assert result == {'rows_inserted': 6}
+        assert valid_rows.values.tolist() == [
+            [101, 'Store A', 'TI'], [103, 'Store C', 'BS'], [104, 'Salon D', 'GE'], [105, 'Bookshop E', 'BS'], [106, 'Shop F', 'VD']
+        ]
+
+    def test_backfill_matches_columns_by_name(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        client.query(f"""
+            create table `transformation_scd2.day_1` (PartnerID INTEGER NOT NULL, Canton STRING, Name STRING, Snapshot_Date DATE);
+            insert into `transformation_scd2.day_1` values (101, 'ZH', 'Store A', '2023-01-01');
+            delete from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` where true;
+        """)
+
+        DataIngestor(bigquery_connection=client).backfill(
+            'transformation_scd2.day_1', TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY, 'Snapshot_Date')
+        rows = client.query(f"select PartnerID, Name, Canton from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`").to_dataframe()
+        client.close()
+
+        assert rows.values.tolist() == [[101, 'Store A', 'ZH']]
+
+    def test_backfill_computes_fingerprints(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        client.query(f"""
+            create table `transformation_scd2.day_1` as select DATE '2023-01-01' as Snapshot_Date, * from `{TestDataIngestor.SAMPLE_SOURCE_TABLE_ID}`;
+            delete from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` where true;
+        """)
+        comparer = TableComparer(client, fingerprint_column='Row_Hash')
+        comparer.add_fingerprint_column(TestDataIngestor.SAMPLE_DEST_TABLE_ID)
+
+        ingestor = DataIngestor(bigquery_connection=client, fingerprint_column='Row_Hash', schema_registry=SchemaRegistry(client))
+        result = ingestor.backfill('transformation_scd2.day_1', TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY, 'Snapshot_Date')
+        differences = comparer.compare_tables(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        client.close()
+
+        assert result == {'rows_inserted': 5}
+        assert differences.empty
+
+    def test_schema_registry_uses_explicit_columns(self):
+        _, expected_rows = self.__run_local(server_side=True)
+
+        for server_side in (False, True):
+            client = LocalConnector().get_client()
+            client.create_dataset('transformation_scd2')
+            client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+            # destination business columns in another order than the source
+            client.query(f"""
+                create or replace table `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` as
+                select TechnicalKey, PartnerID, Canton, Name, Date_From, Date_To, Is_valid from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`
+            """)
+            ingestor = DataIngestor(bigquery_connection=client, schema_registry=SchemaRegistry(client, ttl=60))
+
+            if server_side:
+                ingestor.apply_changes(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+            else:
+                ingestor.ingest_data(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+            rows = client.query(f"""
+                select PartnerID, Name, Canton, Date_From, Date_To, Is_valid from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`
+            """).to_dataframe()
+            client.close()
+
+            assert rows.sort_values(by=['PartnerID', 'Date_From']).reset_index(drop=True).equals(expected_rows)
+
+    def test_schema_drift_is_detected_before_the_session(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        client.query(f"alter table `{TestDataIngestor.SAMPLE_SOURCE_TABLE_ID}` add column Region STRING")
+        ingestor = DataIngestor(bigquery_connection=client, schema_registry=SchemaRegistry(client))
+
+        with pytest.raises(ValueError):
+            ingestor.ingest_data(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        report = ingestor.get_last_run_report()
+        client.close()
+
+        assert report['status'] == 'failed'
+        assert report['statements'] == []
+
+    def test_unchanged_source_is_skipped(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        state_store = IngestionStateStore(client, 'transformation_scd2.scd2_state')
+        ingestor = DataIngestor(bigquery_connection=client, state_store=state_store, change_detector=ChecksumChangeDetector(client))
+
+        ingestor.ingest_data(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        first_fingerprint = state_store.get_state(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, 'source_fingerprint')
+
+        # same source: no session is opened
+        res = ingestor.apply_changes(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        skipped_report = ingestor.get_last_run_report()
+
+        # changed source: the run is executed and the fingerprint is updated
+        client.query(f"update `{TestDataIngestor.SAMPLE_SOURCE_TABLE_ID}` set Name = 'Store A2' where PartnerID = 101")
+        ingestor.ingest_data(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+        second_fingerprint = state_store.get_state(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, 'source_fingerprint')
+        valid_names = client.query(f"""
+            select Name from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` where PartnerID = 101 and Is_valid = 'yes'
+        """).to_dataframe()
+        client.close()
+
+        assert first_fingerprint is not None
+        assert res == {'rows_updated': 0, 'rows_inserted': 0}
+        assert skipped_report['status'] == 'succeeded'
+        assert skipped_report['phase'] == 'unchanged'
+        # checksum and state lookup only
+        assert [statement['statement_type'] for statement in skipped_report['statements']] == ['SELECT', 'SELECT']
+        assert second_fingerprint != first_fingerprint
+        assert valid_names['Name'].tolist() == ['Store A2']
+
+    def test_change_detection_requires_state_store(self):
+        with pytest.raises(ValueError):
+            DataIngestor(bigquery_connection=mock.MagicMock(), change_detector=mock.MagicMock())
+
+    def test_run_token_makes_a_duplicated_run_a_no_op(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        state_store = IngestionStateStore(client, 'transformation_scd2.scd2_state')
+        ingestor = DataIngestor(bigquery_connection=client, state_store=state_store)
+
+        ingestor.ingest_data(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY, run_token='run-1')
+        rows_after_first_run = client.query(f"select count(*) from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`").to_dataframe().iloc[0, 0]
+        # the source changes, but the duplicated run is not applied
+        client.query(f"update `{TestDataIngestor.SAMPLE_SOURCE_TABLE_ID}` set Name = 'Store A2' where PartnerID = 101")
+        res = ingestor.apply_changes(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY, run_token='run-1')
+        duplicate_report = ingestor.get_last_run_report()
+        rows_after_duplicate = client.query(f"select count(*) from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`").to_dataframe().iloc[0, 0]
+        client.close()
+
+        assert res == {'rows_updated': 0, 'rows_inserted': 0}
+        assert duplicate_report['status'] == 'succeeded'
+        assert duplicate_report['phase'] == 'duplicate'
+        assert rows_after_duplicate == rows_after_first_run
+
+    def test_run_token_prunes_expired_tokens(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        state_store = IngestionStateStore(client, 'transformation_scd2.scd2_state')
+        ingestor = DataIngestor(bigquery_connection=client, state_store=state_store, run_token_retention_days=7)
+
+        ingestor.ingest_data(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY, run_token='run-1')
+        state_table = state_store.state_table_name(TestDataIngestor.SAMPLE_DEST_TABLE_ID)
+        client.query(f"update `{state_table}` set updated_at = '2023-01-01 00:00:00'")
+        ingestor.apply_changes(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY, run_token='run-2')
+        state_keys = client.query(f"select state_key from `{state_table}`").to_dataframe()['state_key'].tolist()
+        client.close()
+
+        assert state_keys == ['run_token:run-2']
+
+    def test_run_token_requires_state_store(self):
+        ingestor = DataIngestor(bigquery_connection=mock.MagicMock())
+
+        with pytest.raises(ValueError):
+            ingestor.ingest_data('source_table', 'dest_table', 'pkey', run_token='run-1')
+
+    def test_conflict_is_retried_from_the_comparison(self):
+        _, client_side_rows = self.__run_local(server_side=False)
+        insert_records = BigQueryManager.insert_records
+        calls = []
+
+        def insert_records_with_conflict(bigquery_manager, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise Exception('Transaction is aborted due to concurrent update against table transformation_scd2.table_2_partners_output')
+            return insert_records(bigquery_manager, *args, **kwargs)
+
+        with mock.patch.object(BigQueryManager, 'insert_records', insert_records_with_conflict), \
+                mock.patch('lib.data.comparer.TableComparer.TableComparer.compare_tables', autospec=True, side_effect=TableComparer.compare_tables) as compare_tables:
+            _, retried_rows = self.__run_local(server_side=False, retry_policy=RetryPolicy(initial_delay=0))
+
+        assert len(calls) == 2
+        assert compare_tables.call_count == 2
+        assert retried_rows.equals(client_side_rows)
+
+    def test_sharded_apply_changes_matches_ingest_data(self):
+        _, client_side_rows = self.__run_local(server_side=False)
+        sharded_result, sharded_rows = self.__run_local(server_side=True, shards=3, staging_dataset='staging')
+        _, fingerprint_rows = self.__run_local(server_side=True, fingerprint_column='Row_Hash', shards=2, staging_dataset='staging')
+        _, derived_rows = self.__run_local(server_side=True, rows_per_shard=2, shard_concurrency=2, staging_dataset='staging')
+
+        assert sharded_result == {'rows_updated': 2, 'rows_inserted': 2}
+        assert sharded_rows.equals(client_side_rows)
+        assert fingerprint_rows.equals(client_side_rows)
+        assert derived_rows.equals(client_side_rows)
+
+    def test_sharded_apply_changes_is_all_or_nothing(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.create_dataset('staging')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        rows_before = client.query(f"select * from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`").to_dataframe()
+        ingestor = DataIngestor(bigquery_connection=client, shards=2, staging_dataset='staging')
+        insert_from_query = BigQueryManager.insert_from_query
+        calls = []
+
+        def fail_on_last_shard(bigquery_manager, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise Exception('insert failed')
+            return insert_from_query(bigquery_manager, *args, **kwargs)
+
+        with mock.patch.object(BigQueryManager, 'insert_from_query', fail_on_last_shard):
+            with pytest.raises(Exception):
+                ingestor.apply_changes(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+
+        rows_after = client.query(f"select * from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`").to_dataframe()
+        staging_tables = client.query("select name from staging.sqlite_master").to_dataframe()
+        client.close()
+
+        assert len(calls) == 2
+        assert rows_after.equals(rows_before)
+        assert staging_tables.empty
+
+    def test_sharded_apply_changes_skips_keys_changed_since_the_comparison(self):
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.create_dataset('staging')
+        client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+        ingestor = DataIngestor(bigquery_connection=client, shards=2, staging_dataset='staging')
+        materialize_differences = TableComparer.materialize_differences
+        compared_shards, lock = [], threading.Lock()
+
+        def concurrent_run_after_comparison(comparer, *args, **kwargs):
+            materialize_differences(comparer, *args, **kwargs)
+            with lock:
+                compared_shards.append(args[2])
+                if len(compared_shards) == 2:
+                    # a concurrent run applies the change of 105 and the new key 106 once the shards are compared
+                    client.query(f"""
+                        update `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` set Is_valid = 'no', Date_To = '2023-12-31 00:00:00'
+                        where TechnicalKey = 901234;
+                        insert into `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` values
+                            (1, 105, 'Bookshop E', 'BS', '2024-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+                            (2, 106, 'Shop F', 'VD', '2024-01-01 00:00:00', '9999-01-01 00:00:00', 'yes');
+                    """)
+
+        with mock.patch.object(TableComparer, 'materialize_differences', concurrent_run_after_comparison):
+            res = ingestor.apply_changes(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+
+        valid_rows = client.query(
+            f"select PartnerID, Name, Canton from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` where Is_valid = 'yes' order by PartnerID"
+        ).to_dataframe()
+        client.close()
+
+        # only 102 is still deleted by the run, 105 and 106 are kept with a single valid version
+        assert res == {'rows_updated': 1, 'rows_inserted': 0}
+        assert valid_rows.values.tolist() == [
+            [101, 'Store A', 'ZH'], [103, 'Store C', 'BS'], [104, 'Salon D', 'GE'], [105, 'Bookshop E', 'BS'], [106, 'Shop F', 'VD']
+        ]
+
+    COMPOSITE_SETUP_STMT = """
+        create table `transformation_scd2.prices_input` (PartnerID INT64 NOT NULL, Country STRING NOT NULL, Price INT64);
+        create table `transformation_scd2.prices_output` (
+            TechnicalKey INT64 NOT NULL, PartnerID INT64 NOT NULL, Country STRING NOT NULL, Price INT64,
+            Date_From DATETIME NOT NULL, Date_To DATETIME NOT NULL, Is_valid STRING NOT NULL
+        );
+        insert into `transformation_scd2.prices_input` values
+            (101, 'CH', 10), (101, 'DE', 12), (102, 'CH', 20), (103, 'FR', 30);
+        insert into `transformation_scd2.prices_output` values
+            (1, 101, 'CH', 10, '2020-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (2, 101, 'DE', 11, '2020-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (3, 102, 'CH', 20, '2020-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (4, 102, 'DE', 21, '2020-01-01 00:00:00', '9999-01-01 00:00:00', 'yes');
+    """
+
+    def __run_composite_key(self, server_side:bool, **ingestor_args) -> tuple:
+        client = LocalConnector().get_client()
+        client.create_dataset('transformation_scd2')
+        client.query(TestDataIngestor.COMPOSITE_SETUP_STMT)
+        if ingestor_args.get('staging_dataset'):
+            client.create_dataset(ingestor_args['staging_dataset'])
+
+        ingestor = DataIngestor(bigquery_connection=client, **ingestor_args)
+        ingest = ingestor.apply_changes if server_side else ingestor.ingest_data
+        res = ingest('transformation_scd2.prices_input', 'transformation_scd2.prices_output', ['PartnerID', 'Country'])
+
+        result = client.query("select * except(TechnicalKey) from `transformation_scd2.prices_output`").to_dataframe()
+        client.close()
+        return res, result.sort_values(by=['PartnerID', 'Country', 'Date_From']).reset_index(drop=True)
+
+    def test_composite_key_invalidates_only_the_changed_keys(self):
+        client_side_result, client_side_rows = self.__run_composite_key(server_side=False)
+        _, chunked_rows = self.__run_composite_key(server_side=False, invalidation_chunk_size=1)
+        server_side_result, server_side_rows = self.__run_composite_key(server_side=True)
+        _, sharded_rows = self.__run_composite_key(server_side=True, shards=2, staging_dataset='staging')
+
+        assert client_side_result == 0
+        # (101, DE) updated, (102, DE) deleted, (103, FR) inserted: (102, CH) shares the PartnerID of a deleted key
+        assert server_side_result == {'rows_updated': 2, 'rows_inserted': 2}
+        assert client_side_rows[client_side_rows['Is_valid'] == 'yes'][['PartnerID', 'Country', 'Price']].values.tolist() == [
+            [101, 'CH', 10], [101, 'DE', 12], [102, 'CH', 20], [103, 'FR', 30]
+        ]
+        assert list(client_side_rows['Is_valid']) == ['yes', 'no', 'yes', 'yes', 'no', 'yes']
+        assert chunked_rows.equals(client_side_rows)
+        assert server_side_rows.equals(client_side_rows)
+        assert sharded_rows.equals(client_side_rows)
+
+    def test_one_column_key_as_list(self):
+        _, expected_rows = self.__run_local(server_side=False)
+
+        for server_side in (False, True):
+            client = LocalConnector().get_client()
+            client.create_dataset('transformation_scd2')
+            client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+            ingestor = DataIngestor(bigquery_connection=client)
+            ingest = ingestor.apply_changes if server_side else ingestor.ingest_data
+
+            ingest(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, [TestDataIngestor.PKEY])
+            rows = client.query(f"select * except(TechnicalKey) from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}`").to_dataframe()
+            client.close()
+
+            assert rows.sort_values(by=['PartnerID', 'Date_From']).reset_index(drop=True).equals(expected_rows)
+
+    def test_same_day_versions_get_different_keys(self):
+        for server_side in (False, True):
+            client = LocalConnector().get_client()
+            client.create_dataset('transformation_scd2')
+            client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+            ingestor = DataIngestor(bigquery_connection=client)
+            ingest = ingestor.apply_changes if server_side else ingestor.ingest_data
+
+            ingest(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+            # 106 changes twice on the same day
+            client.query(f"update `{TestDataIngestor.SAMPLE_SOURCE_TABLE_ID}` set Name = 'Shop F2' where PartnerID = 106")
+            ingest(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+
+            keys = client.query(
+                f"select TechnicalKey from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` where PartnerID = 106"
+            ).to_dataframe()['TechnicalKey']
+            client.close()
+
+            assert len(keys) == 2
+            assert keys.is_unique
+
+    def test_same_day_versions_of_composite_key_get_different_keys(self):
+        for server_side in (False, True):
+            client = LocalConnector().get_client()
+            client.create_dataset('transformation_scd2')
+            client.query(TestDataIngestor.COMPOSITE_SETUP_STMT)
+            ingestor = DataIngestor(bigquery_connection=client)
+            ingest = ingestor.apply_changes if server_side else ingestor.ingest_data
+
+            ingest('transformation_scd2.prices_input', 'transformation_scd2.prices_output', ['PartnerID', 'Country'])
+            # (101, DE) changes again on the same day, (101, CH) shares its PartnerID
+            client.query("update `transformation_scd2.prices_input` set Price = 13 where PartnerID = 101 and Country = 'DE'")
+            ingest('transformation_scd2.prices_input', 'transformation_scd2.prices_output', ['PartnerID', 'Country'])
+
+            keys = client.query(
+                "select TechnicalKey from `transformation_scd2.prices_output` where PartnerID = 101 and Country = 'DE'"
+            ).to_dataframe()['TechnicalKey']
+            client.close()
+
+            assert len(keys) == 3
+            assert keys.is_unique
+
+    def test_retried_run_gets_the_same_keys(self):
+        for server_side in (False, True):
+            keys = []
+            for _ in range(2):
+                client = LocalConnector().get_client()
+                client.create_dataset('transformation_scd2')
+                client.query(TestDataIngestor.SAMPLE_SETUP_STMT)
+                ingestor = DataIngestor(bigquery_connection=client)
+                ingest = ingestor.apply_changes if server_side else ingestor.ingest_data
+
+                ingest(TestDataIngestor.SAMPLE_SOURCE_TABLE_ID, TestDataIngestor.SAMPLE_DEST_TABLE_ID, TestDataIngestor.PKEY)
+                keys.append(client.query(
+                    f"select TechnicalKey from `{TestDataIngestor.SAMPLE_DEST_TABLE_ID}` order by TechnicalKey"
+                ).to_dataframe()['TechnicalKey'].tolist())
+                client.close()
+
+            assert keys[0] == keys[1]
@@ -0,0 +1,76 @@
+from lib.data.state.IngestionStateStore import IngestionStateStore
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.dbmanagement.transaction.BigqueryTransaction import BigqueryTransaction
+
+
+class TestIngestionStateStore():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.client = LocalConnector().get_client()
+        self.client.create_dataset('test')
+        self.state_store = IngestionStateStore(self.client, 'test.scd2_state')
+        self.state_store.create_state_table('test.dest')
+        self.state_store.create_state_table('test.other_dest')
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        self.client.close()
+
+    ### Tests
+
+    def test_set_state_replaces_value(self):
+        assert self.state_store.get_state('test.source', 'test.dest', 'watermark') is None
+
+        self.state_store.set_state('test.source', 'test.dest', 'watermark', '2023-01-01 00:00:00')
+        self.state_store.set_state('test.source', 'test.dest', 'watermark', '2023-02-01 00:00:00')
+        self.state_store.set_state('test.source', 'test.other_dest', 'watermark', '2022-01-01 00:00:00')
+
+        assert self.state_store.get_state('test.source', 'test.dest', 'watermark') == '2023-02-01 00:00:00'
+        assert self.state_store.get_state('test.source', 'test.other_dest', 'watermark') == '2022-01-01 00:00:00'
+
+    def test_set_state_in_rolled_back_transaction(self):
+        transaction = BigqueryTransaction(bigquery_connection = self.client)
+        job_config = transaction.begin_transaction()
+        self.state_store.set_state('test.source', 'test.dest', 'watermark', '2023-01-01 00:00:00', job_config)
+        transaction.rollback_transaction()
+
+        assert self.state_store.get_state('test.source', 'test.dest', 'watermark') is None
+
+    def test_state_table_per_destination(self):
+        self.state_store.set_state('test.source', 'test.dest', 'watermark', '2023-01-01 00:00:00')
+        self.state_store.set_state('test.source', 'test.other_dest', 'watermark', '2022-01-01 00:00:00')
+        # created once per destination
+        self.state_store.create_state_table('test.dest')
+
+        dest_states = self.client.query(f"select state_value from `{self.state_store.state_table_name('test.dest')}`").to_dataframe()
+
+        assert self.state_store.state_table_name('test.dest') == 'test.scd2_state_test_dest'
+        assert dest_states['state_value'].tolist() == ['2023-01-01 00:00:00']
+
+    def test_delete_expired_states(self):
+        self.state_store.set_state('test.source', 'test.dest', 'run_token:old', '2023-01-01 00:00:00')
+        self.state_store.set_state('test.source', 'test.dest', 'run_token:new', '2023-03-01 00:00:00')
+        self.state_store.set_state('test.source', 'test.dest', 'watermark', '2023-01-01 00:00:00')
+        self.client.query(
+            f"update `{self.state_store.state_table_name('test.dest')}` set updated_at = '2023-01-01 00:00:00' where state_key <> 'run_token:new'"
+        )
+
+        deleted = self.state_store.delete_expired_states('test.source', 'test.dest', 'run_token:', 30)
+
+        assert deleted == 1
+        assert self.state_store.get_state('test.source', 'test.dest', 'run_token:old') is None
+        assert self.state_store.get_state('test.source', 'test.dest', 'run_token:new') == '2023-03-01 00:00:00'
+        assert self.state_store.get_state('test.source', 'test.dest', 'watermark') == '2023-01-01 00:00:00'
@@ -0,0 +1,72 @@
+from lib.data.technicalkey.HashKeyAllocator import HashKeyAllocator
+import numpy
+import pandas
+
+
+class TestHashKeyAllocator():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.allocator = HashKeyAllocator()
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        pass
+
+    ### Tests
+
+    def test_assign_keys(self):
+        rows = pandas.DataFrame({
+            'PartnerID': [100, 101, 100, 100],
+            'Date_From': ['2022-01-01 00:00:00', '2022-01-01 00:00:00', '2022-02-01 00:00:00', '2022-02-01 00:00:00'],
+            'Version': [0, 0, 0, 1]
+        })
+
+        keys = self.allocator.assign_keys('test.dest_table', rows, 'PartnerID')
+
+        assert keys.dtype == 'int64'
+        assert (keys >= 0).all()
+        assert keys.is_unique
+        assert self.allocator.derived_keys
+
+    def test_same_version_of_another_run_gets_the_same_key(self):
+        rows = pandas.DataFrame({'PartnerID': [100], 'Date_From': ['2022-01-01 00:00:00'], 'Version': [0]})
+
+        keys = self.allocator.assign_keys('test.dest_table', rows, 'PartnerID')
+        other_keys = self.allocator.assign_keys('test.dest_table', rows, 'PartnerID')
+
+        assert keys.tolist() == other_keys.tolist()
+
+    def test_keys_of_ten_million_versions_are_unique(self):
+        # slow test (a few seconds): same number of rows as the benchmark
+        num_rows = 10_000_000
+        rows = pandas.DataFrame({
+            'PartnerID': numpy.arange(num_rows, dtype='int64') // 2,
+            'Date_From': pandas.Series(['2022-01-01 00:00:00'], dtype='category').repeat(num_rows).reset_index(drop=True),
+            'Version': numpy.arange(num_rows, dtype='int64') % 2
+        })
+
+        keys = self.allocator.assign_keys('test.dest_table', rows, 'PartnerID')
+
+        assert not keys.duplicated().any()
+
+    def test_key_expression(self):
+        expression = self.allocator.key_expression('test.dest_table', 'PartnerID', 'DATETIME(CURRENT_DATE())', count_rows=None, version_expression='versions.Version')
+
+        assert expression == (
+            "(FARM_FINGERPRINT(CAST(PartnerID AS STRING) || '|' || CAST(DATETIME(CURRENT_DATE()) AS STRING) || '|' || "
+            "CAST(versions.Version AS STRING)) & 0x7FFFFFFFFFFFFFFF)"
+        )
+        assert expression == self.allocator.key_expression('test.dest_table', 'PartnerID', 'DATETIME(CURRENT_DATE())', count_rows=None, version_expression='versions.Version')
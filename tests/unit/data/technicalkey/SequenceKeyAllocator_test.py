@@ -0,0 +1,63 @@
+from lib.data.technicalkey.SequenceKeyAllocator import SequenceKeyAllocator
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+import pandas
+
+
+class TestSequenceKeyAllocator():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.client = LocalConnector().get_client()
+        self.client.create_dataset('test')
+        self.client.query("""
+            create table `test.dest_table` (
+                TechnicalKey INT64 NOT NULL,
+                PartnerID INT64
+            );
+            insert into `test.dest_table` values (41, 100), (7, 101);
+        """)
+        self.allocator = SequenceKeyAllocator(self.client, 'test.scd2_sequences', block_size=10)
+        self.allocator.create_counter_table()
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        self.client.close()
+
+    ### Tests
+
+    def test_sequence_starts_after_max_key(self):
+        rows = pandas.DataFrame({'PartnerID': [102, 103, 104]}, index=[5, 6, 7])
+
+        keys = self.allocator.assign_keys('test.dest_table', rows, 'PartnerID')
+
+        assert keys.tolist() == [42, 43, 44]
+        assert keys.index.tolist() == [5, 6, 7]
+
+    def test_reserved_block_is_reused(self):
+        assert self.allocator.allocate('test.dest_table', 4) == 42
+        assert self.allocator.allocate('test.dest_table', 4) == 46
+        # one block of 10 keys reserved
+        assert list(self.client.query("select next_value from `test.scd2_sequences`").result()) == [(52,)]
+
+    def test_new_allocator_continues_sequence(self):
+        self.allocator.allocate('test.dest_table', 25)
+        other_allocator = SequenceKeyAllocator(self.client, 'test.scd2_sequences', block_size=10)
+
+        assert other_allocator.allocate('test.dest_table', 1) == 67
+
+    def test_key_expression(self):
+        expression = self.allocator.key_expression('test.dest_table', 'PartnerID', 'DATETIME(CURRENT_DATE())', lambda: 3)
+
+        assert expression == "(42 + ROW_NUMBER() OVER () - 1)"
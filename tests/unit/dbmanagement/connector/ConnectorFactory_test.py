@@ -0,0 +1,61 @@
+from lib.dbmanagement.connector.BigQueryConnector import BigQueryConnector
+from lib.dbmanagement.connector.ConnectorFactory import ConnectorFactory
+from lib.dbmanagement.connector.LocalClient import LocalClient
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.data.ingestor.DataIngestor import DataIngestor
+import pytest
+from unittest import mock
+
+
+class TestConnectorFactory():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        pass
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        pass
+
+    ### Tests
+
+    @mock.patch('google.cloud.bigquery.Client')
+    def test_create_bigquery_connector(self, mock_client):
+        connector = ConnectorFactory.create('bigquery', project_id='my-prj', location=None)
+
+        assert isinstance(connector, BigQueryConnector)
+        mock_client.assert_called_once_with(project='my-prj', location='europe-west6')
+
+    def test_create_local_connector(self, tmp_path):
+        connector = ConnectorFactory.create('local', database_dir=str(tmp_path))
+        client = connector.get_client()
+
+        client.create_dataset('transformation_scd2')
+        client.query("create table `transformation_scd2.src` (PartnerID INTEGER NOT NULL, Name STRING)")
+        client.query("insert into `transformation_scd2.src` values (1, 'Store A')")
+        client.query("""create table `transformation_scd2.dest` (
+            TechnicalKey INTEGER NOT NULL, PartnerID INTEGER NOT NULL, Name STRING,
+            Date_From DATETIME NOT NULL, Date_To DATETIME NOT NULL, Is_valid STRING NOT NULL)""")
+        result = DataIngestor(client).apply_changes('transformation_scd2.src', 'transformation_scd2.dest', 'PartnerID')
+        client.close()
+
+        assert isinstance(connector, LocalConnector)
+        assert isinstance(client, LocalClient)
+        assert result == {'rows_updated': 0, 'rows_inserted': 1}
+        assert list(tmp_path.iterdir())
+
+    def test_unknown_engine(self):
+        with pytest.raises(ValueError):
+            ConnectorFactory.create('postgres')
@@ -0,0 +1,87 @@
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.dbmanagement.transaction.BigqueryTransaction import BigqueryTransaction
+import pytest
+
+
+class TestLocalConnector():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.client = LocalConnector().get_client()
+        self.client.create_dataset('test')
+        self.client.query("""
+            create table `my-prj.test.dest_table` (
+                TechnicalKey INTEGER NOT NULL,
+                sample_id STRING,
+                name STRING,
+                Date_From DATETIME NOT NULL,
+                Date_To DATETIME NOT NULL,
+                Is_valid STRING NOT NULL
+            );
+            insert into `test.dest_table` values (1, '100', "test", '2022-01-01 00:00:00', '9999-01-01 00:00:00', 'yes');
+        """)
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        self.client.close()
+
+    ### Tests
+
+    def test_query_translates_bigquery_syntax(self):
+        query_job = self.client.query("""
+            select * except(TechnicalKey, Date_From, Date_To, Is_valid), DATE_SUB(DATE '2023-01-02', INTERVAL 1 DAY) as day # comment
+            from `test.dest_table`
+            where Is_valid = "yes"
+        """)
+
+        expected_result = [{'sample_id': '100', 'name': 'test', 'day': '2023-01-01'}]
+
+        assert query_job.to_dataframe().to_dict(orient='records') == expected_result
+
+    def test_query_translates_table_layout(self):
+        self.client.query("""
+            create or replace table `test.dest_table`
+            partition by DATETIME_TRUNC(Date_To, MONTH)
+            cluster by Is_valid, sample_id
+            as
+            select *, ROW_NUMBER() over (partition by Is_valid order by sample_id) as position
+            from `test.dest_table`;
+        """)
+
+        query_job = self.client.query("select sample_id, position from `test.dest_table`")
+
+        assert query_job.to_dataframe().to_dict(orient='records') == [{'sample_id': '100', 'position': 1}]
+
+    def test_query_returns_dml_affected_rows(self):
+        query_job = self.client.query("update `test.dest_table` set name = 'changed' where sample_id = '100'")
+
+        assert query_job.num_dml_affected_rows == 1
+
+    def test_rollback_transaction(self):
+        transaction = BigqueryTransaction(bigquery_connection=self.client)
+        job_config = transaction.begin_transaction()
+        self.client.query("create temp table `diff` as select sample_id from `test.dest_table`", job_config=job_config)
+        self.client.query("delete from `test.dest_table` where sample_id in (select sample_id from `diff`)", job_config=job_config)
+        transaction.rollback_transaction()
+
+        assert self.client.query("select count(*) as cnt from `test.dest_table`").to_dataframe()['cnt'][0] == 1
+
+    def test_query_on_aborted_session_raises_error(self):
+        transaction = BigqueryTransaction(bigquery_connection=self.client)
+        job_config = transaction.begin_transaction()
+        transaction.commit_transaction()
+
+        with pytest.raises(Exception):
+            self.client.query("select 1", job_config=job_config)
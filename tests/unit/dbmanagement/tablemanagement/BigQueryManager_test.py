@@ -0,0 +1,134 @@
+from datetime import date
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+from lib.dbmanagement.transaction.BigqueryTransaction import BigqueryTransaction
+import pandas as pd
+import pytest
+from unittest import mock
+
+
+class TestBigQueryManager():
+    SAMPLE_TABLE_ID = 'test.transaction_table'
+
+    SAMPLE_ROWS = pd.DataFrame({
+        'sample_id': ['100', '101', '102'],
+        'name': ["it's", None, 'back\\slash'],
+        'value': [0, 1, 2],
+        'Date_From': ['2023-01-01 00:00:00', '2023-01-02 00:00:00', '2023-01-03 00:00:00']
+    })
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.client = LocalConnector().get_client()
+        self.client.create_dataset('test')
+        self.client.create_dataset('staging')
+        self.client.query(f"create table `{TestBigQueryManager.SAMPLE_TABLE_ID}` (sample_id STRING, name STRING, value INT64, Date_From DATETIME)")
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        self.client.close()
+
+    def __read_table(self) -> list:
+        query_job = self.client.query(f"select * from `{TestBigQueryManager.SAMPLE_TABLE_ID}` order by sample_id")
+        return query_job.to_dataframe().astype(object).where(lambda df: df.notna(), None).to_dict(orient='records')
+
+    ### Tests
+
+    def test_to_sql_literal(self):
+        assert BigQueryManager.to_sql_literal(None) == 'NULL'
+        assert BigQueryManager.to_sql_literal(float('nan')) == 'NULL'
+        assert BigQueryManager.to_sql_literal("it's") == "'it\\'s'"
+        assert BigQueryManager.to_sql_literal(date(2023, 1, 1)) == "'2023-01-01'"
+        assert BigQueryManager.to_sql_literal([1, 2]) == '[1, 2]'
+        assert BigQueryManager.to_sql_literal({'Street': "it's", 'Zip': 8000}) == "STRUCT('it\\'s' AS Street, 8000 AS Zip)"
+        assert BigQueryManager.to_sql_literal([{'Tags': ['a'], 'Geo': {'Lat': 1.5}}]) == "[STRUCT(['a'] AS Tags, STRUCT(1.5 AS Lat) AS Geo)]"
+
+    @pytest.mark.parametrize('staging_threshold', [10000, 0])
+    def test_insert_records(self, staging_threshold):
+        bq_manager = BigQueryManager(self.client, staging_threshold=staging_threshold, staging_dataset='staging')
+        result = bq_manager.insert_records(TestBigQueryManager.SAMPLE_TABLE_ID, TestBigQueryManager.SAMPLE_ROWS)
+
+        assert result == 3
+        assert self.__read_table() == TestBigQueryManager.SAMPLE_ROWS.astype(object).where(TestBigQueryManager.SAMPLE_ROWS.notna(), None).to_dict(orient='records')
+
+    def test_insert_records_staged_rollback(self):
+        bq_manager = BigQueryManager(self.client, staging_threshold=0, staging_dataset='staging')
+        transaction = BigqueryTransaction(bigquery_connection=self.client)
+        job_config = transaction.begin_transaction()
+        bq_manager.insert_records(TestBigQueryManager.SAMPLE_TABLE_ID, TestBigQueryManager.SAMPLE_ROWS, job_config)
+        transaction.rollback_transaction()
+
+        assert self.__read_table() == []
+        # staging table is always deleted
+        assert self.client.query("select name from staging.sqlite_master").to_dataframe().empty
+
+    def test_create_and_migrate_scd2_table(self):
+        bq_manager = BigQueryManager(self.client)
+        self.client.query("create table `test.source_table` (sample_id STRING, name STRING, value INT64)")
+        bq_manager.create_scd2_table('test.scd2_table', 'test.source_table', 'sample_id', fingerprint_column='Row_Hash')
+        self.client.query("""
+            insert into `test.scd2_table` values (1, '100', 'a', 0, '2023-01-01 00:00:00', '9999-01-01 00:00:00', 'yes', 42)
+        """)
+
+        migrated = bq_manager.migrate_scd2_table('test.scd2_table', 'sample_id')
+        columns = [field.name for field in self.client.get_table('test.scd2_table').schema]
+        rows = self.client.query("select TechnicalKey, sample_id from `test.scd2_table`").to_dataframe()
+        tables = self.client.query("select name from test.sqlite_master where type = 'table' order by name").to_dataframe()
+
+        assert migrated
+        assert columns == ['TechnicalKey', 'sample_id', 'name', 'value', 'Date_From', 'Date_To', 'Is_valid', 'Row_Hash']
+        assert rows.to_dict(orient='list') == {'TechnicalKey': [1], 'sample_id': ['100']}
+        # the migrated copy is swapped in, the previous table is dropped
+        assert tables['name'].tolist() == ['scd2_table', 'source_table', 'transaction_table']
+
+    @mock.patch('google.cloud.bigquery.Client')
+    def test_migrate_scd2_table_layout(self, mock_bigquery):
+        bq_manager = BigQueryManager(mock_bigquery)
+        mock_bigquery.get_table.return_value = mock.Mock(time_partitioning=None, clustering_fields=None)
+
+        assert bq_manager.migrate_scd2_table('test.scd2_table', 'PartnerID')
+        migrate_stmt = mock_bigquery.query.call_args[0][0]
+        assert 'partition by DATETIME_TRUNC(Date_To, MONTH)' in migrate_stmt
+        assert 'cluster by Is_valid, PartnerID' in migrate_stmt
+        # a table cannot be replaced with a different partitioning spec
+        assert 'create or replace' not in migrate_stmt
+        assert 'create table `test.scd2_table__migrated`' in migrate_stmt
+        assert 'alter table `test.scd2_table__migrated` rename to `scd2_table`' in migrate_stmt
+
+        mock_bigquery.query.reset_mock()
+        mock_bigquery.get_table.return_value = mock.Mock(
+            time_partitioning=mock.Mock(field='Date_To', type_='MONTH'), clustering_fields=['Is_valid', 'PartnerID']
+        )
+
+        assert not bq_manager.migrate_scd2_table('test.scd2_table', 'PartnerID')
+        mock_bigquery.query.assert_not_called()
+
+    def test_update_records_joined_on_composite_key(self):
+        bq_manager = BigQueryManager(self.client)
+        bq_manager.insert_records(TestBigQueryManager.SAMPLE_TABLE_ID, TestBigQueryManager.SAMPLE_ROWS)
+        keys = [{'sample_id': '100', 'value': 0}, {'sample_id': '101', 'value': 2}, {'sample_id': '102', 'value': 2}]
+
+        result = bq_manager.update_records(
+            TestBigQueryManager.SAMPLE_TABLE_ID,
+            {'name': "'updated'"},
+            BigQueryManager.key_join(['sample_id', 'value'], 'dest', 'keys'),
+            query_parameters = [BigQueryManager.struct_array_parameter('keys', keys)],
+            join_relation = "unnest(@keys) as keys"
+        )
+
+        assert result == 2
+        assert [row['name'] for row in self.__read_table()] == ['updated', None, 'updated']
+        assert BigQueryManager.key_string('sample_id') == 'CAST(sample_id AS STRING)'
+        assert " || '|' || " in BigQueryManager.key_string(['sample_id', 'value'])
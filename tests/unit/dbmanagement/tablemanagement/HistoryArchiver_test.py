@@ -0,0 +1,109 @@
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.dbmanagement.tablemanagement.BigQueryManager import BigQueryManager
+from lib.dbmanagement.tablemanagement.HistoryArchiver import HistoryArchiver
+import pytest
+from unittest import mock
+
+
+class TestHistoryArchiver():
+    DEST_TABLE_ID = 'test.partners_output'
+    HISTORY_TABLE_ID = 'test.partners_output_history'
+
+    SETUP_STMT = """
+        create table `test.partners_output` (
+            TechnicalKey INT64 NOT NULL, PartnerID INT64 NOT NULL, Name STRING,
+            Date_From DATETIME NOT NULL, Date_To DATETIME NOT NULL, Is_valid STRING NOT NULL
+        );
+        insert into `test.partners_output` values
+            (1, 101, 'Store A', '2019-01-01 00:00:00', '2019-12-31 00:00:00', 'no'),
+            (2, 101, 'Store A2', '2020-01-01 00:00:00', '2020-12-31 00:00:00', 'no'),
+            (3, 101, 'Store A3', '2021-01-01 00:00:00', '9999-01-01 00:00:00', 'yes'),
+            (4, 102, 'Store B', '2019-01-01 00:00:00', '2020-12-31 00:00:00', 'no'),
+            (5, 103, 'Store C', '2019-01-01 00:00:00', DATETIME_SUB(CURRENT_DATETIME(), INTERVAL 1 DAY), 'no');
+    """
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.client = LocalConnector().get_client()
+        self.client.create_dataset('test')
+        self.client.query(TestHistoryArchiver.SETUP_STMT)
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        self.client.close()
+
+    def __technical_keys(self, table:str) -> list:
+        return self.client.query(f"select TechnicalKey from `{table}` order by TechnicalKey").to_dataframe()['TechnicalKey'].tolist()
+
+    ### Tests
+
+    def test_archive_moves_old_closed_versions(self):
+        archiver = HistoryArchiver(self.client, batch_size=1)
+        archiver.create_history_table(TestHistoryArchiver.DEST_TABLE_ID, 'PartnerID')
+
+        result = archiver.archive(TestHistoryArchiver.DEST_TABLE_ID, retention_days=30)
+        # a second run has nothing left to move
+        rerun_result = archiver.archive(TestHistoryArchiver.DEST_TABLE_ID, retention_days=30)
+
+        # versions closed on the same day are moved in the same batch
+        assert result == {'rows_archived': 3, 'batches': 2}
+        assert rerun_result == {'rows_archived': 0, 'batches': 0}
+        assert self.__technical_keys(TestHistoryArchiver.DEST_TABLE_ID) == [3, 5]
+        assert self.__technical_keys(TestHistoryArchiver.HISTORY_TABLE_ID) == [1, 2, 4]
+
+    def test_failed_batch_is_rolled_back(self):
+        archiver = HistoryArchiver(self.client)
+        archiver.create_history_table(TestHistoryArchiver.DEST_TABLE_ID, 'PartnerID')
+        run_query = BigQueryManager.run_query
+
+        def fail_on_delete(bigquery_manager, query, *args, **kwargs):
+            if query.startswith('delete'):
+                raise Exception('delete failed')
+            return run_query(bigquery_manager, query, *args, **kwargs)
+
+        with mock.patch.object(BigQueryManager, 'run_query', fail_on_delete):
+            with pytest.raises(Exception):
+                archiver.archive(TestHistoryArchiver.DEST_TABLE_ID, retention_days=30)
+
+        assert self.__technical_keys(TestHistoryArchiver.DEST_TABLE_ID) == [1, 2, 3, 4, 5]
+        assert self.__technical_keys(TestHistoryArchiver.HISTORY_TABLE_ID) == []
+
+    def test_unified_view_returns_every_version(self):
+        archiver = HistoryArchiver(self.client)
+        archiver.create_history_table(TestHistoryArchiver.DEST_TABLE_ID, 'PartnerID')
+        archiver.create_unified_view(TestHistoryArchiver.DEST_TABLE_ID, 'test.partners_output_all')
+        archiver.archive(TestHistoryArchiver.DEST_TABLE_ID, retention_days=30)
+
+        assert self.__technical_keys('test.partners_output_all') == [1, 2, 3, 4, 5]
+
+    def test_recently_closed_versions_are_kept(self):
+        # versions closed today, yesterday and two days ago end the day before
+        self.client.query(f"""
+            insert into `{TestHistoryArchiver.DEST_TABLE_ID}` values
+                (6, 104, 'Store D', '2019-01-01 00:00:00', DATETIME(DATE_SUB(CURRENT_DATE(), INTERVAL 1 DAY)), 'no'),
+                (7, 105, 'Store E', '2019-01-01 00:00:00', DATETIME(DATE_SUB(CURRENT_DATE(), INTERVAL 2 DAY)), 'no'),
+                (8, 106, 'Store F', '2019-01-01 00:00:00', DATETIME(DATE_SUB(CURRENT_DATE(), INTERVAL 3 DAY)), 'no');
+        """)
+        archiver = HistoryArchiver(self.client)
+        archiver.create_history_table(TestHistoryArchiver.DEST_TABLE_ID, 'PartnerID')
+
+        archiver.archive(TestHistoryArchiver.DEST_TABLE_ID, retention_days=1)
+
+        assert self.__technical_keys(TestHistoryArchiver.DEST_TABLE_ID) == [3, 5, 6, 7]
+        assert self.__technical_keys(TestHistoryArchiver.HISTORY_TABLE_ID) == [1, 2, 4, 8]
+
+    def test_archive_requires_retention(self):
+        with pytest.raises(ValueError):
+            HistoryArchiver(self.client).archive(TestHistoryArchiver.DEST_TABLE_ID, retention_days=0)
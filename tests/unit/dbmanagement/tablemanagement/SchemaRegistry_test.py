@@ -0,0 +1,102 @@
+from google.cloud.bigquery import SchemaField
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.dbmanagement.tablemanagement.SchemaRegistry import SchemaRegistry
+import pytest
+from unittest import mock
+
+
+class TestSchemaRegistry():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.client = LocalConnector().get_client()
+        self.client.create_dataset('test')
+        self.client.query("""
+            create table `test.source` (PartnerID INT64 NOT NULL, Name STRING, Canton STRING);
+            create table `test.destination` (
+                TechnicalKey INT64 NOT NULL, PartnerID INT64 NOT NULL, Canton STRING, Name STRING,
+                Date_From DATETIME NOT NULL, Date_To DATETIME NOT NULL, Is_valid STRING NOT NULL
+            );
+        """)
+        self.get_table = mock.Mock(wraps=self.client.get_table)
+        self.client.get_table = self.get_table
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        self.client.close()
+
+    ### Tests
+
+    def test_columns_are_cached(self):
+        registry = SchemaRegistry(self.client, ttl=60)
+
+        assert registry.get_columns('test.source') == ['PartnerID', 'Name', 'Canton']
+        assert registry.get_column_types('test.source') == {'PartnerID': 'INT64', 'Name': 'STRING', 'Canton': 'STRING'}
+        assert self.get_table.call_count == 1
+
+        registry.invalidate('test.source')
+        registry.get_columns('test.source')
+        assert self.get_table.call_count == 2
+
+    def test_expired_entry_is_refreshed(self):
+        registry = SchemaRegistry(self.client, ttl=0)
+        registry.get_columns('test.source')
+        self.client.query("alter table `test.source` add column Region STRING")
+
+        assert registry.get_columns('test.source') == ['PartnerID', 'Name', 'Canton', 'Region']
+        assert self.get_table.call_count == 2
+
+    def test_check_compatibility(self):
+        registry = SchemaRegistry(self.client, ttl=60)
+
+        # business columns in another order are compatible, the compatibility is cached
+        assert registry.check_compatibility('test.source', 'test.destination') == ['PartnerID', 'Name', 'Canton']
+        assert registry.check_compatibility('test.source', 'test.destination') == ['PartnerID', 'Name', 'Canton']
+        assert self.get_table.call_count == 2
+
+    def test_schema_drift(self):
+        self.client.query("""
+            alter table `test.source` add column Region STRING;
+            alter table `test.destination` add column Phone STRING;
+        """)
+        registry = SchemaRegistry(self.client, ttl=60)
+
+        with pytest.raises(ValueError) as error:
+            registry.check_compatibility('test.source', 'test.destination', fingerprint_column='Row_Hash')
+
+        assert 'missing tech column Row_Hash' in str(error.value)
+        assert 'column Region missing in destination' in str(error.value)
+        assert 'column Phone missing in source' in str(error.value)
+
+    def test_nested_columns_are_listed_and_compared(self):
+        address = lambda zip_type: SchemaField('Address', 'RECORD', fields=[SchemaField('Street', 'STRING'), SchemaField('Zip', zip_type)])
+        source_schema = [SchemaField('PartnerID', 'INTEGER'), SchemaField('Phones', 'STRING', mode='REPEATED'), address('INTEGER')]
+        tech_schema = [SchemaField(column, 'INTEGER') for column in SchemaRegistry.TECH_COLUMNS]
+        client = mock.Mock()
+        client.get_table.side_effect = lambda table: mock.Mock(etag=None, schema={
+            'test.source': source_schema,
+            'test.destination': source_schema + tech_schema,
+            'test.drifted_destination': source_schema[:2] + [address('STRING')] + tech_schema
+        }[table])
+        registry = SchemaRegistry(client, ttl=60)
+
+        assert registry.get_column_types('test.source') == {
+            'PartnerID': 'INT64', 'Phones': 'ARRAY<STRING>', 'Address': 'STRUCT<Street STRING, Zip INT64>'
+        }
+        assert registry.check_compatibility('test.source', 'test.destination') == ['PartnerID', 'Phones', 'Address']
+        with pytest.raises(ValueError) as error:
+            registry.check_compatibility('test.source', 'test.drifted_destination')
+
+        assert 'column Address is STRUCT<Street STRING, Zip INT64> in source and STRUCT<Street STRING, Zip STRING> in destination' in str(error.value)
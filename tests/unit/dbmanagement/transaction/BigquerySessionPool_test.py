@@ -0,0 +1,112 @@
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.dbmanagement.transaction.BigquerySessionPool import BigquerySessionPool
+from lib.dbmanagement.transaction.BigqueryTransaction import BigqueryTransaction
+import pytest
+
+
+class TestBigquerySessionPool():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.client = LocalConnector().get_client()
+        self.client.create_dataset('test')
+        self.client.query("create table `test.pool_table` (id INT64)")
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        self.client.close()
+
+    ### Tests
+
+    def test_transactions_reuse_warm_session(self):
+        pool = BigquerySessionPool(self.client, size=1)
+        pool.warm_up()
+        session_ids = []
+
+        for _ in range(3):
+            transaction = BigqueryTransaction(bigquery_connection=self.client, session_pool=pool)
+            job_config = transaction.begin_transaction()
+            session_ids.append(job_config.connection_properties[0].value)
+            self.client.query("insert into `test.pool_table` values (1)", job_config=job_config)
+            transaction.commit_transaction()
+
+        rows = list(self.client.query("select count(*) from `test.pool_table`").result())[0][0]
+        pool.close()
+
+        assert len(set(session_ids)) == 1
+        assert rows == 3
+
+    def test_idle_session_is_evicted(self):
+        pool = BigquerySessionPool(self.client, size=1, idle_ttl=0)
+        pool.warm_up()
+        idle_session, idle_job_config = pool.acquire()
+        pool.release(idle_session, idle_job_config)
+
+        _, job_config = pool.acquire()
+        pool.close()
+
+        assert job_config.connection_properties[0].value != idle_job_config.connection_properties[0].value
+        with pytest.raises(ValueError):
+            self.client.query("select 1", job_config=idle_job_config)
+
+    def test_unhealthy_session_is_replaced(self):
+        pool = BigquerySessionPool(self.client, size=1, health_check_after=0)
+        pool.warm_up()
+        session, dead_job_config = pool.acquire()
+        # the session is aborted outside the pool
+        self.client.query("CALL BQ.ABORT_SESSION();", job_config=dead_job_config)
+        pool.release(session, dead_job_config)
+
+        _, job_config = pool.acquire()
+        result = list(self.client.query("select 1", job_config=job_config).result())
+        pool.close()
+
+        assert job_config.connection_properties[0].value != dead_job_config.connection_properties[0].value
+        assert result == [(1,)]
+
+    def test_rolled_back_session_is_recycled(self):
+        pool = BigquerySessionPool(self.client, size=1)
+        transaction = BigqueryTransaction(bigquery_connection=self.client, session_pool=pool)
+        job_config = transaction.begin_transaction()
+        self.client.query("insert into `test.pool_table` values (1)", job_config=job_config)
+        transaction.rollback_transaction()
+
+        _, recycled_job_config = pool.acquire()
+        rows = list(self.client.query("select count(*) from `test.pool_table`", job_config=recycled_job_config).result())[0][0]
+        pool.close()
+
+        assert recycled_job_config.connection_properties[0].value == job_config.connection_properties[0].value
+        assert rows == 0
+
+    def test_failed_run_session_is_aborted(self):
+        pool = BigquerySessionPool(self.client, size=1)
+        transaction = BigqueryTransaction(bigquery_connection=self.client, session_pool=pool)
+        job_configs = []
+
+        def unit_of_work(job_config):
+            job_configs.append(job_config)
+            # the session temp table of the failed work is not dropped by the rollback
+            self.client.query("create temp table scd2_diff (id INT64)", job_config=job_config)
+            raise RuntimeError('unit of work failed')
+
+        with pytest.raises(RuntimeError):
+            transaction.run(unit_of_work)
+
+        _, job_config = pool.acquire()
+        pool.close()
+
+        assert job_config.connection_properties[0].value != job_configs[0].connection_properties[0].value
+        with pytest.raises(ValueError):
+            self.client.query("select 1", job_config=job_configs[0])
@@ -0,0 +1,82 @@
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.dbmanagement.transaction.BigqueryTransaction import BigqueryTransaction
+from lib.dbmanagement.transaction.RetryPolicy import RetryPolicy
+from unittest import mock
+import pytest
+
+
+class TestBigqueryTransaction():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.client = LocalConnector().get_client()
+        self.client.create_dataset('test')
+        self.client.query("create table `test.transaction_table` (id INT64)")
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        self.client.close()
+
+    ### Tests
+
+    def test_run_retries_the_whole_unit_of_work(self):
+        attempts = []
+
+        def unit_of_work(job_config):
+            attempts.append(job_config)
+            self.client.query(f"insert into `test.transaction_table` values ({len(attempts)})", job_config=job_config).result()
+            if len(attempts) < 3:
+                raise Exception('Transaction is aborted due to concurrent update against table test.transaction_table')
+            return len(attempts)
+
+        retries = []
+        transaction = BigqueryTransaction(bigquery_connection=self.client, retry_policy=RetryPolicy(initial_delay=0))
+        result = transaction.run(unit_of_work, on_retry=lambda attempt, error: retries.append(attempt))
+
+        rows = self.client.query("select id from `test.transaction_table`").to_dataframe()
+
+        assert result == 3
+        assert retries == [1, 2]
+        # the inserts of the aborted attempts are rolled back
+        assert rows['id'].tolist() == [3]
+
+    def test_run_does_not_retry_other_errors(self):
+        unit_of_work = mock.MagicMock(side_effect=ValueError('invalid column'))
+        transaction = BigqueryTransaction(bigquery_connection=self.client, retry_policy=RetryPolicy(initial_delay=0))
+
+        with pytest.raises(ValueError):
+            transaction.run(unit_of_work)
+
+        assert unit_of_work.call_count == 1
+
+    def test_run_stops_after_max_attempts(self):
+        unit_of_work = mock.MagicMock(side_effect=Exception('Could not serialize access to table test.transaction_table'))
+        transaction = BigqueryTransaction(bigquery_connection=self.client, retry_policy=RetryPolicy(max_attempts=2, initial_delay=0))
+
+        with pytest.raises(Exception):
+            transaction.run(unit_of_work)
+
+        assert unit_of_work.call_count == 2
+
+    def test_retry_delay_grows_with_jitter(self):
+        retry_policy = RetryPolicy(initial_delay=1, max_delay=5, multiplier=2, jitter=0.5)
+
+        delays = [retry_policy.delay(attempt) for attempt in (1, 2, 3, 4)]
+
+        assert 0.5 <= delays[0] <= 1
+        assert 1 <= delays[1] <= 2
+        assert 2 <= delays[2] <= 4
+        # capped by max_delay
+        assert 2.5 <= delays[3] <= 5
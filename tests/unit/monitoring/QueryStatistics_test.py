@@ -0,0 +1,92 @@
+from lib.monitoring.MetricsRegistry import MetricsRegistry
+from lib.monitoring.QueryStatistics import QueryStatistics, RunReport
+from datetime import datetime
+from unittest import mock
+
+
+class TestQueryStatistics():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        QueryStatistics.REGISTRY.reset()
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        QueryStatistics.REGISTRY.reset()
+
+    def __query_job(self, query:str, **statistics):
+        return mock.Mock(
+            job_id = 'job_1',
+            query = query,
+            statement_type = statistics.get('statement_type'),
+            created = datetime(2023, 1, 1, 0, 0, 0),
+            started = datetime(2023, 1, 1, 0, 0, 1),
+            ended = datetime(2023, 1, 1, 0, 0, 3),
+            total_bytes_processed = statistics.get('bytes_processed', 100),
+            total_bytes_billed = statistics.get('bytes_billed', 10485760),
+            slot_millis = statistics.get('slot_ms', 2000),
+            cache_hit = statistics.get('cache_hit', False),
+            num_dml_affected_rows = statistics.get('dml_affected_rows')
+        )
+
+    ### Tests
+
+    def test_from_job(self):
+        statement = QueryStatistics.from_job(self.__query_job("update `t` set x = 1 where true", dml_affected_rows=3), 2.5)
+
+        assert statement == {
+            'job_id': 'job_1',
+            'statement_type': 'UPDATE',
+            'wall_ms': 2500,
+            'queue_ms': 1000,
+            'execution_ms': 2000,
+            'bytes_processed': 100,
+            'bytes_billed': 10485760,
+            'slot_ms': 2000,
+            'cache_hit': False,
+            'dml_affected_rows': 3,
+        }
+
+    def test_run_report_aggregates_statements(self):
+        with RunReport('src', 'dest') as report:
+            QueryStatistics.record(self.__query_job("BEGIN TRANSACTION;"), 0.1)
+            QueryStatistics.record(self.__query_job("select 1", statement_type='SELECT', cache_hit=True), 0.2)
+            QueryStatistics.record(self.__query_job("insert into `t` values (1)", dml_affected_rows=1), 0.3)
+        # outside the report
+        QueryStatistics.record(self.__query_job("select 2", statement_type='SELECT'), 0.2)
+
+        summary = report.summary()
+
+        assert summary['status'] == 'succeeded'
+        assert summary['totals']['statements'] == 3
+        assert summary['totals']['bytes_processed'] == 300
+        assert summary['totals']['cache_hits'] == 1
+        assert summary['totals']['dml_affected_rows'] == 1
+        assert sorted(summary['by_statement_type']) == ['BEGIN', 'INSERT', 'SELECT']
+        assert QueryStatistics.REGISTRY.get('scd2_statements_total', {'statement_type': 'SELECT'}) == 2
+        assert QueryStatistics.REGISTRY.get('scd2_runs_total', {'destination_table': 'dest', 'status': 'succeeded'}) == 1
+
+    def test_metrics_registry_render(self):
+        registry = MetricsRegistry()
+        registry.describe('scd2_statements_total', 'Statements issued by the lib')
+        registry.increment('scd2_statements_total', 2, {'statement_type': 'SELECT'})
+        registry.increment('scd2_statements_total', 1, {'statement_type': 'UPDATE'})
+
+        assert registry.render() == (
+            '# HELP scd2_statements_total Statements issued by the lib\n'
+            '# TYPE scd2_statements_total counter\n'
+            'scd2_statements_total{statement_type="SELECT"} 2\n'
+            'scd2_statements_total{statement_type="UPDATE"} 1\n'
+        )
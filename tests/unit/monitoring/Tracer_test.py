@@ -0,0 +1,126 @@
+from lib.monitoring.Tracer import InMemorySpanExporter, JsonLinesSpanExporter, Tracer
+import json
+import threading
+import time
+import pytest
+
+
+class TestTracer():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.exporter = InMemorySpanExporter()
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        Tracer.disable()
+
+    ### Tests
+
+    def test_disabled_tracer_returns_noop_span(self):
+        with Tracer.span('compare_tables', source_table='src') as span:
+            span.set(rows=10)
+
+        assert span is Tracer.NOOP_SPAN
+        assert not Tracer.is_enabled()
+
+    def test_disabled_tracer_overhead_is_negligible(self):
+        start = time.perf_counter()
+        for _ in range(100000):
+            with Tracer.span('statement') as span:
+                span.set(rows=1)
+        assert time.perf_counter() - start < 1
+
+    def test_nested_spans(self):
+        Tracer.configure(self.exporter)
+
+        with Tracer.span('ingest_data', source_table='src') as root:
+            with Tracer.span('compare_tables') as child:
+                child.set(rows=3, bytes=128)
+
+        child_span, root_span = self.exporter.spans
+
+        assert root_span['name'] == 'ingest_data' and root_span['parent_id'] is None
+        assert child_span['parent_id'] == root_span['span_id']
+        assert child_span['trace_id'] == root_span['trace_id'] == root.trace_id
+        assert child_span['attributes'] == {'rows': 3, 'bytes': 128}
+        assert root_span['start_time'] <= child_span['start_time'] <= child_span['end_time'] <= root_span['end_time']
+        assert root_span['peak_memory_bytes'] is None
+
+    def test_span_records_error(self):
+        Tracer.configure(self.exporter)
+
+        with pytest.raises(ValueError):
+            with Tracer.span('insert'):
+                raise ValueError('boom')
+
+        assert self.exporter.spans[0]['error'] == "ValueError('boom')"
+
+    def test_span_records_peak_memory(self):
+        Tracer.configure(self.exporter, trace_memory=True)
+
+        with Tracer.span('ingest_data'):
+            with Tracer.span('to_dataframe'):
+                data = bytearray(10 * 1024 * 1024)
+                del data
+            with Tracer.span('insert'):
+                pass
+
+        insert_span, to_dataframe_span = self.exporter.spans[1], self.exporter.spans[0]
+        root_span = self.exporter.spans[2]
+
+        assert to_dataframe_span['peak_memory_bytes'] >= 10 * 1024 * 1024
+        assert insert_span['peak_memory_bytes'] < 1024 * 1024
+        # the peak of a child span is also a peak of its parent
+        assert root_span['peak_memory_bytes'] >= 10 * 1024 * 1024
+
+    def test_overlapping_spans_of_other_threads_have_no_peak_memory(self):
+        Tracer.configure(self.exporter, trace_memory=True)
+        started, release = threading.Event(), threading.Event()
+
+        def run():
+            with Tracer.span('other_run'):
+                started.set()
+                release.wait(5)
+
+        with Tracer.span('ingest_data'):
+            thread = threading.Thread(target = run)
+            thread.start()
+            started.wait(5)
+            release.set()
+            thread.join()
+        with Tracer.span('insert'):
+            pass
+
+        spans = {span['name']: span for span in self.exporter.spans}
+
+        # the process-wide peak cannot be split between overlapping spans
+        assert spans['ingest_data']['peak_memory_bytes'] is None
+        assert spans['other_run']['peak_memory_bytes'] is None
+        assert spans['insert']['peak_memory_bytes'] is not None
+
+    def test_json_lines_exporter(self, tmp_path):
+        path = tmp_path / 'spans.jsonl'
+        Tracer.configure(JsonLinesSpanExporter(str(path)))
+
+        with Tracer.span('commit'):
+            pass
+        with Tracer.span('commit'):
+            pass
+
+        spans = [json.loads(line) for line in path.read_text().splitlines()]
+
+        assert [span['name'] for span in spans] == ['commit', 'commit']
+        assert spans[0]['trace_id'] != spans[1]['trace_id']
@@ -0,0 +1,148 @@
+from lib.runner.IngestionRunner import IngestionRunner
+import threading
+import time
+import pytest
+from unittest import mock
+
+
+class TestIngestionRunner():
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        self.release = threading.Event()
+        self.ingestor = mock.Mock()
+        self.ingestor.ingest_data.side_effect = self.__ingest_data
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        self.release.set()
+
+    def __ingest_data(self, source_table, destination_table, pkey, progress = None):
+        report = mock.Mock(phase = 'comparing', counts = {'rows_compared': 3}, status = None)
+        progress(report)
+        self.release.wait(5)
+        if source_table == 'broken':
+            raise Exception('table not found')
+        report.phase, report.status = 'succeeded', 'succeeded'
+        report.summary.return_value = {'totals': {'statements': 7}}
+        progress(report)
+        return 0
+
+    ### Tests
+
+    def test_submit_returns_before_run_ends(self):
+        runner = IngestionRunner(self.ingestor, max_workers = 1)
+        run_id = runner.submit('src', 'dest', 'id')
+
+        time.sleep(0.1)
+        running = runner.get_run(run_id)
+        self.release.set()
+        finished = runner.wait(run_id, timeout = 5)
+        runner.shutdown()
+
+        assert (running['status'], running['phase'], running['counts']) == ('running', 'comparing', {'rows_compared': 3})
+        assert (finished['status'], finished['phase'], finished['error']) == ('succeeded', 'succeeded', None)
+        assert finished['report'] == {'statements': 7}
+
+    def test_failed_run_reports_error(self):
+        runner = IngestionRunner(self.ingestor)
+        self.release.set()
+        run = runner.wait(runner.submit('broken', 'dest', 'id'), timeout = 5)
+        runner.shutdown()
+
+        assert run['status'] == 'failed'
+        assert run['error'] == 'table not found'
+
+    def test_submit_is_bounded(self):
+        runner = IngestionRunner(self.ingestor, max_workers = 1, max_pending = 1)
+        runner.submit('src', 'dest', 'id')
+        runner.submit('src', 'dest', 'id')
+
+        with pytest.raises(RuntimeError):
+            runner.submit('src', 'dest', 'id')
+
+        self.release.set()
+        runner.shutdown()
+
+    def test_finished_runs_expire(self):
+        runner = IngestionRunner(self.ingestor, result_ttl = 0)
+        self.release.set()
+        run_id = runner.submit('src', 'dest', 'id')
+        runner.wait(run_id, timeout = 5)
+        time.sleep(0.01)
+        runner.shutdown()
+
+        assert runner.get_run(run_id) is None
+
+    def test_triggers_are_coalesced_in_queued_run(self):
+        runner = IngestionRunner(self.ingestor, coalesce_window = 0.2)
+        self.release.set()
+        run_ids = [runner.submit('src', 'dest', 'id') for _ in range(3)]
+        other_run_id = runner.submit('src', 'dest', 'other_id')
+        run = runner.wait(run_ids[0], timeout = 5)
+        runner.wait(other_run_id, timeout = 5)
+        # a trigger after the start of the run gets a new run
+        late_run_id = runner.submit('src', 'dest', 'id')
+        runner.wait(late_run_id, timeout = 5)
+        runner.shutdown()
+
+        assert len(set(run_ids)) == 1
+        assert other_run_id != run_ids[0] and late_run_id != run_ids[0]
+        assert (run['status'], run['triggers']) == ('succeeded', 3)
+        assert self.ingestor.ingest_data.call_count == 3
+
+    def test_concurrent_triggers_are_coalesced(self):
+        runner = IngestionRunner(self.ingestor, coalesce_window = 0.5)
+        self.release.set()
+        barrier, run_ids = threading.Barrier(8), []
+
+        def trigger():
+            barrier.wait()
+            run_ids.append(runner.submit('src', 'dest', 'id'))
+
+        threads = [threading.Thread(target = trigger) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        run = runner.wait(run_ids[0], timeout = 5)
+        runner.shutdown()
+
+        assert len(set(run_ids)) == 1
+        assert run['triggers'] == 8
+        assert self.ingestor.ingest_data.call_count == 1
+
+    def test_runs_are_serialized_per_destination(self):
+        running, overlaps, lock = set(), [], threading.Lock()
+
+        def ingest_data(source_table, destination_table, pkey, progress = None):
+            with lock:
+                overlaps.extend((destination_table, other) for other in running)
+                running.add(destination_table)
+            time.sleep(0.1)
+            with lock:
+                running.discard(destination_table)
+            return 0
+
+        self.ingestor.ingest_data.side_effect = ingest_data
+        runner = IngestionRunner(self.ingestor, max_workers = 4)
+        run_ids = [runner.submit(f'src_{i}', 'dest_1', 'id') for i in range(3)] + [runner.submit('src', 'dest_2', 'id')]
+        runs = [runner.wait(run_id, timeout = 5) for run_id in run_ids]
+        runner.shutdown()
+
+        assert all(run['status'] == 'succeeded' for run in runs)
+        # dest_2 runs beside dest_1, the dest_1 runs never overlap
+        assert ('dest_1', 'dest_1') not in overlaps
+        assert ('dest_2', 'dest_1') in overlaps or ('dest_1', 'dest_2') in overlaps
@@ -0,0 +1,110 @@
+from lib.data.ingestor.DataIngestor import DataIngestor
+from lib.dbmanagement.connector.LocalConnector import LocalConnector
+from lib.runner.ManifestRunner import ManifestRunner
+import json
+import time
+import pytest
+from unittest import mock
+
+
+class TestManifestRunner():
+
+    MANIFEST = {
+        'concurrency': 3,
+        'tables': [
+            {'src_table': 'dataset.src_1', 'dest_table': 'dataset.dest_1', 'pkey': 'id'},
+            {'src_table': 'dataset.src_2', 'dest_table': 'dataset.dest_2', 'pkey': 'id'},
+            {'src_table': 'dataset.src_3', 'dest_table': 'dataset.dest_3', 'pkey': 'id', 'operation': 'apply_changes'},
+        ]
+    }
+
+  ### Class setup/teardown
+
+    @classmethod
+    def setup_class (cls):
+        pass
+
+    @classmethod
+    def teardown_class (cls):
+        """ setup_class is invoked after class tests execution """
+        pass
+
+    ### Method setup/teardown
+    def setup_method (self):
+        """ setup_method is invoked before every test method """
+        pass
+
+    def teardown_method(self):
+        """ teardown is invoked after every test method """
+        pass
+
+    ### Tests
+
+    def test_run_executes_pairs_concurrently(self):
+        ingestor = mock.Mock()
+        ingestor.ingest_data.side_effect = lambda *args, **kwargs: time.sleep(0.3)
+        ingestor.apply_changes.side_effect = lambda *args, **kwargs: time.sleep(0.3)
+
+        report = ManifestRunner(ingestor).run(TestManifestRunner.MANIFEST)
+
+        assert report['status'] == 'succeeded'
+        assert (report['succeeded'], report['failed']) == (3, 0)
+        # the pairs run concurrently: the wall time approaches the slowest pair
+        assert report['wall_ms'] < 800
+        assert [table['operation'] for table in report['tables']] == ['ingest_data', 'ingest_data', 'apply_changes']
+        assert all(table['wall_ms'] >= 300 for table in report['tables'])
+
+    def test_run_reports_failed_pairs(self):
+        ingestor = mock.Mock()
+        ingestor.ingest_data.side_effect = lambda source_table, *args, **kwargs: 1 / (source_table != 'dataset.src_2')
+
+        report = ManifestRunner(ingestor).run({'tables': TestManifestRunner.MANIFEST['tables'][:2]})
+
+        assert report['status'] == 'failed'
+        assert (report['succeeded'], report['failed']) == (1, 1)
+        assert report['tables'][1]['error'] == 'division by zero'
+
+    def test_invalid_manifest(self):
+        with pytest.raises(ValueError):
+            ManifestRunner(mock.Mock()).run({'tables': [{'src_table': 'dataset.src_1', 'dest_table': 'dataset.dest_1'}]})
+
+    def test_load_manifest(self, tmp_path):
+        (tmp_path / 'manifest.json').write_text(json.dumps(TestManifestRunner.MANIFEST))
+        (tmp_path / 'manifest.yaml').write_text(
+            "concurrency: 3\n"
+            "tables:\n"
+            "  - {src_table: dataset.src_1, dest_table: dataset.dest_1, pkey: id}\n"
+            "  - {src_table: dataset.src_2, dest_table: dataset.dest_2, pkey: id}\n"
+            "  - {src_table: dataset.src_3, dest_table: dataset.dest_3, pkey: id, operation: apply_changes}\n"
+        )
+
+        assert ManifestRunner.load_manifest(str(tmp_path / 'manifest.json')) == TestManifestRunner.MANIFEST
+        assert ManifestRunner.load_manifest(str(tmp_path / 'manifest.yaml')) == TestManifestRunner.MANIFEST
+
+    def test_load_yaml_manifest_without_pyyaml(self, tmp_path):
+        (tmp_path / 'manifest.yaml').write_text('tables: []')
+
+        with mock.patch.dict('sys.modules', {'yaml': None}):
+            with pytest.raises(ValueError, match='PyYAML'):
+                ManifestRunner.load_manifest(str(tmp_path / 'manifest.yaml'))
+
+    def test_run_on_local_client(self):
+        client = LocalConnector().get_client()
+        manifest = {'tables': []}
+        for dataset in ('dataset_1', 'dataset_2'):
+            client.create_dataset(dataset)
+            client.query(f"""
+                create table `{dataset}.src` (id INT64, name STRING);
+                create table `{dataset}.dest` (
+                    TechnicalKey INT64, id INT64, name STRING, Date_From DATETIME, Date_To DATETIME, Is_valid STRING
+                );
+                insert into `{dataset}.src` values (1, 'a'), (2, 'b');
+            """)
+            manifest['tables'].append({'src_table': f'{dataset}.src', 'dest_table': f'{dataset}.dest', 'pkey': 'id'})
+
+        report = ManifestRunner(DataIngestor(client)).run(manifest)
+        rows = [list(client.query(f"select count(*) from `{dataset}.dest`").result())[0][0] for dataset in ('dataset_1', 'dataset_2')]
+        client.close()
+
+        assert report['status'] == 'succeeded'
+        assert rows == [2, 2]